@@ -0,0 +1,158 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+from collections import namedtuple
+
+import numpy as np
+
+# lengths of the timesteps: one month, 4 steps a month (days 1-7, 8-14, 15-21 and 22 to the end of the month) or
+# one day, the steps never overlap two months
+frequencies = ['monthly', 'weekly', 'daily']
+
+# columns of Calendar.table (see engines.kernel)
+MONTH = 0
+MONTH_INDEX = 1
+FRACTION = 2
+DURATION = 3
+FIRST = 4
+calendar_columns = ['month', 'month_index', 'fraction', 'duration', 'first']
+
+# timestep of a calendar: month of the year (0: January), months since the start, share of the month, duration in
+# months of 30 days (1 for the monthly steps) and first step of the month
+Timestep = namedtuple('Timestep', calendar_columns)
+
+
+class Calendar(object):
+    """
+    Time axis of a simulation over a number of months from January of the start year
+    The forcing and the constants of the model are monthly volumes [hm3/month]: a timestep takes the share of its
+    month (fraction = days of the step / days of the month), the pumping capacity of Israel (a flow rate) the
+    duration of the step in months of 30 days
+    """
+
+    def __init__(self, months, frequency='monthly', start=1983):
+        if frequency not in frequencies:
+            raise ValueError("Unknown frequency %s (%s)" % (frequency, ', '.join(frequencies)))
+        self.months = int(months)
+        self.frequency = frequency
+        self.start = start
+        first_days = (np.datetime64('%d-01' % start, 'M') + np.arange(self.months + 1)).astype('datetime64[D]')
+        days_in_month = np.diff(first_days).astype(int)
+        if frequency == 'monthly':
+            self.month_index = np.arange(self.months)
+            offset = np.zeros(self.months, dtype=int)
+            self.days = days_in_month
+        elif frequency == 'weekly':
+            self.month_index = np.repeat(np.arange(self.months), 4)
+            offset = np.tile([0, 7, 14, 21], self.months)
+            self.days = np.where(offset == 21, days_in_month[self.month_index] - 21, 7)
+        else:
+            self.month_index = np.repeat(np.arange(self.months), days_in_month)
+            offset = np.arange(len(self.month_index)) - np.repeat(np.cumsum(days_in_month) - days_in_month,
+                                                                  days_in_month)
+            self.days = np.ones(len(self.month_index), dtype=int)
+        self.dates = first_days[self.month_index] + offset  # first day of each timestep
+        self.month = self.month_index % 12
+        self.first = offset == 0
+        self.fraction = self.days / days_in_month[self.month_index]
+        if frequency == 'monthly':
+            self.duration = np.ones(self.months)
+        else:
+            self.duration = self.days / 30.
+        self.steps_per_month = len(self.month_index) / float(max(self.months, 1))
+        self.steps_per_year = 12 * self.steps_per_month
+        self._timesteps = [Timestep(*row) for row in zip(self.month.tolist(), self.month_index.tolist(),
+                                                         self.fraction.tolist(), self.duration.tolist(),
+                                                         self.first.tolist())]
+
+    def __repr__(self):
+        return "%s(months=%s, frequency=%s, timesteps=%s)" % (self.__class__.__name__, self.months, self.frequency,
+                                                              len(self))
+
+    def __len__(self):
+        return len(self.month_index)
+
+    def __getitem__(self, timestep):
+        """
+        Month, month index, fraction, duration and first of a timestep (Timestep), as Python numbers
+        """
+        return self._timesteps[timestep]
+
+    def steps(self, months):
+        """
+        Number of timesteps of a duration in months (e.g. the transit time of the aquifers)
+        """
+        return int(round(months * self.steps_per_month))
+
+    def timestep(self, year, month=1):
+        """
+        First timestep of a month (1: January) of a year
+        """
+        return int(np.searchsorted(self.month_index, (year - self.start) * 12 + month - 1))
+
+    def table(self):
+        """
+        Timesteps as an array [timestep, calendar_columns] (see engines.kernel)
+        """
+        return np.column_stack([self.month, self.month_index, self.fraction, self.duration, self.first]).astype(float)
+
+    def disaggregate(self, values, kind='volume'):
+        """
+        Monthly values [month, ...] at the timesteps of the months given: volumes split by the days of the steps,
+        states (e.g. a storage objective) repeated
+        The values are returned as they are with monthly steps
+        """
+        if kind not in ('volume', 'state'):
+            raise ValueError("Unknown kind %s of monthly values (volume, state)" % kind)
+        if self.frequency == 'monthly':
+            return values
+        values = np.asarray(values, dtype=float)
+        index = self.month_index[self.month_index < len(values)]
+        if kind == 'state':
+            return values[index]
+        return values[index] * self.fraction[:len(index)].reshape((-1,) + (1,) * (values.ndim - 1))
+
+    def aggregate(self, values, kind='volume', timesteps=None):
+        """
+        Values [timestep, ...] of consecutive timesteps (the first ones by default) back to their months [month, ...]:
+        volumes summed, states at the last step of each month, 'mean' averaged over the steps
+        Returns the months and the monthly values
+        """
+        if kind not in ('volume', 'state', 'mean'):
+            raise ValueError("Unknown kind %s of values (volume, state, mean)" % kind)
+        values = np.asarray(values)
+        if timesteps is None:
+            timesteps = np.arange(len(values))
+        index = self.month_index[np.asarray(timesteps, dtype=int)]
+        starts = np.flatnonzero(np.concatenate([[True], np.diff(index) != 0]))
+        months = index[starts]
+        if self.frequency == 'monthly':
+            return months, values
+        if kind == 'state':
+            return months, values[np.append(starts[1:], len(values)) - 1]
+        total = np.add.reduceat(values, starts, axis=0)
+        if kind == 'mean':
+            counts = np.diff(np.append(starts, len(values)))
+            total = total / counts.reshape((-1,) + (1,) * (values.ndim - 1))
+        return months, total
+
+
+def get_calendar(network):
+    """
+    Returns the calendar of the network, monthly over the longest forecast of the nodes if none was set
+    """
+    if getattr(network, 'calendar', None) is None:
+        network.calendar = Calendar(max(len(getattr(n, f, [])) for n in network.nodes
+                                        for f in ['inflow_forecast', 'crop_demand_forecast', 'storage_forecast']))
+    return network.calendar
+
+
+def set_calendar(network, calendar):
+    """
+    Sets the calendar of a network built from forcing at the timesteps of the calendar, before the first timestep:
+    the nodes depending on the length of the steps are updated (set_calendar of the nodes)
+    """
+    network.calendar = calendar
+    for n in network.nodes:
+        if hasattr(n, 'set_calendar'):
+            n.set_calendar(calendar)
@@ -0,0 +1,76 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+
+levels = np.arange(0, 101, 2) / 100.0  # storage levels of the area-storage relations [ratio of the capacity]
+
+
+class Hypsometry(object):
+    """
+    Area-storage relation given at the storage levels 0, 2, ..., 100% of the capacity
+    The capacity is passed at each lookup, so the relation follows the sediments without being rebuilt
+    One reservoir (areas [level]) or several reservoirs at once (areas [reservoir, level], see stack)
+    """
+
+    def __init__(self, areas):
+        self.areas = np.asarray(areas, dtype=float)[..., :len(levels)]
+        # plain floats for the lookup of one storage
+        self._levels = levels.tolist()
+        self._areas = self.areas.tolist()
+
+    def __repr__(self):
+        return "%s(reservoirs=%s)" % (self.__class__.__name__, 1 if self.areas.ndim == 1 else len(self.areas))
+
+    @classmethod
+    def stack(cls, hypsometries):
+        """
+        One relation for several reservoirs, for batched lookups
+        """
+        return cls([h.areas for h in hypsometries])
+
+    def index(self, storage, capacity):
+        """
+        First level whose storage (level * capacity) is >= storage
+        """
+        if self.areas.ndim == 1 and np.ndim(storage) == 0:
+            # bisection, the levels are sorted (decreasing storages if the sediments exceed the capacity,
+            # only the first level can then be above the storage)
+            id_s = 0
+            hi = 0 if self._levels[0] * capacity >= storage else len(self._levels)
+            while id_s < hi:
+                j = (id_s + hi) // 2
+                if self._levels[j] * capacity >= storage:
+                    hi = j
+                else:
+                    id_s = j + 1
+            if id_s == len(self._levels):
+                raise ValueError("Storage %s above the capacity %s" % (storage, capacity))
+            return id_s
+        storage = np.asarray(storage, dtype=float)
+        above = levels * np.asarray(capacity, dtype=float)[..., None] >= storage[..., None]
+        if not np.all(np.any(above, axis=-1)):
+            raise ValueError("Storage above the capacity")
+        return np.argmax(above, axis=-1)
+
+    def area(self, storage, capacity, interpolate=False):
+        """
+        Area at the first level above the storage, or linearly interpolated between the levels around the storage
+        """
+        id_s = self.index(storage, capacity)
+        if self.areas.ndim == 1 and np.ndim(storage) == 0:
+            if not interpolate or id_s == 0:
+                return self._areas[id_s]
+            s0 = self._levels[id_s - 1] * capacity
+            return self._areas[id_s - 1] + (storage - s0) * (self._areas[id_s] - self._areas[id_s - 1]) / \
+                (self._levels[id_s] * capacity - s0)
+        rows = () if self.areas.ndim == 1 else (np.arange(len(self.areas)),)
+        area = self.areas[rows + (id_s,)]
+        if not interpolate:
+            return area
+        previous = np.maximum(id_s - 1, 0)
+        s0 = levels[previous] * capacity
+        a0 = self.areas[rows + (previous,)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            interpolated = a0 + (storage - s0) * (area - a0) / (levels[id_s] * capacity - s0)
+        return np.where(id_s > 0, interpolated, area)
@@ -3,6 +3,9 @@ __email__ = 'nicolas.avisse@gmail.com'
 
 from pynsim import Institution
 
+from components.calendar import get_calendar
+from components.topology import get_topology
+
 
 class Syria(Institution):
     """
@@ -10,6 +13,8 @@ class Syria(Institution):
     """
 
     def manage_water_resources(self, timestep):
+        topology = get_topology(self.network)
+        fraction = get_calendar(self.network)[timestep].fraction
         wadi_losses = 0
         for n in self.network.nodes:
             if n.component_type == 'SurfaceReservoir':
@@ -17,41 +22,28 @@ class Syria(Institution):
                 n.wadi_losses = 0
                 wadi_losses += n.wadi_losses
                 # adding outflow from current upstream reservoirs
-                for us_n in n.upstream_nodes:
-                    if us_n in n.current_upstream_reservoirs():
-                        link = self.network.get_link('RS_' + str(us_n.idx) + '-' + str(n.idx))
-                        if link is None:
-                            link2 = self.network.get_link('C_' + str(us_n.idx) + '-' + str(n.idx))
-                        list_ds_n = [n2 for n2 in us_n.downstream_nodes if n2.component_type == 'SurfaceReservoir']
+                cur_us_reservoirs = n.current_upstream_reservoirs()
+                for us_n, kind, wadi, link_yield, max_flow, wadi_yield in topology.upstream_edges(n):
+                    if kind == topology.TRANSFER:
+                        continue
+                    if us_n in cur_us_reservoirs:
                         # if both a wadi and a canal come from the upstream reservoir
-                        if len(list_ds_n) > 1:
-                            # if not wadi then canal to n
-                            if link is None:
-                                # additional inflow cannot excess the transfer capacity of canal/pipe
-                                n.inflow_tot += link2.link_yield * min(link2.max_flow, us_n.outflow)
-                                n.wadi_losses += (1 - link2.link_yield) * min(link2.max_flow, us_n.outflow)
-                                wadi_losses += (1 - link2.link_yield) * min(link2.max_flow, us_n.outflow)
-                            else:
-                                list_ds_n.remove(n)
-                                ds_n = list_ds_n[0]
-                                link2 = self.network.get_link('C_' + str(us_n.idx) + '-' + str(ds_n.idx))
-                                # what does not go through the canal goes to the wadi
-                                n.inflow_tot += link.link_yield * max(0, us_n.outflow - link2.max_flow)
-                                n.wadi_losses += (1 - link.link_yield) * max(0, us_n.outflow - link2.max_flow)
-                                wadi_losses += (1 - link.link_yield) * max(0, us_n.outflow - link2.max_flow)
+                        if kind == topology.CANAL_SPLIT:
+                            # additional inflow cannot excess the transfer capacity of canal/pipe
+                            flow = min(max_flow, us_n.outflow)
+                        elif kind == topology.WADI_SPLIT:
+                            # what does not go through the canal goes to the wadi
+                            flow = max(0, us_n.outflow - max_flow)
                         # else: only one wadi
                         else:
-                            if link is None:
-                                link = self.network.get_link('C_' + str(us_n.idx) + '-' + str(n.idx))
-                            n.inflow_tot += link.link_yield * us_n.outflow
-                            n.wadi_losses += (1 - link.link_yield) * us_n.outflow
-                            wadi_losses += (1 - link.link_yield) * us_n.outflow
+                            flow = us_n.outflow
+                        n.inflow_tot += link_yield * flow
+                        n.wadi_losses += (1 - link_yield) * flow
+                        wadi_losses += (1 - link_yield) * flow
                     # direct upstream reservoir inactive
-                    elif us_n.component_type == 'SurfaceReservoir':
-                        link = self.network.get_link('RS_' + str(us_n.idx) + '-' + str(n.idx))
+                    elif wadi:
                         # flow can only be diverted through a canal if the reservoir is active
-                        if link is not None:
-                            n.inflow_tot += us_n.inflow_tot
+                        n.inflow_tot += us_n.inflow_tot
                 if n.name != 'El Wahda':
                     # dams built?
                     if n.active == 0:  # dam not built yet
@@ -77,31 +69,32 @@ class Syria(Institution):
 
             elif n.component_type == 'Aquifer':
                 # demand
-                l_d_average = len(n.demand_average)
-                n.demand_average[timestep % l_d_average] += sum([us_n.deficit for us_n in n.upstream_nodes])
-                n.demand = sum(n.demand_average) / l_d_average
+                n.demand_average.add(timestep, sum([us_n.deficit for us_n in n.upstream_nodes]))
+                n.demand = n.demand_average.mean()
                 # only reservoirs upstream anyway
-                l_if_average = len(n.inflow_average)
                 n.inflow_tot = sum([us_n.rf * (1 - us_n.eta) * us_n.demand for us_n in n.upstream_nodes])
                 if n.name == 'GW_Wahda':
                     n.inflow_tot += n.wadi_rf * wadi_losses + n.rf * (1 - n.eta) * n.demand
-                n.inflow_average[timestep % l_if_average] += n.inflow_tot
-                n.inflow = sum(n.inflow_average) / l_if_average
-                # release
-                if n.demand - n.inflow <= n.trigger:  # pumping too low to affect the base flow
-                    n.outflow = n.hist_bf
+                n.inflow_average.add(timestep, n.inflow_tot)
+                n.inflow = n.inflow_average.mean()
+                # release, monthly volumes of the aquifer for the timestep
+                hist_bf = n.hist_bf * fraction
+                trigger = n.trigger * fraction
+                min_bf = n.min_bf * fraction
+                if n.demand - n.inflow <= trigger:  # pumping too low to affect the base flow
+                    n.outflow = hist_bf
                     n.deficit = 0
                     for us_n in n.upstream_nodes:
                         us_n.deficit = 0
-                elif n.demand - n.inflow <= n.trigger + n.hist_bf - n.min_bf:
+                elif n.demand - n.inflow <= trigger + hist_bf - min_bf:
                     # pumping decreases the level of the aquifer
-                    n.outflow = n.trigger + n.hist_bf - n.demand + n.inflow
+                    n.outflow = trigger + hist_bf - n.demand + n.inflow
                     n.deficit = 0
                     for us_n in n.upstream_nodes:
                         us_n.deficit = 0
                 else:  # minimum base flow
-                    n.outflow = n.min_bf
-                    n.deficit = n.demand - n.inflow - (n.trigger + n.hist_bf - n.min_bf)
+                    n.outflow = min_bf
+                    n.deficit = n.demand - n.inflow - (trigger + hist_bf - min_bf)
                     us_satisfied_ratio = 1 - n.deficit / n.demand
                     for us_n in n.upstream_nodes:
                         us_n.deficit -= us_n.deficit * us_satisfied_ratio
@@ -129,19 +122,28 @@ class JVA(Institution):
     kac95_07 = [100, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]  # [%]
     kac08 = [100, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]  # [%]
     # ===================================================================================
+    # annual KAC objective set in April: max(kac_min, storage of Wahda + Mukheibeh - transfers to Israel +
+    # kac_margin, objective of the last year - kac_decrease)
+    kac_min = 55  # [hm3]
+    kac_margin = 30  # [hm3]
+    kac_decrease = 20  # [hm3]
 
     _properties = {'kac': None}  # available in the KAC
+    # attributes carried from one timestep to the next, besides _properties (see tools.checkpoint)
+    _state = ['objective_kac']
 
     def __init__(self, name, **kwargs):
         super(JVA, self).__init__(name, **kwargs)
         self.kac = None  # already defined in _properties
 
     def manage_wahda(self, timestep):
+        step = get_calendar(self.network)[timestep]
         wahda = self.network.get_node('El Wahda')
         # aquifer deficit
         aq = self.network.get_node('GW_Wahda')
+        min_bf = aq.min_bf * step.fraction
         wahda.inflow_tot += aq.outflow
-        diff_min_flow = wahda.inflow_tot - aq.min_bf
+        diff_min_flow = wahda.inflow_tot - min_bf
         wahda.inflow_tot -= min(diff_min_flow, aq.deficit)
         if wahda.active == 0:  # dam not built yet
             wahda.deficit = 0  # n.demand
@@ -153,7 +155,7 @@ class JVA(Institution):
             # Loss in Wahda reservoir
             pct_abstractions = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]  # [%]
             # % of yearly amount
-            wahda.inflow_tot -= min(wahda.inflow_tot - aq.min_bf, pct_abstractions[timestep % 12] / 100.0 * 0)
+            wahda.inflow_tot -= min(wahda.inflow_tot - min_bf, pct_abstractions[step.month] / 100.0 * 0)
             # ==================================================================
             if wahda.inflow_tot + wahda.storage_ini - wahda.storage - wahda.demand >= 0:
                 # demand and storage objective are met
@@ -172,29 +174,32 @@ class JVA(Institution):
     def separate_the_flow(self, timestep):
         # flow to Adasiya
         adasiya = self.network.get_node('Adasiya')
-        for us_n in adasiya.upstream_nodes:
-            if us_n in adasiya.current_upstream_reservoirs():
-                link = self.network.get_link('RS_' + str(us_n.idx) + '-0')
-                adasiya.inflow_tot += link.link_yield * us_n.outflow
+        cur_us_reservoirs = adasiya.current_upstream_reservoirs()
+        for us_n, kind, wadi, link_yield, max_flow, wadi_yield in get_topology(self.network).upstream_edges(adasiya):
+            if us_n in cur_us_reservoirs:
+                adasiya.inflow_tot += wadi_yield * us_n.outflow
             elif us_n.component_type == 'SurfaceReservoir':
                 adasiya.inflow_tot += us_n.inflow_tot
             else:
                 adasiya.inflow_tot += us_n.outflow
-        # rules from the 1994 Treaty of Peace
+        # rules from the 1994 Treaty of Peace, monthly quantities shared by the timesteps of the month
+        step = get_calendar(self.network)[timestep]
+        m = step.month
         wahda = self.network.get_node('El Wahda')
-        israel_share = self.allocation[timestep % 12] + self.concession[timestep % 12]
-        if timestep / 12 < 1995 - 1983:
-            kac = self.kac_94[timestep % 12] / 100 * self.objective_kac  # hm3
-        elif timestep / 12 < 2008 - 1983:
-            kac = self.kac95_07[timestep % 12] / 100 * self.objective_kac  # hm3
+        israel_share = (self.allocation[m] + self.concession[m]) * step.fraction
+        if step.month_index / 12 < 1995 - 1983:
+            kac = self.kac_94[m] / 100 * self.objective_kac * step.fraction  # hm3
+        elif step.month_index / 12 < 2008 - 1983:
+            kac = self.kac95_07[m] / 100 * self.objective_kac * step.fraction  # hm3
         else:
-            kac = self.kac08[timestep % 12] / 100 * self.objective_kac  # hm3
+            kac = self.kac08[m] / 100 * self.objective_kac * step.fraction  # hm3
+        mukheibeh = self.mukheibeh[m] * step.fraction
         if wahda.active == 1:
-            # if Wahda built and active and max storage in April
-            if timestep % 12 == 3:
+            # if Wahda built and active and max storage in April (first timestep)
+            if m == 3 and step.first:
                 obj_last_year = self.objective_kac
-                self.objective_kac = max(55, wahda.storage + sum(self.mukheibeh) - sum(self.allocation)
-                                         - sum(self.concession) + 30, obj_last_year - 20)
+                self.objective_kac = max(self.kac_min, wahda.storage + sum(self.mukheibeh) - sum(self.allocation)
+                                         - sum(self.concession) + self.kac_margin, obj_last_year - self.kac_decrease)
             # priority 1: allocation and concession for Israel
             # priority 2: KAC
             if adasiya.inflow_tot <= israel_share:
@@ -205,19 +210,18 @@ class JVA(Institution):
                 adasiya.alpha = 0
                 adasiya.beta = adasiya.inflow_tot
             else:
-                if adasiya.inflow_tot - israel_share < kac - self.mukheibeh[timestep % 12]:
-                    water_reserve = min(wahda.storage, kac - self.mukheibeh[timestep % 12]
-                                        - (adasiya.inflow_tot - israel_share))
+                if adasiya.inflow_tot - israel_share < kac - mukheibeh:
+                    water_reserve = min(wahda.storage, kac - mukheibeh - (adasiya.inflow_tot - israel_share))
                     wahda.storage -= water_reserve
                     wahda.outflow += water_reserve
                     adasiya.inflow_tot += water_reserve
-                adasiya.alpha = min(adasiya.inflow_tot - israel_share, kac - self.mukheibeh[timestep % 12])
+                adasiya.alpha = min(adasiya.inflow_tot - israel_share, kac - mukheibeh)
                 adasiya.beta = adasiya.inflow_tot - adasiya.alpha
         else:
             adasiya.beta = min(adasiya.inflow_tot, israel_share)
-            adasiya.alpha = min(adasiya.inflow_tot - adasiya.beta, kac - self.mukheibeh[timestep % 12])
+            adasiya.alpha = min(adasiya.inflow_tot - adasiya.beta, kac - mukheibeh)
             adasiya.beta += adasiya.inflow_tot - adasiya.alpha - adasiya.beta
-        self.kac = adasiya.alpha + self.mukheibeh[timestep % 12]
+        self.kac = adasiya.alpha + mukheibeh
 
 
 class Israel(Institution):
@@ -225,7 +229,7 @@ class Israel(Institution):
     Israeli decision maker
     """
 
-    # 3.95 m3/s (in theory 4.5 m3/s)
+    # 3.95 m3/s (in theory 4.5 m3/s) [hm3/month of 30 days]
     pumping_capacity = 3.95 * 86400 * 30 / 1e6
     # ===================================================================================
     # CONFIDENTIAL DATA (numbers given in this section are false values)
@@ -240,6 +244,8 @@ class Israel(Institution):
     _properties = {'quantity_available': None,   # available for Israel
                    'yarmouk_to_tiberias': None,  # send to Tiberias
                    'loss_to_JordanRiver': None}  # to the Jordan River
+    # attributes carried from one timestep to the next, besides _properties (see tools.checkpoint)
+    _state = ['obs_concession']
 
     def __init__(self, name, **kwargs):
         super(Israel, self).__init__(name, **kwargs)
@@ -248,20 +254,27 @@ class Israel(Institution):
         self.loss_to_JordanRiver = None  # already defined in _properties
         self.obs_concession = self.concession
 
-    def pump_in_yarmoukeem_pool(self):
+    def pump_in_yarmoukeem_pool(self, timestep):
         adasiya = self.network.get_node('Adasiya')
-        self.yarmouk_to_tiberias = min(self.pumping_capacity, adasiya.beta)
+        duration = get_calendar(self.network)[timestep].duration
+        self.yarmouk_to_tiberias = min(self.pumping_capacity * duration, adasiya.beta)
         self.loss_to_JordanRiver = adasiya.beta - self.yarmouk_to_tiberias
 
     def send_concession_back(self, timestep):
-        if self.yarmouk_to_tiberias <= self.allocation[timestep % 12]:
+        step = get_calendar(self.network)[timestep]
+        m = step.month
+        allocation = self.allocation[m] * step.fraction
+        concession = self.concession[m] * step.fraction
+        if self.yarmouk_to_tiberias <= allocation:
             self.quantity_available = self.yarmouk_to_tiberias
-            self.obs_concession[timestep % 12] = 0
-        elif self.yarmouk_to_tiberias <= self.allocation[timestep % 12] + self.concession[timestep % 12]:
-            self.quantity_available = self.allocation[timestep % 12]
-            self.obs_concession[timestep % 12] = self.yarmouk_to_tiberias - self.quantity_available
+            observed = 0
+        elif self.yarmouk_to_tiberias <= allocation + concession:
+            self.quantity_available = allocation
+            observed = self.yarmouk_to_tiberias - self.quantity_available
         else:
-            self.quantity_available = self.yarmouk_to_tiberias - self.concession[timestep % 12]
-            self.obs_concession[timestep % 12] = self.concession[timestep % 12]
+            self.quantity_available = self.yarmouk_to_tiberias - concession
+            observed = concession
+        # observed concession of the month, summed over its timesteps
+        self.obs_concession[m] = observed if step.first else self.obs_concession[m] + observed
         jva = self.network.get_institution('Jordan Valley Authority')
-        jva.kac += max(0, self.tiberias[timestep % 12] + (sum(self.obs_concession) - sum(self.concession)) / 12)
+        jva.kac += max(0, self.tiberias[m] + (sum(self.obs_concession) - sum(self.concession)) / 12) * step.fraction
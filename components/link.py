@@ -8,12 +8,15 @@ class RiverSection(Link):
     """
     Simple link type with a max and min flow value and a yield
     """
+    link_yield = 0.5  # share of the flow reaching the downstream node, unless given to the link
+
     _properties = {'min_flow': None,
                    'max_flow': None}
 
-    def __init__(self, name, start_node, end_node, link_yield=0.5, **kwargs):
+    def __init__(self, name, start_node, end_node, link_yield=None, **kwargs):
         super(RiverSection, self).__init__(name, start_node, end_node, **kwargs)
-        self.link_yield = link_yield
+        if link_yield is not None:
+            self.link_yield = link_yield
 
 
 class Canal(Link):
@@ -1,19 +1,108 @@
 __author__ = 'N. Avisse'
 __email__ = 'nicolas.avisse@gmail.com'
 
+from collections import deque
+
+import numpy as np
 from pynsim import Node
 
+from components.calendar import get_calendar
+from components.hypsometry import Hypsometry
+from components.schedule import NOT_BUILT, CREATED, BUILT, reservoir_schedule, capacity_schedule
+from components.topology import get_topology
+from components.transit import TransitTime
+
+
+class UpstreamReservoirs(object):
+    """
+    Upstream reservoirs of a node, memoized until the active state of a reservoir changes
+    """
+
+    def _memoized(self, key, active_dependent, compute):
+        topology = get_topology(self.network)
+        version = (topology, getattr(self.network, 'active_version', 0) if active_dependent else None)
+        cache = self.__dict__.setdefault('_us_cache', dict())
+        if key not in cache or cache[key][0] != version:
+            cache[key] = (version, compute(topology))
+        return list(cache[key][1])
+
+    def current_upstream_reservoirs(self):
+        """
+        Returns upstream reservoirs at a given time (relative after Jan 1983)
+        """
+        return self._memoized('current', True, self._current_upstream_reservoirs)
+
+    def all_current_upstream_reservoirs(self):
+        """
+        Returns all upstream reservoirs in the network for a given time (relative after Jan 1983)
+        """
+        return self._memoized('all_current', True, lambda topology: _sort_upstream(
+            self, lambda res: res.current_upstream_reservoirs()))
+
+    def all_upstream_reservoirs(self):
+        """
+        Returns all upstream reservoirs in the network
+        """
+        return self._memoized('all', False, lambda topology: _sort_upstream(
+            self, lambda res: [edge[0] for edge in topology.upstream_edges(res)
+                               if edge[0].component_type == 'SurfaceReservoir']))
+
+    def _current_upstream_reservoirs(self, topology):
+        cur_us_reservoirs = []
+        res_tmp = deque(edge[0] for edge in topology.upstream_edges(self)
+                        if edge[0].component_type == 'SurfaceReservoir')
+        # while there remains upstream reservoirs not taken into account
+        while len(res_tmp) > 0:
+            res = res_tmp.popleft()
+            # dam built and active?
+            if res.active == 1:
+                cur_us_reservoirs.append(res)
+            else:
+                for us_r, kind, wadi, link_yield, max_flow, wadi_yield in topology.upstream_edges(res):
+                    # only wadi because canal not built if reservoir not built
+                    if us_r.component_type == 'SurfaceReservoir' and wadi:
+                        res_tmp.append(us_r)
+        return cur_us_reservoirs
+
 
-class SurfaceReservoir(Node):
+def _last_occurrences(reservoirs):
+    """
+    Reservoirs without duplicates, in the order of their last occurrence
+    """
+    last = dict((res, k) for k, res in enumerate(reservoirs))
+    return sorted(last, key=last.get)
+
+
+def _sort_upstream(node, upstream):
+    """
+    All the reservoirs upstream of node, sorted from us to ds: by the last level of the breadth-first search where
+    they are found (farthest first), then by their last occurrence in that level, as if each visit moved them first
+    Each level only keeps the last occurrence of a reservoir: the order of the last occurrences of a level only
+    depends on the one of the level before
+    """
+    last_visit = dict()
+    visit = 0
+    level = _last_occurrences(upstream(node))
+    while len(level) > 0:
+        for res in level:
+            visit += 1
+            last_visit[res] = visit
+        level = _last_occurrences([us_res for res in level for us_res in upstream(res)])
+    return sorted(last_visit, key=lambda res: -last_visit[res])
+
+
+class SurfaceReservoir(UpstreamReservoirs, Node):
     """
     A general surface reservoir node
     """
 
     eta_pipe = 0.5  # household network efficiency
+    household_use = 5  # household consumption [m3/month per inhabitant]
     eta = 0.5   # irrigation efficiency
     rf = 0.3    # return flows
     CroppingIntensity = 1  #1.12  # cropping intensity (WB, 2001)
     sediment_pct = 0.001  # sediment per water quantity [ratio]
+    interpolate_area = False  # linear interpolation of the area-storage relation for the evaporation
 
     _properties = {'storage': None,
                    'inflow': None,
@@ -24,6 +113,8 @@ class SurfaceReservoir(Node):
                    'inflow_tot': None,
                    'inflow_deficit': None,
                    'wadi_losses': None}
+    # attributes carried from one timestep to the next, besides _properties (see tools.checkpoint)
+    _state = ['storage_ini', 'capacity', 'sediments', 'active']
 
     def __init__(self, name, x, y, idx, capacity=0, area_storage=list(), service_year=1970, end_year=None,
                  use=None, manager=None, initial_storage=0, nre_forecast=list(), crop_demand_forecast=list(),
@@ -31,7 +122,9 @@ class SurfaceReservoir(Node):
         super(SurfaceReservoir, self).__init__(name, x, y, **kwargs)
         self.idx = idx
         self.capacity = capacity
+        self.observed_capacity = capacity  # before the sediments accumulated until 1983
         self.area_storage = area_storage
+        self.hypsometry = Hypsometry(area_storage)
         self.year_start = service_year
         self.year_end = end_year
         self.use = use
@@ -53,76 +146,65 @@ class SurfaceReservoir(Node):
         self.wadi_losses = None  # already defined in _properties
         self.active = 0      # 0: not built yet / 1: built and active / 2: destroyed or abandoned
         # sediments in 1983, but capacity in 1983 estimated from 2000 remote sensing observation
-        if service_year < 1983:
-            self.sediments = self.sediment_pct * sum(inflow_forecast) / len(inflow_forecast) * 12 * \
-                             (1983 - service_year)
-            self.capacity -= self.sediments
+        self.set_sediments(12)
+        self.set_schedule()
+
+    def set_sediments(self, steps_per_year):
+        """
+        Sediments accumulated until 1983 from the mean inflow of the timesteps of the forecast
+        """
+        if self.year_start < 1983:
+            self.sediments = self.sediment_pct * sum(self.inflow_forecast) / len(self.inflow_forecast) * \
+                steps_per_year * (1983 - self.year_start)
+            self.capacity = self.observed_capacity - self.sediments
         else:
             self.sediments = None
 
+    def set_calendar(self, calendar):
+        """
+        Timesteps of the forecasts (components.calendar), before the first timestep
+        """
+        self.set_sediments(calendar.steps_per_year)
+        self.set_schedule(calendar)
+
     def __repr__(self):
         return "%s(name=%s, x=%s, y=%s, capacity in 1983=%s MCM, created in %s, destroyed in %s)"\
                % (self.__class__.__name__, self.name, self.x, self.y, self.capacity, self.year_start, self.year_end)
 
-    def current_upstream_reservoirs(self):
-        """
-        Returns upstream reservoirs at a given time (relative after Jan 1983)
-        """
-        cur_us_reservoirs = []
-        res_tmp = [us_n for us_n in self.upstream_nodes if us_n.component_type == 'SurfaceReservoir']
-        # while there remains upstream reservoirs not taken into account
-        while len(res_tmp) > 0:
-            # dam built and active?
-            if res_tmp[0].active == 1:
-                cur_us_reservoirs.append(res_tmp[0])
-            else:
-                for us_r in res_tmp[0].upstream_nodes:
-                    if us_r.component_type == 'SurfaceReservoir':
-                        # only wadi because canal not built if reservoir not built
-                        link = self.network.get_link('RS_' + str(us_r.idx) + '-' + str(res_tmp[0].idx))
-                        if link is not None:  # if the wadi exists
-                            res_tmp.append(us_r)
-            res_tmp.remove(res_tmp[0])
-        return cur_us_reservoirs
+    @property
+    def active(self):
+        return self._active
 
-    def all_current_upstream_reservoirs(self):
+    @active.setter
+    def active(self, value):
+        # any transition invalidates the memoized upstream reservoirs
+        if value != getattr(self, '_active', None) and self.network is not None:
+            self.network.active_version = getattr(self.network, 'active_version', 0) + 1
+        self._active = value
+
+    def set_schedule(self, calendar=None, start=0):
         """
-        Returns all upstream reservoirs in the network for a given time (relative after Jan 1983)
+        Phase, value given to active (-1: unchanged), capacity and sediments [hm3] at the end of each timestep
+        (components.schedule), computed once from the forecasts and from the capacity and sediments before the
+        timestep start: when the reservoir or the calendar of the network is built, then again at the setup after
+        reset_schedule
+        calendar: components.calendar.Calendar of the timesteps, monthly steps if None
         """
-        all_cur_us_reservoirs = []
-        cur_us_res_tmp = [us_res for us_res in self.current_upstream_reservoirs()]
-        # while there remains upstream reservoirs not taken into account
-        while len(cur_us_res_tmp) > 0:
-            cur_res_tmp = cur_us_res_tmp
-            cur_us_res_tmp = []
-            for res in cur_res_tmp:
-                # sorting us to ds
-                if res in all_cur_us_reservoirs:
-                    all_cur_us_reservoirs.remove(res)
-                all_cur_us_reservoirs.insert(0, res)
-                for us_res in res.current_upstream_reservoirs():
-                    cur_us_res_tmp.append(us_res)
-        return all_cur_us_reservoirs
+        inflow = np.asarray(self.inflow_forecast, dtype=float)
+        phase, active, accumulating = reservoir_schedule(len(inflow), self.year_start, self.year_end, calendar)
+        sedimentation = np.where(accumulating, self.sediment_pct * inflow, 0.)
+        capacity, sediments = capacity_schedule(self.capacity, np.nan if self.sediments is None else self.sediments,
+                                                phase[start:], sedimentation[start:])
+        self._schedule = (phase, active, np.concatenate([np.full(start, np.nan), capacity]),
+                          np.concatenate([np.full(start, np.nan), sediments]))
 
-    def all_upstream_reservoirs(self):
+    def reset_schedule(self):
         """
-        Returns all upstream reservoirs in the network
+        Schedule computed again at the next setup, from the values at this timestep: to be called when the
+        forecasts, the years, sediment_pct, capacity or sediments are changed after the reservoir was built
+        (e.g. tools.scenarios.Rehabilitation, tools.checkpoint.set_state)
         """
-        all_us_reservoirs = []
-        us_res_tmp = [us_n for us_n in self.upstream_nodes if us_n.component_type == 'SurfaceReservoir']
-        # while there remains upstream reservoirs not taken into account
-        while len(us_res_tmp) > 0:
-            res_tmp = us_res_tmp
-            us_res_tmp = []
-            for res in res_tmp:
-                # sorting us to ds
-                if res in all_us_reservoirs:
-                    all_us_reservoirs.remove(res)
-                all_us_reservoirs.insert(0, res)
-                for us_n in res.upstream_nodes:
-                    if us_n.component_type == 'SurfaceReservoir':
-                        us_res_tmp.append(us_n)
-        return all_us_reservoirs
+        self._schedule = None
 
     def setup(self, timestamp):
         """
@@ -130,33 +212,35 @@ class SurfaceReservoir(Node):
         """
         # if (float(timestamp) - 3) / 12 == 2018 - 1983:     # test efficiency for future scenarios
         #     self.eta += 0.1
+        step = get_calendar(self.network)[timestamp]
         self.inflow = self.inflow_forecast[timestamp]
+        # household consumption [hm3/month], share of the month of the timestep
         self.demand = self.crop_demand_forecast[timestamp] * self.CroppingIntensity / self.eta + \
-            self.inhabitants * 5 / 1e6 / self.eta_pipe
-        # assumption: dams built and destroyed in April
+            self.inhabitants * self.household_use / 1e6 / self.eta_pipe * step.fraction
+        # assumption: dams built and destroyed in April (see components.schedule)
         # if (float(timestamp) - 3) / 12 == 2018 - 1983:     # test rehabilitation for future scenarios
         #     self.active = 1
         #     self.year_end = 2222
-        if (float(timestamp) - 3) / 12 == self.year_start - 1983:    # reservoir just created
-            self.active = 1
+        if self._schedule is None:
+            self.set_schedule(get_calendar(self.network), timestamp)
+        # sediments, none once the dam is destroyed or abandoned
+        phase, active, capacity, sediments = self._schedule
+        if active[timestamp] >= 0:
+            self.active = int(active[timestamp])
+        if phase[timestamp] == CREATED:    # reservoir just created
             self.storage_ini = 0
-            self.sediments = self.sediment_pct * self.inflow
-            self.capacity -= self.sediment_pct * self.inflow
-        elif (float(timestamp) - 3) / 12 > self.year_start - 1983:   # reservoir already created
+            self.sediments = 0
+        elif phase[timestamp] == BUILT:   # reservoir already created
             # for dams already built for the first timestamp
             if timestamp == 0:
-                self.active = 1
                 self.storage = self.storage_ini
-            # index in the storage area relation -> evaporation
-            id_s = [s / 100.0 * self.capacity >= self.storage for s in range(0, 101, 2)].index(True)
-            self.evaporation = min(self.storage, self.area_storage[id_s] * self.nre_forecast[timestamp] / 1000)  # [MCM]
+            # storage area relation -> evaporation
+            area = self.hypsometry.area(self.storage, self.capacity, self.interpolate_area)
+            self.evaporation = min(self.storage, area * self.nre_forecast[timestamp] / 1000)  # [MCM]
             self.storage_ini = self.storage - self.evaporation
-            # sediments
-            if (timestamp - 3) / 12 < self.year_end - 1983 or self.year_end != self.year_end:  # reservoir still active
-                self.sediments += self.sediment_pct * self.inflow
-                self.capacity -= self.sediment_pct * self.inflow
-            else:  # dam destroyed or abandoned
-                self.active = 2
+        if phase[timestamp] != NOT_BUILT:
+            self.sediments = sediments[timestamp]
+            self.capacity = capacity[timestamp]
         # Wahda reservoir
         if len(self.storage_forecast) > 0:  # storage objective
             self.storage = self.storage_forecast[timestamp]
@@ -164,7 +248,7 @@ class SurfaceReservoir(Node):
             # CONFIDENTIAL DATA (numbers given in this section are false values)
             # TODO replace this data
             pct_abstractions = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]  # [%]
-            self.demand += pct_abstractions[timestamp % 12] / 100.0 * 0  # % of yearly amount
+            self.demand += pct_abstractions[step.month] / 100.0 * 0  # % of yearly amount
             # ===================================================================================
 
 
@@ -176,13 +260,23 @@ class Aquifer(Node):
     eta = 0.7  # irrigation efficiency
     rf = 0.3    # return flows
     wadi_rf = 0.75  # return flows from the wadis
+    # transit time: demand and inflow averaged over the last lag months, weighted by the kernel
+    # (components.transit: 'uniform', 'exponential' or 'gamma' of scale [months] and shape), unless given to the node
+    # hist_bf, trigger and min_bf are monthly volumes, shares of the month at each timestep (components.calendar)
+    lag = 24  # [months]
+    transit_kernel = 'uniform'
+    transit_scale = 12.  # [months]
+    transit_shape = 2
 
     _properties = {'outflow': None,
                    'demand': None,
                    'deficit': None,
                    'inflow': None}
+    # attributes carried from one timestep to the next, besides _properties (see tools.checkpoint)
+    _state = ['inflow_tot', 'demand_average', 'inflow_average', 'outflow_1']
 
-    def __init__(self, name, x=0, y=0, hist_bf=0, trigger=100, min_bf=0, crop_demand_forecast=list(), **kwargs):
+    def __init__(self, name, x=0, y=0, hist_bf=0, trigger=100, min_bf=0, crop_demand_forecast=list(), lag=None,
+                 transit_kernel=None, transit_scale=None, transit_shape=None, **kwargs):
         super(Aquifer, self).__init__(name, x, y, **kwargs)
         self.hist_bf = hist_bf  # base flow [hm3]
         self.trigger = trigger  # trigger under which GW decreases [hm3]
@@ -193,14 +287,35 @@ class Aquifer(Node):
         self.deficit = None     # already defined in _properties
         self.inflow = None      # already defined in _properties
         self.inflow_tot = None
-        self.demand_average = [hist_bf + 0 * m for m in range(0, 2*12)]  # average to consider a transit time
-        self.inflow_average = [hist_bf + 0 * m for m in range(0, 2*12)]  # average to consider a transit time
+        for attribute, value in [('lag', lag), ('transit_kernel', transit_kernel), ('transit_scale', transit_scale),
+                                 ('transit_shape', transit_shape)]:
+            if value is not None:
+                setattr(self, attribute, value)
+        # averages to consider a transit time
+        self.set_transit_time(1.)
         self.outflow_1 = None   # release at time t-1
 
     def __repr__(self):
         return "%s(name=%s, x=%s, y=%s, hist_GW_flow=%s MCM, trigger=%s MCM, min_flow=%s MCM)" \
                % (self.__class__.__name__, self.name, self.x, self.y, self.hist_bf, self.trigger, self.min_bf)
 
+    def set_transit_time(self, steps_per_month):
+        """
+        Averages of the demand and the inflow over lag months in timesteps, from the base flow of a timestep
+        """
+        self.demand_average = TransitTime(self.hist_bf / steps_per_month, int(round(self.lag * steps_per_month)),
+                                          self.transit_kernel, self.transit_scale * steps_per_month,
+                                          self.transit_shape)
+        self.inflow_average = TransitTime(self.hist_bf / steps_per_month, int(round(self.lag * steps_per_month)),
+                                          self.transit_kernel, self.transit_scale * steps_per_month,
+                                          self.transit_shape)
+
+    def set_calendar(self, calendar):
+        """
+        Timesteps of the forecasts (components.calendar), before the first timestep
+        """
+        self.set_transit_time(calendar.steps_per_month)
+
     def setup(self, timestamp):
         """
         At each timestep, demand is initialized
@@ -209,17 +324,17 @@ class Aquifer(Node):
         #     self.eta += 0.1
         # average demand and inflow
         if len(self.crop_demand_forecast) > 0:  # if there is pumping from the aquifer
-            self.demand_average[timestamp % len(self.demand_average)] = self.crop_demand_forecast[timestamp] / self.eta
-            self.inflow_average[timestamp % len(self.inflow_average)] = 0
+            self.demand_average.set(timestamp, self.crop_demand_forecast[timestamp] / self.eta)
+            self.inflow_average.set(timestamp, 0)
 
         # release at t-1
         if timestamp > 0:
             self.outflow_1 = self.outflow
         else:
-            self.outflow_1 = self.hist_bf
+            self.outflow_1 = self.hist_bf * get_calendar(self.network)[timestamp].fraction
 
 
-class Outlet(Node):
+class Outlet(UpstreamReservoirs, Node):
     """
     Outlet of the YRB
     """
@@ -242,24 +357,3 @@ class Outlet(Node):
         At each timestep, inflows are initialized
         """
         self.inflow = self.inflow_forecast[timestamp]
-
-    def current_upstream_reservoirs(self):
-        """
-        Returns upstream reservoirs at a given time
-        """
-        cur_us_reservoirs = []
-        res_tmp = [us_n for us_n in self.upstream_nodes if us_n.component_type == 'SurfaceReservoir']
-        # while there remains upstream reservoirs not taken into account
-        while len(res_tmp) > 0:
-            # dam built and active?
-            if res_tmp[0].active == 1:
-                cur_us_reservoirs.append(res_tmp[0])
-            else:
-                for us_r in res_tmp[0].upstream_nodes:
-                    if us_r.component_type == 'SurfaceReservoir':
-                        # only wadi because canal not built if reservoir not built
-                        link = self.network.get_link('RS_' + str(us_r.idx) + '-' + str(res_tmp[0].idx))
-                        if link is not None:  # if the wadi exists
-                            res_tmp.append(us_r)
-            res_tmp.remove(res_tmp[0])
-        return cur_us_reservoirs
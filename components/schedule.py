@@ -0,0 +1,61 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+
+# phases of a reservoir in a timestep
+NOT_BUILT = 0
+CREATED = 1  # timestep of the creation
+BUILT = 2    # created before the timestep, active or destroyed
+
+
+def reservoir_schedule(T, year_start, year_end, calendar=None):
+    """
+    Phase of a reservoir over T timesteps from Jan 1983, computed at once for the setup of the reservoirs
+    (assumption: dams built and destroyed in April, created at the first timestep of April)
+    year_end: NaN or None if the dam is never destroyed
+    calendar: components.calendar.Calendar of the timesteps, monthly steps if None
+    Returns phase [T], active [T] (value given to active by the setup, -1: unchanged) and accumulating [T]
+    (timesteps when the sediments accumulate: from the creation until the dam is destroyed or abandoned)
+    """
+    if calendar is None:
+        t = np.arange(T)
+        first = np.ones(T, dtype=bool)
+    else:
+        t = calendar.month_index[:T]
+        first = calendar.first[:T]
+    year = (t - 3) / 12.
+    phase = np.where(year == year_start - 1983, np.where(first, CREATED, BUILT),
+                     np.where(year > year_start - 1983, BUILT, NOT_BUILT))
+    if year_end is None or year_end != year_end:
+        still_active = np.ones(T, dtype=bool)
+    else:
+        still_active = year < year_end - 1983
+    active = np.full(T, -1, dtype=int)
+    active[phase == CREATED] = 1
+    # for dams already built for the first timestep
+    if T > 0 and phase[0] == BUILT:
+        active[0] = 1
+    active[(phase == BUILT) & ~still_active] = 2
+    accumulating = (phase == CREATED) | ((phase == BUILT) & still_active)
+    return phase, active, accumulating
+
+
+def capacity_schedule(capacity, sediments, phase, sedimentation):
+    """
+    Capacity and sediments [hm3] at the end of a sequence of timesteps of a reservoir, computed at once from the ones
+    before the first timestep (sediments: NaN if unknown), the phases [timestep] and the sediments of the timesteps
+    [timestep, ...]: added one after the other as in the setup of the reservoirs (none while not built), from 0 at the
+    creation of the dam
+    capacity, sediments: numbers or arrays of the last axes of sedimentation (e.g. scenarios)
+    """
+    sedimentation = np.asarray(sedimentation, dtype=float)
+    capacity = np.broadcast_to(np.asarray(capacity, dtype=float), sedimentation.shape[1:])
+    sediments = np.broadcast_to(np.asarray(sediments, dtype=float), sedimentation.shape[1:])
+    capacities = np.subtract.accumulate(np.concatenate([capacity[None], sedimentation]), axis=0)[1:]
+    created = np.flatnonzero(np.asarray(phase) == CREATED)
+    c = created[-1] if len(created) > 0 else len(sedimentation)
+    accumulated = np.concatenate([np.add.accumulate(np.concatenate([sediments[None], sedimentation[:c]]), axis=0)[1:],
+                                  np.add.accumulate(np.concatenate([np.zeros_like(sediments)[None], sedimentation[c:]]),
+                                                    axis=0)[1:]])
+    return capacities, accumulated
@@ -0,0 +1,216 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import json
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from pynsim import Network
+
+from components.calendar import Calendar, set_calendar
+from components.node import SurfaceReservoir, Aquifer, Outlet
+from components.link import RiverSection, Canal, UndergroundTransfer
+from components.institution import Syria, JVA, Israel
+from components.topology import Topology
+
+node_types = dict((c.__name__, c) for c in [SurfaceReservoir, Aquifer, Outlet])
+link_types = dict((c.__name__, c) for c in [RiverSection, Canal, UndergroundTransfer])
+institution_types = dict((c.__name__, c) for c in [JVA, Israel, Syria])
+# names of the links between reservoirs looked up by the topology, from the idx of their nodes (0: outlet)
+link_names = {'RiverSection': 'RS_%d-%d', 'Canal': 'C_%d-%d'}
+
+
+def topological_order(outlet, upstream):
+    """
+    Nodes upstream of the outlet sorted from us to ds in O(V+E) (plus the sort of each level): farthest from the
+    outlet first, then as the former wiring loop of build_network (last visited first in each level)
+    upstream: dict name -> names of the start nodes of its incoming links, in their order
+    Raises ValueError if the links upstream of the outlet form a cycle
+    """
+    # nodes upstream of the outlet and number of their links to these nodes
+    pending = {outlet: 0}
+    queue = deque([outlet])
+    while len(queue) > 0:
+        for us_n in upstream[queue.popleft()]:
+            if us_n not in pending:
+                pending[us_n] = 0
+                queue.append(us_n)
+            pending[us_n] += 1
+    # longest path to the outlet, each node processed once all its downstream nodes are (Kahn)
+    depth = {outlet: 0}
+    queue = deque([outlet])
+    processed = 0
+    while len(queue) > 0:
+        n = queue.popleft()
+        processed += 1
+        for us_n in upstream[n]:
+            depth[us_n] = max(depth.get(us_n, 0), depth[n] + 1)
+            pending[us_n] -= 1
+            if pending[us_n] == 0:
+                queue.append(us_n)
+    if processed < len(pending):
+        raise ValueError("Cycle in the links upstream of %s: %s" % (outlet, sorted(n for n in pending
+                                                                                   if pending[n] > 0)))
+    # rank in each level of the last visit, from the rank of the downstream nodes one level closer to the outlet
+    levels = dict()
+    for n, d in depth.items():
+        levels.setdefault(d, []).append(n)
+    rank = {outlet: 0}
+    for d in range(1, len(levels)):
+        last_visit = dict()
+        for n in levels[d - 1]:
+            for j, us_n in enumerate(upstream[n]):
+                if depth[us_n] == d:
+                    last_visit[us_n] = max(last_visit.get(us_n, (-1, -1)), (rank[n], j))
+        rank.update((n, k) for k, n in enumerate(sorted(levels[d], key=lambda n: last_visit[n])))
+    return sorted(depth, key=lambda n: (-depth[n], -rank[n]))
+
+
+class NetworkSpec(object):
+    """
+    Declarative description of a network, validated and built by build
+    nodes: dicts {'type', 'name', arguments of the class} e.g. {'type': 'Aquifer', 'name': 'GW_Adasiya', 'hist_bf': 2}
+    links: dicts {'type', 'name', 'start', 'end', arguments}, created in this order (order of the in_links)
+    institutions: dicts {'type', 'name'}
+    calendar: components.calendar.Calendar of the timesteps of the forecasts, monthly if None
+    """
+
+    def __init__(self, name, nodes, links, institutions, calendar=None):
+        self.name = name
+        self.nodes = [dict(n) for n in nodes]
+        self.links = [dict(link) for link in links]
+        self.institutions = [dict(i) for i in institutions]
+        self.calendar = calendar
+
+    def __repr__(self):
+        return "%s(name=%s, nodes=%s, links=%s, institutions=%s)" % (self.__class__.__name__, self.name,
+                                                                     len(self.nodes), len(self.links),
+                                                                     len(self.institutions))
+
+    @classmethod
+    def from_frames(cls, name, nodes, links, institutions, calendar=None):
+        """
+        Spec from tables (DataFrames), one row per component, empty cells (NaN) not passed to the classes
+        """
+        def rows(frame):
+            return [dict((k, v) for k, v in row.items() if not (np.isscalar(v) and v != v))
+                    for row in frame.to_dict('records')]
+        return cls(name, rows(nodes), rows(links), rows(institutions), calendar)
+
+    def frames(self):
+        """
+        Nodes, links and institutions as DataFrames
+        """
+        return pd.DataFrame(self.nodes), pd.DataFrame(self.links), pd.DataFrame(self.institutions)
+
+    def save(self, path):
+        """
+        Writes the spec in a JSON file, series (e.g. the forecasts) as lists, the calendar as its arguments
+        """
+        def values(row):
+            return dict((k, np.asarray(v).tolist() if isinstance(v, (list, np.ndarray, pd.Series)) else
+                         (v.item() if isinstance(v, np.generic) else v)) for k, v in row.items())
+        with open(path, 'w') as f:
+            json.dump({'name': self.name, 'nodes': [values(n) for n in self.nodes],
+                       'links': [values(link) for link in self.links],
+                       'institutions': [values(i) for i in self.institutions],
+                       'calendar': None if self.calendar is None else {'months': self.calendar.months,
+                                                                       'frequency': self.calendar.frequency,
+                                                                       'start': self.calendar.start}}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            spec = json.load(f)
+        calendar = spec.get('calendar')
+        return cls(spec['name'], spec['nodes'], spec['links'], spec['institutions'],
+                   None if calendar is None else Calendar(**calendar))
+
+    def outlet(self):
+        return [n['name'] for n in self.nodes if n['type'] == 'Outlet'][0]
+
+    def upstream(self):
+        """
+        Names of the start nodes of the incoming links of each node, in the order of the links
+        """
+        upstream = dict((n['name'], []) for n in self.nodes)
+        for link in self.links:
+            upstream[link['end']].append(link['start'])
+        return upstream
+
+    def validate(self):
+        """
+        Raises ValueError listing the errors of the spec: missing names and types, types, duplicated names, unknown
+        nodes of the links, forecasts that are not sequences or longer than the calendar, number of outlets, names of
+        the links between reservoirs, nodes not upstream of the outlet, cycles
+        """
+        errors = []
+        for rows, types, kind in [(self.nodes, node_types, 'node'), (self.links, link_types, 'link'),
+                                  (self.institutions, institution_types, 'institution')]:
+            errors += ["Missing name of %s %s (row %s)" % (kind, row.get('type'), i) for i, row in enumerate(rows)
+                       if row.get('name') is None]
+            errors += ["Missing type of %s %s" % (kind, row.get('name')) for row in rows if row.get('type') is None]
+            names = [row['name'] for row in rows if row.get('name') is not None]
+            errors += ["Duplicated %s %s" % (kind, name) for name in sorted(set(n for n in names
+                                                                                if names.count(n) > 1))]
+            errors += ["Unknown type %s of %s %s" % (row['type'], kind, row.get('name')) for row in rows
+                       if row.get('type') is not None and row['type'] not in types]
+        nodes = dict((n['name'], n) for n in self.nodes if n.get('name') is not None)
+        for link in self.links:
+            for end in ['start', 'end']:
+                if link.get(end) not in nodes:
+                    errors.append("Unknown %s node %s of link %s" % (end, link.get(end), link.get('name')))
+            if link.get('start') in nodes and link.get('end') in nodes:
+                start, end = nodes[link['start']], nodes[link['end']]
+                if link['start'] == link['end']:
+                    errors.append("Link %s from a node to itself" % link.get('name'))
+                elif link.get('type') in link_names and start.get('type') == 'SurfaceReservoir':
+                    expected = link_names[link['type']] % (start.get('idx', -1), end.get('idx', 0))
+                    if link.get('name') != expected:
+                        errors.append("Link %s should be named %s" % (link.get('name'), expected))
+        for n in self.nodes:
+            for k, v in sorted(n.items()):
+                if not k.endswith('_forecast'):
+                    continue
+                if isinstance(v, str) or not hasattr(v, '__len__'):
+                    errors.append("Forecast %s of node %s is not a sequence" % (k, n.get('name')))
+                elif self.calendar is not None and len(v) > len(self.calendar):
+                    errors.append("Forecast %s of node %s longer than the %s timesteps of the calendar"
+                                  % (k, n.get('name'), len(self.calendar)))
+        outlets = [n['name'] for n in self.nodes if n.get('type') == 'Outlet']
+        if len(outlets) != 1:
+            errors.append("%s outlets instead of one" % len(outlets))
+        if len(errors) == 0:
+            try:
+                order = topological_order(outlets[0], self.upstream())
+            except ValueError as e:
+                errors.append(str(e))
+            else:
+                errors += ["Node %s not upstream of the outlet" % n for n in sorted(set(nodes) - set(order))]
+        if len(errors) > 0:
+            raise ValueError("Invalid network spec:\n" + "\n".join(errors))
+
+    def build(self):
+        """
+        Validates the spec and builds the pynsim network, nodes sorted from us to ds, with its topology and calendar
+        """
+        self.validate()
+
+        def arguments(row, keys):
+            return dict((k, v) for k, v in row.items() if k not in keys)
+        nodes = dict((n['name'], node_types[n['type']](**arguments(n, ['type']))) for n in self.nodes)
+        links = [link_types[link['type']](link['name'], nodes[link['start']], nodes[link['end']],
+                                          **arguments(link, ['type', 'name', 'start', 'end'])) for link in self.links]
+
+        network = Network(self.name)
+        for name in topological_order(self.outlet(), self.upstream()):
+            network.add_node(nodes[name])
+        for link in links:
+            network.add_link(link)
+        network.add_institutions(*[institution_types[i['type']](i['name']) for i in self.institutions])
+        # adjacency used by the institutions at each timestep
+        network.topology = Topology(network)
+        if self.calendar is not None:
+            set_calendar(network, self.calendar)
+        return network
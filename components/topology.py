@@ -0,0 +1,104 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+
+
+class Topology(object):
+    """
+    Integer-indexed adjacency of a network, compiled once after the network is assembled
+    One edge per incoming link of each node, in the order of node.in_links
+    Link yields and capacities are copied: compile again if they are modified
+    """
+
+    SINGLE = 0       # only one downstream reservoir: all the outflow goes through the link
+    CANAL_SPLIT = 1  # canal to the node, the rest of the outflow goes to a wadi
+    WADI_SPLIT = 2   # wadi to the node, what does not go through the canal
+    TRANSFER = 3     # underground transfer, the upstream node is not a reservoir or the node is an aquifer
+
+    def __init__(self, network):
+        self.nodes = list(network.nodes)
+        self.position = dict((n, i) for i, n in enumerate(self.nodes))
+        edge_us = []
+        edge_ds = []
+        edge_kind = []
+        edge_wadi = []  # a wadi links both nodes
+        edge_yield = []
+        edge_max_flow = []
+        edge_wadi_yield = []
+        self.us_ptr = np.zeros(len(self.nodes) + 1, dtype=int)
+        for i, n in enumerate(self.nodes):
+            for l in n.in_links:
+                us_n = l.start_node
+                edge_us.append(self.position[us_n])
+                edge_ds.append(i)
+                if us_n.component_type != 'SurfaceReservoir' or n.component_type == 'Aquifer':
+                    edge_kind.append(self.TRANSFER)
+                    edge_wadi.append(False)
+                    edge_yield.append(np.nan)
+                    edge_max_flow.append(np.nan)
+                    edge_wadi_yield.append(np.nan)
+                    continue
+                # the outlet is node 0 in the names of the links
+                link = network.get_link('RS_' + str(us_n.idx) + '-' + str(getattr(n, 'idx', 0)))
+                list_ds_n = [n2 for n2 in us_n.downstream_nodes if n2.component_type == 'SurfaceReservoir']
+                max_flow = np.nan
+                if n.component_type == 'Outlet':
+                    edge_kind.append(self.SINGLE)
+                    link_yield = link.link_yield
+                # if both a wadi and a canal come from the upstream reservoir
+                elif len(list_ds_n) > 1:
+                    if link is None:
+                        link2 = network.get_link('C_' + str(us_n.idx) + '-' + str(n.idx))
+                        edge_kind.append(self.CANAL_SPLIT)
+                        link_yield = link2.link_yield
+                        max_flow = link2.max_flow
+                    else:
+                        list_ds_n.remove(n)
+                        ds_n = list_ds_n[0]
+                        link2 = network.get_link('C_' + str(us_n.idx) + '-' + str(ds_n.idx))
+                        edge_kind.append(self.WADI_SPLIT)
+                        link_yield = link.link_yield
+                        max_flow = link2.max_flow
+                else:
+                    edge_kind.append(self.SINGLE)
+                    if link is None:
+                        link_yield = network.get_link('C_' + str(us_n.idx) + '-' + str(n.idx)).link_yield
+                    else:
+                        link_yield = link.link_yield
+                edge_wadi.append(link is not None)
+                edge_yield.append(link_yield)
+                edge_max_flow.append(max_flow)
+                edge_wadi_yield.append(link.link_yield if link is not None else np.nan)
+            self.us_ptr[i + 1] = len(edge_us)
+        self.edge_us = np.array(edge_us, dtype=int)
+        self.edge_ds = np.array(edge_ds, dtype=int)
+        self.edge_kind = np.array(edge_kind, dtype=int)
+        self.edge_wadi = np.array(edge_wadi, dtype=bool)
+        self.edge_yield = np.array(edge_yield, dtype=float)
+        self.edge_max_flow = np.array(edge_max_flow, dtype=float)
+        self.edge_wadi_yield = np.array(edge_wadi_yield, dtype=float)
+        # same edges as python objects for the institutions
+        self._edges = [list(zip([self.nodes[j] for j in self.edge_us[a:b]],
+                                self.edge_kind[a:b].tolist(), self.edge_wadi[a:b].tolist(),
+                                self.edge_yield[a:b].tolist(), self.edge_max_flow[a:b].tolist(),
+                                self.edge_wadi_yield[a:b].tolist()))
+                       for a, b in zip(self.us_ptr[:-1], self.us_ptr[1:])]
+
+    def __repr__(self):
+        return "%s(nodes=%s, edges=%s)" % (self.__class__.__name__, len(self.nodes), len(self.edge_us))
+
+    def upstream_edges(self, node):
+        """
+        Returns (upstream node, kind, wadi, yield, max_flow, wadi_yield) for each incoming link of node
+        """
+        return self._edges[self.position[node]]
+
+
+def get_topology(network):
+    """
+    Returns the topology of the network, compiled at the first call
+    """
+    if getattr(network, 'topology', None) is None:
+        network.topology = Topology(network)
+    return network.topology
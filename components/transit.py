@@ -0,0 +1,154 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+from math import comb, exp
+
+import numpy as np
+
+try:
+    from numba.extending import register_jitable
+except ImportError:  # functions called by the pure-Python kernel only
+    def register_jitable(function):
+        return function
+
+# response functions of the aquifers
+transit_kernels = ['uniform', 'exponential', 'gamma']
+
+
+def transit_weights(length, kernel='uniform', scale=12., shape=2):
+    """
+    Weights w_k = P(k) d^k of the months k = 0 (current month) to length - 1 of the window:
+    - uniform: mean of the window (P = 1, d = 1)
+    - exponential: linear reservoir of time constant scale [months] (P = 1, d = exp(-1 / scale))
+    - gamma: cascade of shape linear reservoirs (P(k) = (k + 1) ^ (shape - 1), shape integer)
+    Returns the coefficients of P (increasing degrees), d and the weights [length]
+    """
+    if kernel == 'uniform':
+        coefficients, decay = [1.], 1.
+    elif kernel == 'exponential':
+        coefficients, decay = [1.], exp(-1. / scale)
+    elif kernel == 'gamma':
+        if shape != int(shape) or shape < 1:
+            raise ValueError("Shape of the gamma kernel %s: integer >= 1 expected" % shape)
+        coefficients, decay = [float(comb(int(shape) - 1, j)) for j in range(int(shape))], exp(-1. / scale)
+    else:
+        raise ValueError("Unknown transit kernel %s (%s)" % (kernel, ', '.join(transit_kernels)))
+    k = np.arange(length, dtype=float)
+    weights = sum(c * k ** j for j, c in enumerate(coefficients)) * decay ** k
+    return np.array(coefficients), decay, weights
+
+
+@register_jitable
+def _two_sum(a, b):
+    # a + b rounded and its rounding error (Knuth)
+    summed = a + b
+    virtual = summed - a
+    return summed, (a - (summed - virtual)) + (b - virtual)
+
+
+@register_jitable
+def _accumulate(moments, value):
+    # value added to the first moment, kept as the rounded sum and its rounding error (last entry of moments)
+    c = len(moments) - 1
+    summed, error = _two_sum(moments[0], value)
+    moments[0], moments[c] = _two_sum(summed, moments[c] + error)
+
+
+@register_jitable
+def transit_advance(values, moments, slot, value, step, tail):
+    """
+    Window moved by one month, value replacing the month of slot leaving the window
+    moments[j] = sum over the window of k^j d^k x_(t-k): aged by one month (step), minus the month leaving (tail)
+    The last entry of moments is the rounding error of the first moment (compensated sum)
+    """
+    old = values[slot]
+    c = len(moments) - 1
+    for j in range(c - 1, 0, -1):
+        aged = step[j][0] * moments[0]
+        for i in range(1, j + 1):
+            aged = aged + step[j][i] * moments[i]
+        moments[j] = aged - tail[j] * old
+    moments[0] = step[0][0] * moments[0]
+    moments[c] = step[0][0] * moments[c]
+    _accumulate(moments, -tail[0] * old)
+    _accumulate(moments, value)
+    values[slot] = value
+
+
+@register_jitable
+def transit_add(values, moments, slot, value):
+    """
+    Value added to the month of slot (same age as the current month if set at this timestep)
+    """
+    old = values[slot]
+    new = old + value
+    # change of the (rounded) value of the slot
+    _accumulate(moments, -old)
+    _accumulate(moments, new)
+    values[slot] = new
+
+
+@register_jitable
+def transit_mean(moments, coefficients, total):
+    """
+    Weighted mean of the window: sum of the weights x the values over the sum of the weights, O(1)
+    """
+    weighted = coefficients[0] * (moments[0] + moments[len(moments) - 1])
+    for j in range(1, len(coefficients)):
+        weighted = weighted + coefficients[j] * moments[j]
+    return weighted / total
+
+
+class TransitTime(object):
+    """
+    Transit time in an aquifer: ring buffer of the last length months (slot timestep % length) and its weighted
+    sums updated in O(1) per month, whatever the length (see transit_weights for the kernels), the first sum with the
+    compensation of its rounding errors so that it does not drift from the sum of the window
+    set: value of a new month (the oldest month leaves the window), add: value added to a month of the window
+    initial: number or values [length] (slot order), the month before the first timestep in the last slot
+    """
+
+    def __init__(self, initial, length=24, kernel='uniform', scale=12., shape=2):
+        self.kernel = kernel
+        self.coefficients, self.decay, weights = transit_weights(length, kernel, scale, shape)
+        self.total = float(weights.sum())
+        n = len(self.coefficients)
+        # moments aged by one month: (k + 1)^j = sum_i C(j, i) k^i
+        self.step = np.array([[self.decay * comb(j, i) if i <= j else 0. for i in range(n)] for j in range(n)])
+        self.tail = np.array([float(length) ** j * self.decay ** length for j in range(n)])
+        self.values = np.zeros(length)
+        self.values[:] = initial
+        self.moments = self._moments(length - 1)
+
+    def __repr__(self):
+        return "%s(length=%s, kernel=%s, mean=%s)" % (self.__class__.__name__, len(self), self.kernel, self.mean())
+
+    def __len__(self):
+        return len(self.values)
+
+    def _moments(self, current):
+        k = (current - np.arange(len(self))) % len(self)  # age of the month of each slot
+        moments = np.zeros(len(self.coefficients) + 1)
+        moments[1:-1] = [np.sum(k ** j * self.decay ** k * self.values) for j in range(1, len(self.coefficients))]
+        for value in (self.decay ** k * self.values).tolist():
+            _accumulate(moments, value)
+        return moments
+
+    def set(self, timestep, value):
+        transit_advance(self.values, self.moments, timestep % len(self), value, self.step, self.tail)
+
+    def add(self, timestep, value):
+        transit_add(self.values, self.moments, timestep % len(self), value)
+
+    def mean(self):
+        return transit_mean(self.moments, self.coefficients, self.total)
+
+    def state(self):
+        """
+        Values and moments, as a list (see tools.checkpoint)
+        """
+        return self.values.tolist() + self.moments.tolist()
+
+    def restore(self, state):
+        self.values[:] = state[:len(self)]
+        self.moments[:] = state[len(self):]
@@ -0,0 +1,57 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+
+
+def stack_crop_data(cwr, crops, idx):
+    """
+    Stacks the crop sheets for the reservoirs idx (0 for the aquifer)
+    Returns monthly requirements [crop, reservoir, month] in mm and areas [crop, reservoir, 1984/1998/2014] in m2
+    """
+    requirements = np.zeros((len(crops), len(idx), 12))
+    areas = np.zeros((len(crops), len(idx), 3))
+    for i_c, c in enumerate(crops):
+        rows = cwr[c].idx.tolist()
+        i_r = [rows.index(i) for i in idx]
+        requirements[i_c] = cwr[c][list(range(1, 13))].values[i_r]
+        areas[i_c] = cwr[c][['area_1984', 'area_1998', 'area_2014']].values[i_r]
+    return requirements, areas
+
+
+def area_schedule(years):
+    """
+    Interpolation of the irrigated areas between 1984, 1998, 2006 and 2014
+    Area at time k: (c_a[k] * areas[..., col_a[k]] + c_b[k] * areas[..., col_b[k]]) / denom[k]
+    """
+    years = np.asarray(years, dtype=int)
+    k = np.arange(len(years))
+    # as in the original script, years after 1998 are counted from Jan 1983 (future scenarios appended)
+    periods = [years < 1984,
+               years < 1998,
+               1983 + k // 12 < 2006,
+               1983 + k // 12 < 2014]
+    c_a = np.select(periods, [1, 1998 - years, 2006 - years, 2 * (2014 - years)], 1)
+    c_b = np.select(periods, [0, years - 1984, 2 * (years - 1998), years - 2006], 0)
+    col_a = np.select(periods, [0, 0, 1, 1], 2)
+    col_b = np.select(periods, [0, 1, 1, 2], 2)
+    denom = np.select(periods, [1, 1998 - 1984, 2006 - 1998, 2014 - 2006], 1)
+    return c_a, col_a, c_b, col_b, denom
+
+
+def crop_irrigation_requirements(requirements, areas, eff_precip, years, months, irr_def):
+    """
+    Crop irrigation requirements [hm3] for all reservoirs and months in one pass
+    eff_precip: effective precipitation [reservoir, month] in mm
+    Returns an array [reservoir, month]
+    """
+    c_a, col_a, c_b, col_b, denom = area_schedule(years)
+    m = np.asarray(months, dtype=int) - 1
+    eff_precip = np.asarray(eff_precip, dtype=float)
+    cir = 0
+    # loop on crops to keep the summation order of the scalar version
+    for i_c in range(requirements.shape[0]):
+        area = (c_a * areas[i_c][:, col_a] + c_b * areas[i_c][:, col_b]) / denom
+        deficit = np.maximum(0, requirements[i_c][:, m] * (1 - irr_def) - eff_precip)
+        cir = cir + area * deficit / 1e9
+    return cir
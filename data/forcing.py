@@ -0,0 +1,117 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import json
+import os
+
+import numpy as np
+
+# forecasts of the nodes read at each timestep
+forcing_variables = ['inflow_forecast', 'nre_forecast', 'crop_demand_forecast', 'storage_forecast']
+# months written at once
+chunk_months = 12 * 1000
+
+
+class ForcingStore(object):
+    """
+    Forecasts of the nodes in memory-mapped .npy files, read by timestep without loading them in memory
+    path/index.json: months, nodes having each variable, dtype
+    path/<variable>.npy: array [node, month], one row per node having the variable
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        with open(os.path.join(path, 'index.json')) as f:
+            index = json.load(f)
+        self.T = index['T']
+        self.nodes = index['nodes']  # variable -> names of the nodes
+        self.arrays = dict((variable, np.load(os.path.join(path, variable + '.npy'), mmap_mode=mode))
+                           for variable in self.nodes)
+
+    def __repr__(self):
+        return "%s(path=%s, months=%s)" % (self.__class__.__name__, self.path, self.T)
+
+    @classmethod
+    def create(cls, path, nodes, T, dtype=np.float64):
+        """
+        Empty store (NaN) of T months, nodes: dict variable -> names of the nodes, filled with write
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for variable, names in nodes.items():
+            array = np.lib.format.open_memmap(os.path.join(path, variable + '.npy'), mode='w+', dtype=dtype,
+                                              shape=(len(names), T))
+            for start in range(0, T, chunk_months):
+                array[:, start:start + chunk_months] = np.nan
+            array.flush()
+            del array
+        with open(os.path.join(path, 'index.json'), 'w') as f:
+            json.dump({'T': T, 'nodes': nodes, 'dtype': np.dtype(dtype).name}, f, indent=1)
+        return cls(path, mode='r+')
+
+    def write(self, variable, name, start, values):
+        """
+        Writes the values of a node from the month start
+        """
+        self.arrays[variable][self.nodes[variable].index(name), start:start + len(values)] = values
+
+    def flush(self):
+        for array in self.arrays.values():
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def series(self, variable, name):
+        """
+        Forecast of a node, a view of the file
+        """
+        return self.arrays[variable][self.nodes[variable].index(name)]
+
+    def attach(self, network):
+        """
+        Replaces the forecasts of the nodes of the network by the views of the store
+        The sediments before 1983 were computed by the reservoirs from the forecasts they were built with, their
+        schedules are computed again from the store
+        """
+        for variable, names in self.nodes.items():
+            for name in names:
+                node = network.get_node(name)
+                if node is None:
+                    raise KeyError("Unknown node %s" % name)
+                setattr(node, variable, self.series(variable, name))
+                if hasattr(node, 'reset_schedule'):
+                    node.reset_schedule()
+
+    @classmethod
+    def from_network(cls, network, path, years=None, dtype=np.float64):
+        """
+        Store of the forecasts of a network built with build_network
+        years: optional sequence of years of the forecasts (0 for the first one), to write long synthetic
+        horizons resampling whole years of all the nodes and variables together, chunk by chunk (monthly networks
+        only, see components.calendar)
+        The store is as long as the shortest forecast
+        """
+        nodes = dict()
+        length = dict()
+        for variable in forcing_variables:
+            nodes[variable] = [n.name for n in network.nodes if len(getattr(n, variable, [])) > 0]
+            length.update(((variable, n.name), len(getattr(n, variable))) for n in network.nodes
+                          if len(getattr(n, variable, [])) > 0)
+        T = min(length.values())
+        if years is not None:
+            calendar = getattr(network, 'calendar', None)
+            if calendar is not None and calendar.frequency != 'monthly':
+                raise ValueError("Years resampled from a %s network: monthly forecasts expected" % calendar.frequency)
+            if len(years) > 0 and not 0 <= min(years) <= max(years) < T // 12:
+                raise ValueError("Years between 0 and %s expected (whole years of the forecasts)" % (T // 12 - 1))
+            T = 12 * len(years)
+        store = cls.create(path, nodes, T, dtype)
+        for variable, names in nodes.items():
+            for name in names:
+                values = np.asarray(getattr(network.get_node(name), variable), dtype=float)
+                for start in range(0, T, chunk_months):
+                    k = np.arange(start, min(T, start + chunk_months))
+                    if years is not None:
+                        k = 12 * np.asarray(years)[k // 12] + k % 12
+                    store.write(variable, name, start, values[k])
+        store.flush()
+        return cls(path)
@@ -0,0 +1,143 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+import pandas as pd
+
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+
+
+def file_hash(path):
+    """
+    SHA-1 of a workbook
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def sheet_key(path, kwargs):
+    """
+    Name of the cache entry of a sheet, given the arguments passed to pd.read_excel
+    """
+    h = hashlib.sha1(repr((os.path.abspath(path), sorted(kwargs.items()))).encode('utf-8')).hexdigest()[:16]
+    return os.path.splitext(os.path.basename(path))[0] + '-' + h
+
+
+def _is_valid(path, meta_file):
+    """
+    Checks the fingerprint of a cache entry: mtime first, hash only if the workbook has been touched
+    """
+    if not os.path.exists(meta_file):
+        return False
+    with open(meta_file) as f:
+        meta = json.load(f)
+    stat = os.stat(path)
+    if meta['mtime'] == stat.st_mtime and meta['size'] == stat.st_size:
+        return True
+    if meta['sha1'] != file_hash(path):
+        return False
+    # same content, new mtime
+    meta['mtime'] = stat.st_mtime
+    meta['size'] = stat.st_size
+    with open(meta_file, 'w') as f:
+        json.dump(meta, f)
+    return True
+
+
+def _write(path, entry, df):
+    """
+    Writes one .npy file per column, the column labels (any type: dates, tuples...) and the fingerprint of the
+    workbook
+    """
+    tmp = entry + '.tmp%d' % os.getpid()
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    try:
+        for j in range(len(df.columns)):
+            _save_column(os.path.join(tmp, '%d.npy' % j), df.iloc[:, j])
+        columns = np.empty(len(df.columns), dtype=object)
+        for j, col in enumerate(df.columns):
+            columns[j] = col
+        np.save(os.path.join(tmp, 'columns.npy'), columns, allow_pickle=True)
+        _save_column(os.path.join(tmp, 'index.npy'), df.index)
+        stat = os.stat(path)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': file_hash(path)}, f)
+    except Exception:
+        shutil.rmtree(tmp)
+        raise
+    if os.path.exists(entry):
+        shutil.rmtree(entry)
+    os.rename(tmp, entry)
+
+
+def load_arrays(path, **kwargs):
+    """
+    Returns the columns of a sheet as a dict of arrays, memory-mapped when numeric (copy-on-write: the arrays can be
+    modified, the cache is not)
+    The sheet is parsed with pd.read_excel(path, **kwargs) only if the cache is missing or outdated, a sheet that
+    cannot be stored is returned as parsed (not cached)
+    """
+    entry = os.path.join(cache_dir, sheet_key(path, kwargs))
+    meta_file = os.path.join(entry, 'meta.json')
+    columns_file = os.path.join(entry, 'columns.npy')
+    if not os.path.exists(columns_file) or not _is_valid(path, meta_file):
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        df = pd.read_excel(path, **kwargs)
+        try:
+            _write(path, entry, df)
+        except (TypeError, ValueError, AttributeError, pickle.PicklingError):
+            columns = list(df.columns)
+            arrays = dict((col, df.iloc[:, j].values) for j, col in enumerate(columns))
+            arrays[None] = df.index
+            return columns, arrays
+    columns = np.load(columns_file, allow_pickle=True).tolist()
+    arrays = dict()
+    for j, col in enumerate(columns):
+        arrays[col] = _load_column(os.path.join(entry, '%d.npy' % j))
+    arrays[None] = _load_column(os.path.join(entry, 'index.npy'))
+    return columns, arrays
+
+
+def _save_column(npy, values):
+    values = np.asarray(values)
+    np.save(npy, values, allow_pickle=values.dtype.kind == 'O')
+
+
+def _load_column(npy):
+    try:
+        return np.load(npy, mmap_mode='c')
+    except ValueError:  # object column (text), cannot be memory-mapped
+        return np.load(npy, allow_pickle=True)
+
+
+def read_excel(path, **kwargs):
+    """
+    Drop-in replacement for pd.read_excel using the columnar cache
+    The columns of the frame are the memory-mapped arrays of load_arrays (not copied, one block per column), unless
+    the version of pandas consolidates the columns of a dict (copied then, load_arrays keeps the mapping)
+    """
+    columns, arrays = load_arrays(path, **kwargs)
+    df = pd.DataFrame(dict((j, arrays[col]) for j, col in enumerate(columns)), index=arrays[None],
+                      columns=range(len(columns)), copy=False)
+    df.columns = columns
+    return df
+
+
+def clear_cache():
+    """
+    Removes all cached sheets
+    """
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
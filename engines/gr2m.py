@@ -0,0 +1,167 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from data.store import read_excel
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+gr2m_file = os.path.join(root_dir, 'GR2M_v4.xlsx')
+precip_file = os.path.join(root_dir, 'data', 'precip83-16_v7.xlsx')
+
+# capacity of the routing store of GR2M [mm]
+routing_capacity = 60.
+# baseflow removed from the flow at Adasiya before sharing it between the sub-basins (inflows sheet), supplied by
+# the aquifers (hist_bf of GW_Wahda and GW_Adasiya) [hm3]
+baseflow = 9.
+# column of the rainfall on the whole basin
+basin = 'YRB'
+
+
+def read_parameters(path=gr2m_file):
+    """
+    Calibrated parameters of the GR2M sheet (Adasiya): x1 [mm] (capacity of the production store, D12 = ln(x1)),
+    x2 (exchange), initial levels s0 (x1/2) and r0 [mm], area of the basin [km2]
+    """
+    sheet = read_excel(path, sheetname='GR2M', header=None)
+    x1 = float(np.exp(sheet.iloc[11, 3]))
+    return {'x1': x1, 'x2': float(sheet.iloc[12, 3]), 's0': x1 / 2, 'r0': float(sheet.iloc[16, 4]),
+            'area': float(sheet.iloc[8, 4])}
+
+
+def read_forcing(path=gr2m_file):
+    """
+    Monthly rainfall and PET of the whole basin in the GR2M sheet [mm]
+    Returns a DataFrame Year, Month, precip, pet
+    """
+    sheet = read_excel(path, sheetname='GR2M', header=None, skiprows=39, parse_cols='A:C')
+    sheet = sheet[sheet[1] == sheet[1]]
+    dates = pd.to_datetime(sheet[0])
+    return pd.DataFrame({'Year': dates.dt.year.values, 'Month': dates.dt.month.values,
+                         'precip': sheet[1].values.astype(float), 'pet': sheet[2].values.astype(float)})
+
+
+def read_areas(source):
+    """
+    Names and areas [km2] of the sub-basins (first row of the rainfall sheet)
+    """
+    header = read_excel(source, sheetname='rainfall', header=None, parse_cols='C:W')
+    return list(header.iloc[1]), header.iloc[0].values.astype(float)
+
+
+def gr2m(precip, pet, x1, x2, s0=None, r0=30.):
+    """
+    GR2M (Mouelhi et al., 2006), same equations as the GR2M sheet, vectorized over the leading axes
+    (sub-basins, rainfall ensembles, parameter sets)
+    precip, pet: [..., month] [mm]; x1, x2, s0 (x1/2 if None), r0: numbers or arrays of the leading shape
+    Returns the simulated flow [..., month] [mm]
+    """
+    precip = np.asarray(precip, dtype=float)
+    pet = np.asarray(pet, dtype=float)
+    x1 = np.asarray(x1, dtype=float)
+    x2 = np.asarray(x2, dtype=float)
+    shape = np.broadcast_shapes(precip.shape[:-1], pet.shape[:-1], x1.shape, x2.shape, np.shape(r0),
+                                np.shape(x1 if s0 is None else s0))
+    T = precip.shape[-1]
+    x1 = np.broadcast_to(x1, shape)
+    x2 = np.broadcast_to(x2, shape)
+    s = np.array(np.broadcast_to(x1 / 2 if s0 is None else s0, shape), dtype=float)  # production store [mm]
+    r = np.array(np.broadcast_to(r0, shape), dtype=float)  # routing store [mm]
+    # rain and PET scaled by the production store, computed for all the months at once
+    phi = np.tanh(precip / x1[..., None])
+    psi = np.tanh(pet / x1[..., None])
+    precip = np.broadcast_to(precip, shape + (T,))
+    phi = np.broadcast_to(phi, shape + (T,))
+    psi = np.broadcast_to(psi, shape + (T,))
+
+    q = np.empty(shape + (T,))
+    for t in range(T):
+        s1 = (s + x1 * phi[..., t]) / (1 + s / x1 * phi[..., t])
+        p1 = precip[..., t] + s - s1
+        s2 = s1 * (1 - psi[..., t]) / (1 + (1 - s1 / x1) * psi[..., t])
+        s = s2 / (1 + (s2 / x1) ** 3) ** (1 / 3.)
+        # percolation p2 = s2 - s
+        r2 = x2 * (r + p1 + s2 - s)
+        q[..., t] = r2 * r2 / (r2 + routing_capacity)
+        r = r2 - q[..., t]
+    return q
+
+
+def distribute(flow, rainfall, basin_rainfall, areas, baseflow=baseflow):
+    """
+    Flow at Adasiya shared between the sub-basins as in the inflows sheet: baseflow removed, then in proportion
+    to rainfall x area, or to the area only in the months without rain on the basin
+    flow [hm3], basin_rainfall [mm]: [..., month]; rainfall: [..., sub-basin, month] [mm]; areas [km2]
+    Returns the inflows [..., sub-basin, month] [hm3]
+    """
+    areas = np.asarray(areas, dtype=float)[:, None]
+    flow = np.maximum(0, np.asarray(flow, dtype=float) - baseflow)[..., None, :]
+    basin_rainfall = np.asarray(basin_rainfall, dtype=float)[..., None, :]
+    wet = basin_rainfall > 0
+    weights = np.where(wet, np.asarray(rainfall, dtype=float) * areas / np.where(wet, basin_rainfall, 1),
+                       areas) / areas.sum()
+    return weights * flow
+
+
+class GR2M(object):
+    """
+    Naturalized inflows of the sub-basins computed in-process: GR2M on the whole basin at Adasiya, the flow then
+    shared between the sub-basins (inflows sheet)
+    parameters: read_parameters, numbers or arrays [parameter set] (see gr2m)
+    """
+
+    def __init__(self, names, areas, parameters=None, baseflow=baseflow):
+        self.names = list(names)
+        self.areas = np.asarray(areas, dtype=float)
+        self.parameters = read_parameters() if parameters is None else dict(parameters)
+        self.baseflow = baseflow
+
+    def __repr__(self):
+        return "%s(sub-basins=%s, x1=%s, x2=%s)" % (self.__class__.__name__, len(self.names),
+                                                    self.parameters['x1'], self.parameters['x2'])
+
+    @classmethod
+    def from_workbooks(cls, source, gr2m_path=gr2m_file):
+        """
+        Sub-basins of the source workbook (e.g. data/reservoirs_1983.xlsx), parameters of the GR2M workbook
+        """
+        names, areas = read_areas(source)
+        return cls(names, areas, read_parameters(gr2m_path))
+
+    def basin_flow(self, basin_rainfall, pet):
+        """
+        Flow at Adasiya [..., month] [hm3]
+        """
+        p = self.parameters
+        return gr2m(basin_rainfall, pet, p['x1'], p['x2'], p.get('s0'), p.get('r0', 30.)) * p['area'] / 1000
+
+    def inflows(self, rainfall, basin_rainfall, pet):
+        """
+        Inflows of the sub-basins [..., sub-basin, month] [hm3]
+        rainfall: [..., sub-basin, month] in the order of names, basin_rainfall: [..., month] [mm]
+        pet: [month] or [..., month] [mm]
+        """
+        return distribute(self.basin_flow(basin_rainfall, pet), rainfall, basin_rainfall, self.areas,
+                          self.baseflow)
+
+    def frame(self, rainfall, pet):
+        """
+        Inflows in the layout of the inflows sheet (inputs['flows'])
+        rainfall: DataFrame Year, Month, sub-basins and YRB (calib_for_runoff sheet), pet: [month] [mm]
+        """
+        T = len(rainfall)
+        flows = self.inflows(rainfall[self.names].values.T, rainfall[basin].values, np.asarray(pet)[:T])
+        columns = dict((name, flows[j]) for j, name in enumerate(self.names))
+        return pd.concat([rainfall[['Year', 'Month']].reset_index(drop=True), pd.DataFrame(columns)], axis=1)
+
+    def traces(self, rainfall, basin_rainfall, pet):
+        """
+        Inflow traces of a batch of rainfall ensembles, e.g. perturbed climate
+        rainfall: [ensemble, sub-basin, month], basin_rainfall: [ensemble, month] [mm]
+        Returns a list of dicts name -> trace, the 'flows' parameter of tools.ensemble (simulate, run_traces)
+        """
+        flows = self.inflows(rainfall, basin_rainfall, pet)
+        return [dict((name, flows[i, j]) for j, name in enumerate(self.names)) for i in range(len(flows))]
@@ -0,0 +1,952 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+
+from components.calendar import MONTH, MONTH_INDEX, FRACTION, DURATION, FIRST, get_calendar
+from components.hypsometry import levels
+from components.schedule import NOT_BUILT, CREATED, BUILT, reservoir_schedule, capacity_schedule
+from components.topology import Topology, get_topology
+from components.transit import transit_add, transit_advance, transit_mean
+
+try:
+    from numba import njit
+    from numba.extending import register_jitable
+except ImportError:  # pure-Python kernel only
+    njit = None
+
+    def register_jitable(function):
+        return function
+
+# node kinds
+RESERVOIR = 0
+AQUIFER = 1
+OUTLET = 2
+
+# columns of the node parameters
+YEAR_START = 0
+YEAR_END = 1
+ETA = 2
+ETA_PIPE = 3
+RF = 4
+CROPPING_INTENSITY = 5
+SEDIMENT_PCT = 6
+INHABITANTS = 7
+HIST_BF = 8
+TRIGGER = 9
+MIN_BF = 10
+WADI_RF = 11
+INTERPOLATE_AREA = 12
+HOUSEHOLD_USE = 13
+node_parameters = ['year_start', 'year_end', 'eta', 'eta_pipe', 'rf', 'CroppingIntensity', 'sediment_pct',
+                   'inhabitants', 'hist_bf', 'trigger', 'min_bf', 'wadi_rf', 'interpolate_area', 'household_use']
+
+# columns of the node state, recorded at each timestep
+STORAGE = 0
+STORAGE_INI = 1
+CAPACITY = 2
+SEDIMENTS = 3
+ACTIVE = 4
+INFLOW = 5
+OUTFLOW = 6
+EVAPORATION = 7
+DEMAND = 8
+DEFICIT = 9
+INFLOW_TOT = 10
+INFLOW_DEFICIT = 11
+WADI_LOSSES = 12
+ALPHA = 13
+BETA = 14
+node_state = ['storage', 'storage_ini', 'capacity', 'sediments', 'active', 'inflow', 'outflow', 'evaporation',
+              'demand', 'deficit', 'inflow_tot', 'inflow_deficit', 'wadi_losses', 'alpha', 'beta']
+
+# columns of the forcing [timestep, node, forcing]
+INFLOW_FORECAST = 0
+NRE_FORECAST = 1
+CROP_DEMAND_FORECAST = 2
+STORAGE_FORECAST = 3
+node_forcing = ['inflow_forecast', 'nre_forecast', 'crop_demand_forecast', 'storage_forecast']
+
+# institution state, recorded at each timestep
+OBJECTIVE_KAC = 0
+KAC = 1
+QUANTITY_AVAILABLE = 2
+YARMOUK_TO_TIBERIAS = 3
+LOSS_TO_JORDAN_RIVER = 4
+institution_state = [('Jordan Valley Authority', 'objective_kac'), ('Jordan Valley Authority', 'kac'),
+                     ('Israel', 'quantity_available'), ('Israel', 'yarmouk_to_tiberias'),
+                     ('Israel', 'loss_to_JordanRiver')]
+
+# rows of the monthly constants of the institutions
+JVA_ALLOCATION = 0
+JVA_CONCESSION = 1
+MUKHEIBEH = 2
+KAC_94 = 3
+KAC95_07 = 4
+KAC08 = 5
+ISRAEL_ALLOCATION = 6
+ISRAEL_CONCESSION = 7
+OBS_CONCESSION = 8
+TIBERIAS = 9
+monthly_constants = ['JVA.allocation', 'JVA.concession', 'JVA.mukheibeh', 'JVA.kac_94', 'JVA.kac95_07', 'JVA.kac08',
+                     'Israel.allocation', 'Israel.concession', 'Israel.obs_concession', 'Israel.tiberias']
+
+# parameters of the annual KAC objective of JVA
+KAC_MIN = 0
+KAC_MARGIN = 1
+KAC_DECREASE = 2
+kac_rule = ['kac_min', 'kac_margin', 'kac_decrease']
+
+# ===================================================================================
+# CONFIDENTIAL DATA (numbers given in this section are false values)
+# TODO replace this data
+pct_abstractions = np.zeros(12)  # [%] as in SurfaceReservoir.setup and JVA.manage_wahda
+# ===================================================================================
+
+
+# backends of the kernel, numba if installed
+backends = ['python'] if njit is None else ['python', 'numba']
+default_backend = backends[-1]
+_compiled = dict()
+
+
+def _value(x):
+    return np.nan if x is None else x
+
+
+def _forecast(values, length):
+    forecast = np.full(length, np.nan)
+    values = np.asarray(values, dtype=float)
+    forecast[:len(values)] = values
+    return forecast
+
+
+class Kernel(object):
+    """
+    The three engines (SimulationOfSyria, TreatyOfPeace, ExchangeWithTiberias) and the setup of the nodes as one
+    array-based kernel, with the same operations in the same order as the pynsim components
+    Compiled from a network that has not been run yet (its current state is the initial state)
+    The class constants of Israel are copied: the concession is not modified in place as in pynsim
+    backend: 'python' or 'numba' (simulate compiled at the first run), default numba if installed
+    """
+
+    def __init__(self, network, backend=None):
+        if backend is None:
+            backend = default_backend
+        if backend not in backends:
+            raise ValueError("Kernel backend %s not available (%s)" % (backend, ', '.join(backends)))
+        self.backend = backend
+        topology = get_topology(network)
+        self.network = network
+        # timesteps of the forcing (components.calendar), monthly by default
+        self.calendar = get_calendar(network)
+        self.agents = network.nodes + network.institutions
+        nodes = topology.nodes
+        self.kind = np.array([{'SurfaceReservoir': RESERVOIR, 'Aquifer': AQUIFER, 'Outlet': OUTLET}[n.component_type]
+                              for n in nodes], dtype=int)
+        # edges in the order of the incoming links, for the reservoirs, the aquifers and the outlet
+        self.us_ptr = topology.us_ptr
+        self.edge_us = topology.edge_us
+        self.edge_kind = topology.edge_kind
+        self.edge_wadi = topology.edge_wadi
+        self.edge_yield = topology.edge_yield
+        self.edge_max_flow = topology.edge_max_flow
+        self.edge_wadi_yield = topology.edge_wadi_yield
+        self.transfer = Topology.TRANSFER
+        self.canal_split = Topology.CANAL_SPLIT
+        self.wadi_split = Topology.WADI_SPLIT
+
+        names = [n.name for n in nodes]
+        self.wahda = names.index('El Wahda')
+        self.gw_wahda = names.index('GW_Wahda')
+        self.outlet = names.index('Adasiya')
+
+        self.parameters = np.array([[_value(getattr(n, p, None)) for p in node_parameters] for n in nodes],
+                                   dtype=float)
+        self.state = np.array([[_value(getattr(n, p, None)) for p in node_state] for n in nodes], dtype=float)
+        self.observed_capacity = np.array([_value(getattr(n, 'observed_capacity', None)) for n in nodes], dtype=float)
+        self.area_storage = np.full((len(nodes), len(levels)), np.nan)
+        self.has_storage_forecast = np.zeros(len(nodes), dtype=bool)
+        self.has_crop_demand = np.zeros(len(nodes), dtype=bool)
+        length = max(len(getattr(n, f, [])) for n in nodes for f in node_forcing)
+        self.forcing = np.full((length, len(nodes), len(node_forcing)), np.nan)
+        for i, n in enumerate(nodes):
+            for j, f in enumerate(node_forcing):
+                self.forcing[:, i, j] = _forecast(getattr(n, f, []), length)
+            self.has_storage_forecast[i] = len(getattr(n, 'storage_forecast', [])) > 0
+            self.has_crop_demand[i] = len(getattr(n, 'crop_demand_forecast', [])) > 0
+            if self.kind[i] == RESERVOIR:
+                self.area_storage[i] = n.hypsometry.areas
+
+        # transit times of the aquifers (components.transit): values, moments and kernel of each aquifer, the
+        # moments padded with zeros to the highest degree, then the compensation of the first moment
+        aquifers = [n for n in nodes if n.component_type == 'Aquifer']
+        l_average = set(len(n.demand_average) for n in aquifers) | set(len(n.inflow_average) for n in aquifers)
+        if len(l_average) != 1:
+            raise ValueError("Aquifer averages of different lengths %s" % sorted(l_average))
+        l_average = l_average.pop()
+        n_moments = max(len(n.demand_average.coefficients) for n in aquifers)
+        self.demand_average = np.zeros((len(nodes), l_average))
+        self.inflow_average = np.zeros((len(nodes), l_average))
+        self.demand_moments = np.zeros((len(nodes), n_moments + 1))
+        self.inflow_moments = np.zeros((len(nodes), n_moments + 1))
+        self.transit_step = np.zeros((len(nodes), n_moments, n_moments))
+        self.transit_tail = np.zeros((len(nodes), n_moments))
+        self.transit_coefficients = np.zeros((len(nodes), n_moments))
+        self.transit_total = np.ones(len(nodes))
+        for i, n in enumerate(nodes):
+            if self.kind[i] == AQUIFER:
+                demand, inflow = n.demand_average, n.inflow_average
+                if not (np.array_equal(demand.step, inflow.step) and demand.total == inflow.total):
+                    raise ValueError("Demand and inflow of %s averaged with different kernels" % n.name)
+                m = len(demand.coefficients)
+                self.demand_average[i] = demand.values
+                self.inflow_average[i] = inflow.values
+                self.demand_moments[i, :m] = demand.moments[:m]
+                self.inflow_moments[i, :m] = inflow.moments[:m]
+                self.demand_moments[i, -1] = demand.moments[-1]
+                self.inflow_moments[i, -1] = inflow.moments[-1]
+                self.transit_step[i, :m, :m] = demand.step
+                self.transit_tail[i, :m] = demand.tail
+                self.transit_coefficients[i, :m] = demand.coefficients
+                self.transit_total[i] = demand.total
+
+        jva = network.get_institution('Jordan Valley Authority')
+        israel = network.get_institution('Israel')
+        institutions = {'JVA': jva, 'Israel': israel}
+        self.monthly = np.array([getattr(institutions[c.split('.')[0]], c.split('.')[1]) for c in monthly_constants],
+                                dtype=float)
+        # in pynsim, the observed concession is the concession list itself
+        self.obs_is_concession = israel.obs_concession is israel.concession
+        self.pumping_capacity = float(israel.pumping_capacity)
+        self.kac_rule = np.array([getattr(jva, r) for r in kac_rule], dtype=float)
+        self.institutions = np.array([_value(jva.objective_kac), _value(jva.kac), _value(israel.quantity_available),
+                                      _value(israel.yarmouk_to_tiberias), _value(israel.loss_to_JordanRiver)],
+                                     dtype=float)
+
+    def __repr__(self):
+        return "%s(nodes=%s, edges=%s)" % (self.__class__.__name__, len(self.kind), len(self.edge_us))
+
+    def schedule(self):
+        """
+        Phase, value given to active (-1: unchanged) and timesteps of sedimentation [timestep, node] of the
+        reservoirs, from the years of the parameters (components.schedule)
+        """
+        shape = (len(self.forcing), len(self.kind))
+        phase = np.full(shape, NOT_BUILT, dtype=np.int64)
+        set_active = np.full(shape, -1, dtype=np.int64)
+        accumulating = np.zeros(shape, dtype=bool)
+        for i in np.flatnonzero(self.kind == RESERVOIR):
+            phase[:, i], set_active[:, i], accumulating[:, i] = reservoir_schedule(
+                shape[0], self.parameters[i, YEAR_START], self.parameters[i, YEAR_END], self.calendar)
+        return phase, set_active, accumulating
+
+    def capacity_schedule(self, timesteps, phase, accumulating, state, parameters, inflow):
+        """
+        Capacity and sediments of the reservoirs at the end of each of the timesteps [timestep, node, ...], computed
+        at once from the state before the first one (components.schedule): sediment_pct x inflow while the sediments
+        accumulate
+        state [node, state, ...], parameters [node, parameter, ...], inflow forecasts [timestep, node, ...]
+        """
+        timesteps = np.asarray(timesteps, dtype=int)
+        capacity = np.full((len(timesteps),) + state[:, CAPACITY].shape, np.nan)
+        sediments = np.full_like(capacity, np.nan)
+        for i in np.flatnonzero(self.kind == RESERVOIR):
+            inflow_i = parameters[i, SEDIMENT_PCT] * inflow[timesteps, i]
+            mask = accumulating[timesteps, i].reshape((-1,) + (1,) * (inflow_i.ndim - 1))
+            capacity[:, i], sediments[:, i] = capacity_schedule(state[i, CAPACITY], state[i, SEDIMENTS],
+                                                                phase[timesteps, i], np.where(mask, inflow_i, 0.))
+        return capacity, sediments
+
+    def run(self, timesteps):
+        """
+        Runs the kernel over the timesteps, from the current state
+        Returns the histories [timestep, node, state] and [timestep, institution state]
+        """
+        node_history = np.empty((len(timesteps),) + self.state.shape)
+        institution_history = np.empty((len(timesteps), len(self.institutions)))
+        phase, set_active, accumulating = self.schedule()
+        capacity, sediments = self.capacity_schedule(timesteps, phase, accumulating, self.state, self.parameters,
+                                                     self.forcing[:, :, INFLOW_FORECAST])
+        arguments = [self.kind, self.us_ptr, self.edge_us, self.edge_kind, self.edge_wadi, self.edge_yield,
+                     self.edge_max_flow, self.edge_wadi_yield, self.transfer, self.canal_split, self.wadi_split,
+                     self.wahda, self.gw_wahda, self.outlet, self.parameters, levels, self.area_storage,
+                     self.forcing, self.calendar.table(), phase, set_active, accumulating, capacity, sediments,
+                     self.has_storage_forecast, self.has_crop_demand, self.monthly, self.obs_is_concession,
+                     self.pumping_capacity, self.kac_rule, self.transit_step, self.transit_tail,
+                     self.transit_coefficients, self.transit_total, self.state,
+                     self.demand_average, self.inflow_average, self.demand_moments, self.inflow_moments,
+                     self.institutions]
+        if self.backend == 'numba':
+            # the arrays are updated in place
+            compiled_simulate()(np.asarray(timesteps, dtype=np.int64), *(arguments + [node_history,
+                                                                                      institution_history]))
+            return node_history, institution_history
+        # plain floats in the loop: indexing numpy arrays element by element is slower than the arithmetic
+        values = [a.tolist() if isinstance(a, np.ndarray) else a for a in arguments]
+        simulate([int(t) for t in timesteps], *(values + [node_history, institution_history]))
+        updated = [self.monthly, self.state, self.demand_average, self.inflow_average, self.demand_moments,
+                   self.inflow_moments, self.institutions]
+        for a, v in zip(arguments, values):
+            if any(a is u for u in updated):
+                a[:] = v
+        return node_history, institution_history
+
+    def run_batch(self, timesteps, outputs, inflows=None, n=None, constants=None, demands=None):
+        """
+        Runs the kernel for n scenarios at once, from the current state
+        inflows: dict node name -> inflow traces [scenario, timestep] replacing the inflow forecasts
+        demands: dict node name -> crop demand traces [scenario, timestep] replacing the crop demand forecasts
+        constants: dict 'Class.constant' -> value of each scenario of the constants of the institutions: monthly
+        constants [scenario, month] (monthly_constants), 'JVA.kac_min', 'JVA.kac_margin', 'JVA.kac_decrease' and
+        'Israel.pumping_capacity' [scenario], and of the class constants of the nodes in node_parameters
+        (e.g. 'SurfaceReservoir.eta', 'Aquifer.wadi_rf') [scenario], unless a node has its own value
+        The sediments accumulated until 1983 are computed from the inflow traces and sediment_pct as in
+        SurfaceReservoir
+        outputs: list of (agent, property) recorded
+        Returns a dict (agent, property) -> array [scenario, timestep], the compiled state is not modified
+        """
+        inflows = dict() if inflows is None else inflows
+        demands = dict() if demands is None else demands
+        constants = dict() if constants is None else constants
+        if n is None:
+            traces = list(inflows.values()) + list(demands.values())
+            n = len(traces[0]) if len(traces) > 0 else 1
+        nodes = list(self.network.nodes)
+        names = [node.name for node in nodes]
+        node_kinds = {'SurfaceReservoir': RESERVOIR, 'Aquifer': AQUIFER}
+        monthly = np.repeat(self.monthly[:, :, None], n, axis=2)
+        rule = np.repeat(self.kac_rule[:, None], n, axis=1)
+        pumping_capacity = np.full(n, self.pumping_capacity)
+        # scenario axis last: the parameters of a node are a [parameter, scenario] block
+        parameters = np.repeat(self.parameters[:, :, None], n, axis=2)
+        for name, values in constants.items():
+            values = np.asarray(values, dtype=float)
+            cls, constant = name.split('.', 1) if '.' in name else (None, name)
+            if name in monthly_constants:
+                monthly[monthly_constants.index(name)] = values.T
+            elif cls == 'JVA' and constant in kac_rule:
+                rule[kac_rule.index(constant)] = values
+            elif name == 'Israel.pumping_capacity':
+                pumping_capacity[:] = values
+            elif cls in node_kinds and constant in node_parameters:
+                for i, node in enumerate(nodes):
+                    if self.kind[i] == node_kinds[cls] and constant not in vars(node):
+                        parameters[i, node_parameters.index(constant)] = values
+            else:
+                raise KeyError("Unknown constant %s" % name)
+        state = np.repeat(self.state[:, :, None], n, axis=2)
+        forcing = [self.forcing[:, :, j, None] for j in range(len(node_forcing))]
+        has_crop_demand = self.has_crop_demand.copy()
+        inflow_traces = dict()
+        for replaced, j in [(inflows, INFLOW_FORECAST), (demands, CROP_DEMAND_FORECAST)]:
+            if len(replaced) > 0:
+                forcing[j] = np.repeat(forcing[j], n, axis=2)
+            for name, traces in replaced.items():
+                i = names.index(name)
+                traces = np.asarray(traces, dtype=float)
+                forcing[j][:, i] = np.nan
+                forcing[j][:traces.shape[1], i] = traces.T
+                if j == INFLOW_FORECAST:
+                    inflow_traces[i] = traces
+                else:
+                    has_crop_demand[i] = True
+        for i, node in enumerate(nodes):
+            if self.kind[i] == RESERVOIR and self.parameters[i, YEAR_START] < 1983 and \
+                    (i in inflow_traces or 'SurfaceReservoir.sediment_pct' in constants):
+                traces = inflow_traces.get(i, np.asarray(node.inflow_forecast, dtype=float)[None])
+                total = np.add.accumulate(traces, axis=1)[:, -1]  # same order as the builtin sum
+                state[i, SEDIMENTS] = parameters[i, SEDIMENT_PCT] * total / traces.shape[1] * \
+                    self.calendar.steps_per_year * (1983 - self.parameters[i, YEAR_START])
+                state[i, CAPACITY] = self.observed_capacity[i] - state[i, SEDIMENTS]
+        recorded = []
+        for agent, prop in outputs:
+            if agent in names:
+                recorded.append((names.index(agent), node_state.index(prop)))
+            else:
+                recorded.append((-1, institution_state.index((agent, prop))))
+        history = np.empty((len(outputs), len(timesteps), n))
+        phase, set_active, accumulating = self.schedule()
+        capacity, sediments = self.capacity_schedule(timesteps, phase, accumulating, state, parameters,
+                                                     forcing[INFLOW_FORECAST])
+        simulate_batch(np.asarray(timesteps, dtype=int), self.kind, self.us_ptr, self.edge_us, self.edge_kind,
+                       self.edge_wadi, self.edge_yield, self.edge_max_flow, self.edge_wadi_yield, self.transfer,
+                       self.canal_split, self.wadi_split, self.wahda, self.gw_wahda, self.outlet, parameters, levels,
+                       self.area_storage, forcing, self.calendar.table(), phase, set_active, accumulating, capacity,
+                       sediments, self.has_storage_forecast, has_crop_demand, monthly, self.obs_is_concession,
+                       pumping_capacity, rule, self.transit_step, self.transit_tail, self.transit_coefficients,
+                       self.transit_total, state,
+                       np.repeat(self.demand_average[:, :, None], n, axis=2),
+                       np.repeat(self.inflow_average[:, :, None], n, axis=2),
+                       np.repeat(self.demand_moments[:, :, None], n, axis=2),
+                       np.repeat(self.inflow_moments[:, :, None], n, axis=2),
+                       np.repeat(self.institutions[:, None], n, axis=1), recorded, history)
+        return dict((output, history[o].T) for o, output in enumerate(outputs))
+
+    def results(self, timesteps):
+        """
+        Runs the kernel over the timesteps and returns the results in the layout of ResultsSink.as_dict
+        """
+        node_history, institution_history = self.run(timesteps)
+        properties = []
+        for agent in self.agents:
+            properties += [p for p in agent.get_properties().keys() if p not in properties]
+        values = np.full((len(timesteps), len(self.agents), len(properties)), np.nan)
+        recorded = np.zeros((len(self.agents), len(properties)), dtype=bool)
+        nodes = list(self.network.nodes)
+        for i, agent in enumerate(self.agents):
+            for j, p in enumerate(properties):
+                if p not in agent.get_properties():
+                    continue
+                recorded[i, j] = True
+                if agent in nodes:
+                    values[:, i, j] = node_history[:, nodes.index(agent), node_state.index(p)]
+                elif (agent.name, p) in institution_state:
+                    values[:, i, j] = institution_history[:, institution_state.index((agent.name, p))]
+        return {'values': values, 'timesteps': np.array(timesteps), 'agents': np.array([a.name for a in self.agents]),
+                'properties': np.array(properties), 'recorded': recorded}
+
+
+def compiled_simulate():
+    """
+    simulate compiled by numba, at the first call (cached on disk)
+    """
+    if 'simulate' not in _compiled:
+        _compiled['simulate'] = njit(cache=True)(simulate)
+    return _compiled['simulate']
+
+
+@register_jitable
+def _min(a, b):
+    # same as the builtin min(a, b), also with NaN
+    return b if b < a else a
+
+
+@register_jitable
+def _max(a, b):
+    # same as the builtin max(a, b), also with NaN
+    return b if b > a else a
+
+
+@register_jitable
+def _sum(values):
+    # same summation order as the builtin sum
+    total = 0.0
+    for v in values:
+        total += v
+    return total
+
+
+def simulate(timesteps, kind, us_ptr, edge_us, edge_kind, edge_wadi, edge_yield, edge_max_flow, edge_wadi_yield,
+             transfer, canal_split, wadi_split, wahda, gw_wahda, outlet, p, levels, area_storage, f, calendar, phase,
+             set_active, accumulating, capacity, sediments, has_storage_forecast, has_crop_demand, monthly,
+             obs_is_concession, pumping_capacity, kac_rule, transit_step, transit_tail, transit_coefficients,
+             transit_total, s, demand_average, inflow_average, demand_moments, inflow_moments, g, node_history,
+             institution_history):
+    """
+    Timesteps of the Yarmouk model on arrays, the state s (nodes), g (institutions), the aquifer averages
+    (values and moments) and the monthly constants are updated in place
+    calendar: month, month index, share of the month, duration and first step of the month of each timestep
+    (components.calendar), the monthly volumes are shared by the timesteps of the month
+    """
+    n_nodes = len(kind)
+    n_levels = len(levels)
+    l_average = len(demand_average[0])
+    obs = OBS_CONCESSION
+    if obs_is_concession:
+        obs = ISRAEL_CONCESSION
+    for k in range(len(timesteps)):
+        t = timesteps[k]
+        ct = calendar[t]
+        m = int(ct[MONTH])
+        fraction = ct[FRACTION]
+
+        # setup of the nodes
+        ft = f[t]
+        for i in range(n_nodes):
+            si = s[i]
+            pi = p[i]
+            fi = ft[i]
+            if kind[i] == RESERVOIR:
+                si[INFLOW] = fi[INFLOW_FORECAST]
+                si[DEMAND] = fi[CROP_DEMAND_FORECAST] * pi[CROPPING_INTENSITY] / pi[ETA] + \
+                    pi[INHABITANTS] * pi[HOUSEHOLD_USE] / 1e6 / pi[ETA_PIPE] * fraction
+                # assumption: dams built and destroyed in April (schedule of components.schedule)
+                if set_active[t][i] >= 0:
+                    si[ACTIVE] = set_active[t][i]
+                if phase[t][i] == CREATED:  # reservoir just created
+                    si[STORAGE_INI] = 0
+                    si[SEDIMENTS] = 0
+                elif phase[t][i] == BUILT:  # reservoir already created
+                    if t == 0:
+                        si[STORAGE] = si[STORAGE_INI]
+                    # index in the storage area relation -> evaporation
+                    # first level such that level * capacity >= storage (bisection, the levels are sorted)
+                    # (only the first level if the sediments exceed the capacity)
+                    id_s = 0
+                    hi = 0 if levels[0] * si[CAPACITY] >= si[STORAGE] else n_levels
+                    while id_s < hi:
+                        j = (id_s + hi) // 2
+                        if levels[j] * si[CAPACITY] >= si[STORAGE]:
+                            hi = j
+                        else:
+                            id_s = j + 1
+                    if id_s == n_levels:
+                        raise ValueError("Storage above the area-storage relation")
+                    area = area_storage[i][id_s]
+                    if pi[INTERPOLATE_AREA] == 1 and id_s > 0:  # same as Hypsometry.area
+                        s0 = levels[id_s - 1] * si[CAPACITY]
+                        area = area_storage[i][id_s - 1] + (si[STORAGE] - s0) * \
+                            (area - area_storage[i][id_s - 1]) / (levels[id_s] * si[CAPACITY] - s0)
+                    si[EVAPORATION] = _min(si[STORAGE], area * fi[NRE_FORECAST] / 1000)
+                    si[STORAGE_INI] = si[STORAGE] - si[EVAPORATION]
+                # sediments, until the dam is destroyed or abandoned
+                # (capacity and sediments of the schedule computed by Kernel.capacity_schedule)
+                if accumulating[t][i]:
+                    si[SEDIMENTS] = sediments[k][i]
+                    si[CAPACITY] = capacity[k][i]
+                if has_storage_forecast[i]:  # storage objective
+                    si[STORAGE] = fi[STORAGE_FORECAST]
+                    si[DEMAND] += pct_abstractions[m] / 100.0 * 0
+            elif kind[i] == AQUIFER:
+                if has_crop_demand[i]:
+                    transit_advance(demand_average[i], demand_moments[i], t % l_average,
+                                    fi[CROP_DEMAND_FORECAST] / pi[ETA], transit_step[i], transit_tail[i])
+                    transit_advance(inflow_average[i], inflow_moments[i], t % l_average, 0.0, transit_step[i],
+                                    transit_tail[i])
+            else:
+                si[INFLOW] = fi[INFLOW_FORECAST]
+
+        # SimulationOfSyria
+        wadi_losses = 0.0
+        for i in range(n_nodes):
+            si = s[i]
+            if kind[i] == RESERVOIR:
+                si[INFLOW_TOT] = si[INFLOW]
+                si[WADI_LOSSES] = 0
+                # adding outflow from current upstream reservoirs
+                for e in range(us_ptr[i], us_ptr[i + 1]):
+                    if edge_kind[e] == transfer:
+                        continue
+                    u = edge_us[e]
+                    if s[u][ACTIVE] == 1:
+                        if edge_kind[e] == canal_split:
+                            flow = _min(edge_max_flow[e], s[u][OUTFLOW])
+                        elif edge_kind[e] == wadi_split:
+                            flow = _max(0, s[u][OUTFLOW] - edge_max_flow[e])
+                        else:
+                            flow = s[u][OUTFLOW]
+                        si[INFLOW_TOT] += edge_yield[e] * flow
+                        si[WADI_LOSSES] += (1 - edge_yield[e]) * flow
+                        wadi_losses += (1 - edge_yield[e]) * flow
+                    elif edge_wadi[e]:
+                        si[INFLOW_TOT] += s[u][INFLOW_TOT]
+                if i != wahda:
+                    s_available = si[STORAGE_INI]
+                    s_max = si[CAPACITY]
+                    if si[ACTIVE] == 0:  # dam not built yet
+                        si[DEFICIT] = 0
+                    elif si[ACTIVE] == 2:  # reservoir not active anymore
+                        s_max = si[STORAGE_INI]
+                    if si[ACTIVE] > 0:
+                        if si[INFLOW_TOT] + s_available - si[DEMAND] >= 0:  # demand is met
+                            si[DEFICIT] = 0
+                            si[STORAGE] = _min(s_max, si[INFLOW_TOT] + s_available - si[DEMAND])
+                            si[OUTFLOW] = _max(0, si[INFLOW_TOT] + s_available - si[DEMAND] - s_max)
+                        else:  # demand is not met
+                            si[DEFICIT] = si[DEMAND] - si[INFLOW_TOT] - s_available
+                            si[STORAGE] = 0
+                            si[OUTFLOW] = 0
+
+            elif kind[i] == AQUIFER:
+                pi = p[i]
+                deficit = 0.0
+                inflow_tot = 0.0
+                for e in range(us_ptr[i], us_ptr[i + 1]):
+                    deficit += s[edge_us[e]][DEFICIT]
+                for e in range(us_ptr[i], us_ptr[i + 1]):
+                    u = edge_us[e]
+                    inflow_tot += p[u][RF] * (1 - p[u][ETA]) * s[u][DEMAND]
+                transit_add(demand_average[i], demand_moments[i], t % l_average, deficit)
+                si[DEMAND] = transit_mean(demand_moments[i], transit_coefficients[i], transit_total[i])
+                if i == gw_wahda:
+                    inflow_tot += pi[WADI_RF] * wadi_losses + pi[RF] * (1 - pi[ETA]) * si[DEMAND]
+                si[INFLOW_TOT] = inflow_tot
+                transit_add(inflow_average[i], inflow_moments[i], t % l_average, inflow_tot)
+                si[INFLOW] = transit_mean(inflow_moments[i], transit_coefficients[i], transit_total[i])
+                # release, monthly volumes of the aquifer for the timestep
+                hist_bf = pi[HIST_BF] * fraction
+                trigger = pi[TRIGGER] * fraction
+                min_bf = pi[MIN_BF] * fraction
+                if si[DEMAND] - si[INFLOW] <= trigger:  # pumping too low to affect the base flow
+                    si[OUTFLOW] = hist_bf
+                    si[DEFICIT] = 0
+                    for e in range(us_ptr[i], us_ptr[i + 1]):
+                        s[edge_us[e]][DEFICIT] = 0
+                elif si[DEMAND] - si[INFLOW] <= trigger + hist_bf - min_bf:
+                    # pumping decreases the level of the aquifer
+                    si[OUTFLOW] = trigger + hist_bf - si[DEMAND] + si[INFLOW]
+                    si[DEFICIT] = 0
+                    for e in range(us_ptr[i], us_ptr[i + 1]):
+                        s[edge_us[e]][DEFICIT] = 0
+                else:  # minimum base flow
+                    si[OUTFLOW] = min_bf
+                    si[DEFICIT] = si[DEMAND] - si[INFLOW] - (trigger + hist_bf - min_bf)
+                    us_satisfied_ratio = 1 - si[DEFICIT] / si[DEMAND]
+                    for e in range(us_ptr[i], us_ptr[i + 1]):
+                        s[edge_us[e]][DEFICIT] -= s[edge_us[e]][DEFICIT] * us_satisfied_ratio
+
+            else:
+                si[INFLOW_TOT] = si[INFLOW]
+
+        # TreatyOfPeace: Wahda
+        w = wahda
+        min_bf = p[gw_wahda][MIN_BF] * fraction
+        s[w][INFLOW_TOT] += s[gw_wahda][OUTFLOW]
+        diff_min_flow = s[w][INFLOW_TOT] - min_bf
+        s[w][INFLOW_TOT] -= _min(diff_min_flow, s[gw_wahda][DEFICIT])
+        if s[w][ACTIVE] == 0:  # dam not built yet
+            s[w][DEFICIT] = 0
+        else:
+            s[w][INFLOW_TOT] -= _min(s[w][INFLOW_TOT] - min_bf, pct_abstractions[m] / 100.0 * 0)
+            if s[w][INFLOW_TOT] + s[w][STORAGE_INI] - s[w][STORAGE] - s[w][DEMAND] >= 0:
+                # demand and storage objective are met
+                s[w][OUTFLOW] = s[w][INFLOW_TOT] + s[w][STORAGE_INI] - s[w][STORAGE] - s[w][DEMAND]
+                s[w][DEFICIT] = 0
+            elif s[w][INFLOW_TOT] + s[w][STORAGE_INI] - s[w][STORAGE] > 0:
+                # demand is not satisfied
+                s[w][OUTFLOW] = 0
+                s[w][DEFICIT] = s[w][DEMAND] - (s[w][INFLOW_TOT] + s[w][STORAGE_INI] - s[w][STORAGE])
+            else:
+                # storage objective is not met
+                s[w][OUTFLOW] = 0
+                s[w][STORAGE] = s[w][INFLOW_TOT] + s[w][STORAGE_INI]
+                s[w][DEFICIT] = s[w][DEMAND]
+
+        # TreatyOfPeace: flow to Adasiya
+        o = outlet
+        for e in range(us_ptr[o], us_ptr[o + 1]):
+            u = edge_us[e]
+            if kind[u] == RESERVOIR and s[u][ACTIVE] == 1:
+                s[o][INFLOW_TOT] += edge_wadi_yield[e] * s[u][OUTFLOW]
+            elif kind[u] == RESERVOIR:
+                s[o][INFLOW_TOT] += s[u][INFLOW_TOT]
+            else:
+                s[o][INFLOW_TOT] += s[u][OUTFLOW]
+        # rules from the 1994 Treaty of Peace
+        israel_share = (monthly[JVA_ALLOCATION][m] + monthly[JVA_CONCESSION][m]) * fraction
+        if ct[MONTH_INDEX] / 12 < 1995 - 1983:
+            kac = monthly[KAC_94][m] / 100 * g[OBJECTIVE_KAC] * fraction  # hm3
+        elif ct[MONTH_INDEX] / 12 < 2008 - 1983:
+            kac = monthly[KAC95_07][m] / 100 * g[OBJECTIVE_KAC] * fraction  # hm3
+        else:
+            kac = monthly[KAC08][m] / 100 * g[OBJECTIVE_KAC] * fraction  # hm3
+        mukheibeh = monthly[MUKHEIBEH][m] * fraction
+        if s[w][ACTIVE] == 1:
+            # if Wahda built and active and max storage in April (first timestep)
+            if m == 3 and ct[FIRST] == 1:
+                obj_last_year = g[OBJECTIVE_KAC]
+                g[OBJECTIVE_KAC] = _max(_max(kac_rule[KAC_MIN], s[w][STORAGE] + _sum(monthly[MUKHEIBEH])
+                                             - _sum(monthly[JVA_ALLOCATION]) - _sum(monthly[JVA_CONCESSION])
+                                             + kac_rule[KAC_MARGIN]), obj_last_year - kac_rule[KAC_DECREASE])
+            # priority 1: allocation and concession for Israel
+            # priority 2: KAC
+            if s[o][INFLOW_TOT] <= israel_share:
+                water_reserve = _min(s[w][STORAGE], israel_share - s[o][INFLOW_TOT])
+                s[w][STORAGE] -= water_reserve
+                s[w][OUTFLOW] += water_reserve
+                s[o][INFLOW_TOT] += water_reserve
+                s[o][ALPHA] = 0
+                s[o][BETA] = s[o][INFLOW_TOT]
+            else:
+                if s[o][INFLOW_TOT] - israel_share < kac - mukheibeh:
+                    water_reserve = _min(s[w][STORAGE], kac - mukheibeh - (s[o][INFLOW_TOT] - israel_share))
+                    s[w][STORAGE] -= water_reserve
+                    s[w][OUTFLOW] += water_reserve
+                    s[o][INFLOW_TOT] += water_reserve
+                s[o][ALPHA] = _min(s[o][INFLOW_TOT] - israel_share, kac - mukheibeh)
+                s[o][BETA] = s[o][INFLOW_TOT] - s[o][ALPHA]
+        else:
+            s[o][BETA] = _min(s[o][INFLOW_TOT], israel_share)
+            s[o][ALPHA] = _min(s[o][INFLOW_TOT] - s[o][BETA], kac - mukheibeh)
+            s[o][BETA] += s[o][INFLOW_TOT] - s[o][ALPHA] - s[o][BETA]
+        g[KAC] = s[o][ALPHA] + mukheibeh
+
+        # ExchangeWithTiberias
+        g[YARMOUK_TO_TIBERIAS] = _min(pumping_capacity * ct[DURATION], s[o][BETA])
+        g[LOSS_TO_JORDAN_RIVER] = s[o][BETA] - g[YARMOUK_TO_TIBERIAS]
+        allocation = monthly[ISRAEL_ALLOCATION][m] * fraction
+        concession = monthly[ISRAEL_CONCESSION][m] * fraction
+        if g[YARMOUK_TO_TIBERIAS] <= allocation:
+            g[QUANTITY_AVAILABLE] = g[YARMOUK_TO_TIBERIAS]
+            observed = 0.0
+        elif g[YARMOUK_TO_TIBERIAS] <= allocation + concession:
+            g[QUANTITY_AVAILABLE] = allocation
+            observed = g[YARMOUK_TO_TIBERIAS] - g[QUANTITY_AVAILABLE]
+        else:
+            g[QUANTITY_AVAILABLE] = g[YARMOUK_TO_TIBERIAS] - concession
+            observed = concession
+        # observed concession of the month, summed over its timesteps
+        if ct[FIRST] == 1:
+            monthly[obs][m] = observed
+        else:
+            monthly[obs][m] += observed
+        g[KAC] += _max(0, monthly[TIBERIAS][m] + (_sum(monthly[obs]) - _sum(monthly[ISRAEL_CONCESSION])) / 12) * \
+            fraction
+
+        node_history[k] = s
+        institution_history[k] = g
+
+
+def _where_min(a, b):
+    # elementwise builtin min(a, b)
+    return np.where(b < a, b, a)
+
+
+def _where_max(a, b):
+    # elementwise builtin max(a, b)
+    return np.where(b > a, b, a)
+
+
+def _sum_rows(values):
+    # sum over the first axis in the order of the builtin sum
+    total = 0.0
+    for v in values:
+        total = total + v
+    return total
+
+
+def simulate_batch(timesteps, kind, us_ptr, edge_us, edge_kind, edge_wadi, edge_yield, edge_max_flow,
+                   edge_wadi_yield, transfer, canal_split, wadi_split, wahda, gw_wahda, outlet, p, levels,
+                   area_storage, f, calendar, phase, set_active, accumulating, capacity, sediments,
+                   has_storage_forecast, has_crop_demand, monthly, obs_is_concession, pumping_capacity, kac_rule,
+                   transit_step, transit_tail, transit_coefficients, transit_total, s, demand_average, inflow_average,
+                   demand_moments, inflow_moments, g, recorded, history):
+    """
+    Same steps as simulate with a last scenario axis on the node parameters, the state, the forcing, the aquifer
+    averages and the monthly constants: the rules depending on the state are masked updates, the rules depending on
+    time are not
+    recorded: (node, state) or (-1, institution state) of the outputs, history [output, timestep, scenario]
+    """
+    n_nodes = len(kind)
+    n_levels = len(levels)
+    l_average = demand_average.shape[1]
+    obs = OBS_CONCESSION
+    if obs_is_concession:
+        obs = ISRAEL_CONCESSION
+    for k in range(len(timesteps)):
+        t = timesteps[k]
+        ct = calendar[t]
+        m = int(ct[MONTH])
+        fraction = ct[FRACTION]
+
+        # setup of the nodes
+        for i in range(n_nodes):
+            si = s[i]
+            if kind[i] == RESERVOIR:
+                si[INFLOW] = f[INFLOW_FORECAST][t, i]
+                si[DEMAND] = f[CROP_DEMAND_FORECAST][t, i] * p[i, CROPPING_INTENSITY] / p[i, ETA] + \
+                    p[i, INHABITANTS] * p[i, HOUSEHOLD_USE] / 1e6 / p[i, ETA_PIPE] * fraction
+                # assumption: dams built and destroyed in April (schedule of components.schedule)
+                if set_active[t, i] >= 0:
+                    si[ACTIVE] = set_active[t, i]
+                if phase[t, i] == CREATED:  # reservoir just created
+                    si[STORAGE_INI] = 0
+                    si[SEDIMENTS] = 0
+                elif phase[t, i] == BUILT:  # reservoir already created
+                    if t == 0:
+                        si[STORAGE] = si[STORAGE_INI]
+                    # first level such that level * capacity >= storage (bisection on all the scenarios)
+                    id_s = np.zeros(len(si[STORAGE]), dtype=int)
+                    hi = np.where(levels[0] * si[CAPACITY] >= si[STORAGE], 0, n_levels)
+                    while np.any(id_s < hi):
+                        j = (id_s + hi) // 2
+                        above = levels[np.minimum(j, n_levels - 1)] * si[CAPACITY] >= si[STORAGE]
+                        searching = id_s < hi
+                        hi = np.where(searching & above, j, hi)
+                        id_s = np.where(searching & ~above, j + 1, id_s)
+                    if np.any(id_s == n_levels):
+                        raise ValueError("Storage above the area-storage relation")
+                    area = area_storage[i, id_s]
+                    if np.any(p[i, INTERPOLATE_AREA] == 1):
+                        previous = np.maximum(id_s - 1, 0)
+                        s0 = levels[previous] * si[CAPACITY]
+                        a0 = area_storage[i, previous]
+                        with np.errstate(divide='ignore', invalid='ignore'):
+                            interpolated = a0 + (si[STORAGE] - s0) * (area - a0) / (levels[id_s] * si[CAPACITY] - s0)
+                        area = np.where((id_s > 0) & (p[i, INTERPOLATE_AREA] == 1), interpolated, area)
+                    si[EVAPORATION] = _where_min(si[STORAGE], area * f[NRE_FORECAST][t, i] / 1000)
+                    si[STORAGE_INI] = si[STORAGE] - si[EVAPORATION]
+                # sediments, until the dam is destroyed or abandoned
+                if accumulating[t, i]:
+                    si[SEDIMENTS] = sediments[k, i]
+                    si[CAPACITY] = capacity[k, i]
+                if has_storage_forecast[i]:  # storage objective
+                    si[STORAGE] = f[STORAGE_FORECAST][t, i]
+                    si[DEMAND] += pct_abstractions[m] / 100.0 * 0
+            elif kind[i] == AQUIFER:
+                if has_crop_demand[i]:
+                    transit_advance(demand_average[i], demand_moments[i], t % l_average,
+                                    f[CROP_DEMAND_FORECAST][t, i] / p[i, ETA], transit_step[i], transit_tail[i])
+                    transit_advance(inflow_average[i], inflow_moments[i], t % l_average, 0.0, transit_step[i],
+                                    transit_tail[i])
+            else:
+                si[INFLOW] = f[INFLOW_FORECAST][t, i]
+
+        # SimulationOfSyria
+        wadi_losses = 0.0
+        for i in range(n_nodes):
+            si = s[i]
+            if kind[i] == RESERVOIR:
+                si[INFLOW_TOT] = si[INFLOW]
+                si[WADI_LOSSES] = 0
+                # adding outflow from current upstream reservoirs
+                for e in range(us_ptr[i], us_ptr[i + 1]):
+                    if edge_kind[e] == transfer:
+                        continue
+                    su = s[edge_us[e]]
+                    if edge_kind[e] == canal_split:
+                        flow = _where_min(edge_max_flow[e], su[OUTFLOW])
+                    elif edge_kind[e] == wadi_split:
+                        flow = _where_max(0, su[OUTFLOW] - edge_max_flow[e])
+                    else:
+                        flow = su[OUTFLOW]
+                    active = su[ACTIVE] == 1
+                    if edge_wadi[e]:
+                        si[INFLOW_TOT] = np.where(active, si[INFLOW_TOT] + edge_yield[e] * flow,
+                                                  si[INFLOW_TOT] + su[INFLOW_TOT])
+                    else:
+                        si[INFLOW_TOT] = np.where(active, si[INFLOW_TOT] + edge_yield[e] * flow, si[INFLOW_TOT])
+                    si[WADI_LOSSES] = np.where(active, si[WADI_LOSSES] + (1 - edge_yield[e]) * flow, si[WADI_LOSSES])
+                    wadi_losses = np.where(active, wadi_losses + (1 - edge_yield[e]) * flow, wadi_losses)
+                if i != wahda:
+                    built = si[ACTIVE] > 0
+                    s_available = si[STORAGE_INI]
+                    s_max = np.where(si[ACTIVE] == 2, si[STORAGE_INI], si[CAPACITY])
+                    water = si[INFLOW_TOT] + s_available - si[DEMAND]
+                    met = water >= 0
+                    si[DEFICIT] = np.where(si[ACTIVE] == 0, 0, np.where(
+                        built, np.where(met, 0, si[DEMAND] - si[INFLOW_TOT] - s_available), si[DEFICIT]))
+                    si[STORAGE] = np.where(built, np.where(met, _where_min(s_max, water), 0), si[STORAGE])
+                    si[OUTFLOW] = np.where(built, np.where(met, _where_max(0, water - s_max), 0), si[OUTFLOW])
+
+            elif kind[i] == AQUIFER:
+                deficit = 0.0
+                inflow_tot = 0.0
+                for e in range(us_ptr[i], us_ptr[i + 1]):
+                    deficit = deficit + s[edge_us[e], DEFICIT]
+                for e in range(us_ptr[i], us_ptr[i + 1]):
+                    u = edge_us[e]
+                    inflow_tot = inflow_tot + p[u, RF] * (1 - p[u, ETA]) * s[u, DEMAND]
+                transit_add(demand_average[i], demand_moments[i], t % l_average, deficit)
+                si[DEMAND] = transit_mean(demand_moments[i], transit_coefficients[i], transit_total[i])
+                if i == gw_wahda:
+                    inflow_tot = inflow_tot + (p[i, WADI_RF] * wadi_losses + p[i, RF] * (1 - p[i, ETA]) * si[DEMAND])
+                si[INFLOW_TOT] = inflow_tot
+                transit_add(inflow_average[i], inflow_moments[i], t % l_average, inflow_tot)
+                si[INFLOW] = transit_mean(inflow_moments[i], transit_coefficients[i], transit_total[i])
+                # release, monthly volumes of the aquifer for the timestep
+                hist_bf = p[i, HIST_BF] * fraction
+                trigger = p[i, TRIGGER] * fraction
+                min_bf = p[i, MIN_BF] * fraction
+                low = si[DEMAND] - si[INFLOW] <= trigger  # pumping too low to affect the base flow
+                # pumping decreases the level of the aquifer
+                medium = ~low & (si[DEMAND] - si[INFLOW] <= trigger + hist_bf - min_bf)
+                high = ~low & ~medium  # minimum base flow
+                si[OUTFLOW] = np.where(low, hist_bf, np.where(medium, trigger + hist_bf - si[DEMAND] + si[INFLOW],
+                                                              min_bf))
+                si[DEFICIT] = np.where(high, si[DEMAND] - si[INFLOW] - (trigger + hist_bf - min_bf), 0)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    us_satisfied_ratio = 1 - si[DEFICIT] / si[DEMAND]
+                for e in range(us_ptr[i], us_ptr[i + 1]):
+                    su = s[edge_us[e]]
+                    su[DEFICIT] = np.where(high, su[DEFICIT] - su[DEFICIT] * us_satisfied_ratio, 0)
+
+            else:
+                si[INFLOW_TOT] = si[INFLOW]
+
+        # TreatyOfPeace: Wahda
+        sw = s[wahda]
+        sa = s[gw_wahda]
+        min_bf = p[gw_wahda, MIN_BF] * fraction
+        sw[INFLOW_TOT] += sa[OUTFLOW]
+        diff_min_flow = sw[INFLOW_TOT] - min_bf
+        sw[INFLOW_TOT] -= _where_min(diff_min_flow, sa[DEFICIT])
+        built = sw[ACTIVE] != 0
+        inflow_tot = sw[INFLOW_TOT] - _where_min(sw[INFLOW_TOT] - min_bf, pct_abstractions[m] / 100.0 * 0)
+        water = inflow_tot + sw[STORAGE_INI] - sw[STORAGE]
+        met = water - sw[DEMAND] >= 0  # demand and storage objective are met
+        storage_met = ~met & (water > 0)  # demand is not satisfied
+        sw[OUTFLOW] = np.where(built, np.where(met, water - sw[DEMAND], 0), sw[OUTFLOW])
+        sw[DEFICIT] = np.where(built, np.where(met, 0, np.where(storage_met, sw[DEMAND] - water, sw[DEMAND])), 0)
+        # storage objective is not met
+        sw[STORAGE] = np.where(built & ~met & ~storage_met, inflow_tot + sw[STORAGE_INI], sw[STORAGE])
+        sw[INFLOW_TOT] = np.where(built, inflow_tot, sw[INFLOW_TOT])
+
+        # TreatyOfPeace: flow to Adasiya
+        so = s[outlet]
+        for e in range(us_ptr[outlet], us_ptr[outlet + 1]):
+            su = s[edge_us[e]]
+            if kind[edge_us[e]] == RESERVOIR:
+                so[INFLOW_TOT] = np.where(su[ACTIVE] == 1, so[INFLOW_TOT] + edge_wadi_yield[e] * su[OUTFLOW],
+                                          so[INFLOW_TOT] + su[INFLOW_TOT])
+            else:
+                so[INFLOW_TOT] += su[OUTFLOW]
+        # rules from the 1994 Treaty of Peace
+        israel_share = (monthly[JVA_ALLOCATION, m] + monthly[JVA_CONCESSION, m]) * fraction
+        if ct[MONTH_INDEX] / 12 < 1995 - 1983:
+            kac = monthly[KAC_94, m] / 100 * g[OBJECTIVE_KAC] * fraction  # hm3
+        elif ct[MONTH_INDEX] / 12 < 2008 - 1983:
+            kac = monthly[KAC95_07, m] / 100 * g[OBJECTIVE_KAC] * fraction  # hm3
+        else:
+            kac = monthly[KAC08, m] / 100 * g[OBJECTIVE_KAC] * fraction  # hm3
+        mukheibeh = monthly[MUKHEIBEH, m] * fraction
+        wahda_active = sw[ACTIVE] == 1
+        # if Wahda built and active and max storage in April (first timestep)
+        if m == 3 and ct[FIRST] == 1:
+            g[OBJECTIVE_KAC] = np.where(wahda_active, _where_max(_where_max(
+                kac_rule[KAC_MIN], sw[STORAGE] + _sum_rows(monthly[MUKHEIBEH]) - _sum_rows(monthly[JVA_ALLOCATION])
+                - _sum_rows(monthly[JVA_CONCESSION]) + kac_rule[KAC_MARGIN]),
+                g[OBJECTIVE_KAC] - kac_rule[KAC_DECREASE]), g[OBJECTIVE_KAC])
+        # priority 1: allocation and concession for Israel
+        # priority 2: KAC
+        israel_first = so[INFLOW_TOT] <= israel_share
+        kac_first = ~israel_first & (so[INFLOW_TOT] - israel_share < kac - mukheibeh)
+        water_reserve = np.where(israel_first, _where_min(sw[STORAGE], israel_share - so[INFLOW_TOT]),
+                                 _where_min(sw[STORAGE], kac - mukheibeh - (so[INFLOW_TOT] - israel_share)))
+        release = wahda_active & (israel_first | kac_first)
+        sw[STORAGE] = np.where(release, sw[STORAGE] - water_reserve, sw[STORAGE])
+        sw[OUTFLOW] = np.where(release, sw[OUTFLOW] + water_reserve, sw[OUTFLOW])
+        so[INFLOW_TOT] = np.where(release, so[INFLOW_TOT] + water_reserve, so[INFLOW_TOT])
+        alpha = np.where(israel_first, 0, _where_min(so[INFLOW_TOT] - israel_share, kac - mukheibeh))
+        beta = np.where(israel_first, so[INFLOW_TOT], so[INFLOW_TOT] - alpha)
+        # Wahda not active
+        beta_inactive = _where_min(so[INFLOW_TOT], israel_share)
+        alpha_inactive = _where_min(so[INFLOW_TOT] - beta_inactive, kac - mukheibeh)
+        beta_inactive = beta_inactive + (so[INFLOW_TOT] - alpha_inactive - beta_inactive)
+        so[ALPHA] = np.where(wahda_active, alpha, alpha_inactive)
+        so[BETA] = np.where(wahda_active, beta, beta_inactive)
+        g[KAC] = so[ALPHA] + mukheibeh
+
+        # ExchangeWithTiberias
+        g[YARMOUK_TO_TIBERIAS] = _where_min(pumping_capacity * ct[DURATION], so[BETA])
+        g[LOSS_TO_JORDAN_RIVER] = so[BETA] - g[YARMOUK_TO_TIBERIAS]
+        allocation = monthly[ISRAEL_ALLOCATION, m] * fraction
+        concession = monthly[ISRAEL_CONCESSION, m] * fraction
+        below_allocation = g[YARMOUK_TO_TIBERIAS] <= allocation
+        below_concession = ~below_allocation & (g[YARMOUK_TO_TIBERIAS] <= allocation + concession)
+        g[QUANTITY_AVAILABLE] = np.where(below_allocation, g[YARMOUK_TO_TIBERIAS], np.where(
+            below_concession, allocation, g[YARMOUK_TO_TIBERIAS] - concession))
+        observed = np.where(below_allocation, 0, np.where(
+            below_concession, g[YARMOUK_TO_TIBERIAS] - g[QUANTITY_AVAILABLE], concession))
+        # observed concession of the month, summed over its timesteps
+        monthly[obs, m] = observed if ct[FIRST] == 1 else monthly[obs, m] + observed
+        g[KAC] += _where_max(0, monthly[TIBERIAS, m] + (_sum_rows(monthly[obs])
+                                                        - _sum_rows(monthly[ISRAEL_CONCESSION])) / 12) * fraction
+
+        for o in range(len(recorded)):
+            i, j = recorded[o]
+            if i < 0:
+                history[o, k] = g[j]
+            else:
+                history[o, k] = s[i, j]
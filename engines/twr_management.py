@@ -33,5 +33,5 @@ class ExchangeWithTiberias(Engine):
 
     def run(self):
         # target = Israel
-        self.target.pump_in_yarmoukeem_pool()
+        self.target.pump_in_yarmoukeem_pool(self.target.network.current_timestep)
         self.target.send_concession_back(self.target.network.current_timestep)
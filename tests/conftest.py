@@ -0,0 +1,23 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import pytest
+
+from tools.benchmark import synthetic_inputs
+from tools.ensemble import restore_constants
+
+# synthetic basin of 10 reservoirs over 10 years
+M = 120
+
+
+@pytest.fixture(scope='session')
+def inputs():
+    return synthetic_inputs(10, M)
+
+
+@pytest.fixture(autouse=True)
+def constants():
+    # the pynsim runs modify the class constants of Israel
+    restore_constants()
+    yield
+    restore_constants()
@@ -0,0 +1,83 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+import pytest
+
+from components.calendar import Calendar
+from tests.conftest import M
+from tools.benchmark import synthetic_evaporation
+from tools.model import build_network, build_simulator, check_kernel
+from tools.results import monthly_results, state_properties
+
+
+@pytest.mark.parametrize('frequency, steps', [('monthly', 1), ('weekly', 4), ('daily', None)])
+def test_timesteps(frequency, steps):
+    calendar = Calendar(M, frequency)
+    days = (np.datetime64('1983-01', 'M') + np.arange(M + 1)).astype('datetime64[D]')
+    assert calendar.days.sum() == (days[-1] - days[0]).astype(int)
+    assert len(calendar) == (M * steps if steps else calendar.days.sum())
+    # shares of the months and first steps
+    np.testing.assert_allclose(calendar.aggregate(calendar.fraction)[1], np.ones(M))
+    np.testing.assert_array_equal(calendar.dates[calendar.first], days[:-1])
+    assert calendar.timestep(1984, 2) == 13 * len(calendar) // M if steps else calendar.days[:396].sum()
+
+
+@pytest.mark.parametrize('frequency', ['weekly', 'daily'])
+def test_disaggregate(frequency):
+    calendar = Calendar(M, frequency)
+    values = np.random.RandomState(0).uniform(0, 10, (M, 3))
+    volumes = calendar.disaggregate(values)
+    states = calendar.disaggregate(values, 'state')
+    assert volumes.shape == states.shape == (len(calendar), 3)
+    months, monthly = calendar.aggregate(volumes)
+    np.testing.assert_array_equal(months, np.arange(M))
+    np.testing.assert_allclose(monthly, values, rtol=1e-12)
+    np.testing.assert_array_equal(calendar.aggregate(states, 'state')[1], values)
+    np.testing.assert_allclose(calendar.aggregate(states, 'mean')[1], values, rtol=1e-12)
+    # shorter series (e.g. the storage objective of El Wahda), months from a timestep
+    assert len(calendar.disaggregate(values[:5], 'state')) == calendar.timestep(1983, 6)
+    t = calendar.timestep(1990)
+    months, monthly = calendar.aggregate(volumes[t:], timesteps=range(t, len(calendar)))
+    np.testing.assert_array_equal(months, np.arange(84, M))
+    np.testing.assert_allclose(monthly, values[84:], rtol=1e-12)
+
+
+def test_monthly():
+    calendar = Calendar(M)
+    values = [1., 2., 3.]
+    assert calendar.disaggregate(values) is values
+    months, monthly = calendar.aggregate(np.arange(M), timesteps=range(M))
+    np.testing.assert_array_equal(months, np.arange(M))
+
+
+def test_errors():
+    with pytest.raises(ValueError, match='Unknown frequency'):
+        Calendar(M, 'hourly')
+    with pytest.raises(ValueError, match='Unknown kind'):
+        Calendar(M, 'weekly').disaggregate([1.], 'rate')
+    with pytest.raises(ValueError, match='Unknown kind'):
+        Calendar(M, 'weekly').aggregate([1.], 'rate')
+
+
+def test_monthly_results(inputs):
+    calendar = Calendar(M, 'weekly')
+    s, sink = build_simulator(build_network(inputs, evaporation=synthetic_evaporation, calendar=calendar))
+    s.start()
+    results = sink.as_dict()
+    monthly = monthly_results(results, calendar)
+    np.testing.assert_array_equal(monthly['timesteps'], np.arange(M))
+    weeks = results['values'].reshape((M, 4) + results['values'].shape[1:])
+    for j, prop in enumerate(results['properties']):
+        expected = weeks[:, -1, :, j] if prop in state_properties else weeks[:, :, :, j].sum(axis=1)
+        np.testing.assert_allclose(monthly['values'][:, :, j], expected, rtol=1e-12, err_msg=prop)
+    # monthly inflows of the outlet as the forcing
+    j = list(results['agents']).index('Adasiya')
+    np.testing.assert_allclose(monthly['values'][:, j, list(results['properties']).index('inflow')],
+                               inputs['flows']['Adasiya'], rtol=1e-12)
+
+
+@pytest.mark.parametrize('frequency', ['weekly', 'daily'])
+def test_kernel(inputs, frequency):
+    calendar = Calendar(M, frequency)
+    assert check_kernel(inputs, evaporation=synthetic_evaporation, calendar=calendar) == []
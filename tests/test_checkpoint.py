@@ -0,0 +1,62 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+import pytest
+
+from tests.conftest import M
+from tools.benchmark import synthetic_evaporation
+from tools.checkpoint import Checkpoint, get_state, load_checkpoint, resume, save_checkpoint, set_state
+from tools.ensemble import restore_constants
+from tools.model import build_network, build_simulator
+
+
+@pytest.mark.parametrize('start', [1, 61, M - 1])
+def test_resume(inputs, tmp_path, start):
+    network = build_network(inputs, evaporation=synthetic_evaporation)
+    s, sink = build_simulator(network, M)
+    checkpoint = Checkpoint(network, [start - 1])
+    s.add_engine(checkpoint)
+    s.add_engine(Checkpoint(network, [start - 1], str(tmp_path / 'state_%d.npz')))
+    s.start()
+    expected = sink.values[start:]
+
+    restore_constants()
+    network = build_network(inputs, evaporation=synthetic_evaporation)
+    set_state(network, checkpoint.states[start])
+    s, sink = build_simulator(network, M, start=start)
+    s.start()
+    np.testing.assert_array_equal(sink.values, expected)
+
+    restore_constants()
+    network = build_network(inputs, evaporation=synthetic_evaporation)
+    assert resume(network, str(tmp_path / ('state_%d.npz' % start))) == start
+    s, sink = build_simulator(network, M, start=start)
+    s.start()
+    np.testing.assert_array_equal(sink.values, expected)
+
+
+def test_save_checkpoint(inputs, tmp_path):
+    network = build_network(inputs, evaporation=synthetic_evaporation)
+    state = get_state(network)
+    save_checkpoint(network, 0, str(tmp_path / 'state.npz'))
+    assert load_checkpoint(str(tmp_path / 'state.npz')) == (0, state)
+    with pytest.raises(KeyError):
+        set_state(network, {'Unknown/storage': 0})
+
+
+def test_set_state_schedule(inputs):
+    # capacity and sediments of another state: schedule of the reservoir computed again from them
+    name = [n for n, year in zip(inputs['reservoirs'].name, inputs['reservoirs'].year) if year < 1983][0]
+    values = []
+    for shift in [0, 1]:
+        restore_constants()
+        network = build_network(inputs, evaporation=synthetic_evaporation)
+        state = get_state(network)
+        state[name + '/capacity'] += shift
+        state[name + '/sediments'] -= shift
+        set_state(network, state)
+        s, sink = build_simulator(network, M)
+        s.start()
+        values.append((network.get_node(name).capacity, network.get_node(name).sediments))
+    assert values[1] == pytest.approx((values[0][0] + 1, values[0][1] - 1))
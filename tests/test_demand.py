@@ -0,0 +1,51 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+import pandas as pd
+
+from data.demand import crop_irrigation_requirements, stack_crop_data
+from tools.benchmark import synthetic_inputs
+
+
+def requirement(requirements, areas, eff_precip, year, month, k, irr_def):
+    # former loop of the network construction over the crops, for one reservoir and one month
+    def deficit(c):
+        return max(0, requirements[c][month - 1] * (1 - irr_def) - eff_precip[k])
+    crops = range(len(requirements))
+    if year < 1984:
+        return sum([areas[c][0] * deficit(c) / 1e9 for c in crops])
+    elif year < 1998:
+        return sum([(int(1998 - year) * areas[c][0] + int(year - 1984) * areas[c][1]) / (1998 - 1984) * deficit(c) / 1e9
+                    for c in crops])
+    elif 1983 + k // 12 < 2006:
+        return sum([(int(2006 - year) * areas[c][1] + int(year - 1998) * 2 * areas[c][1]) / (2006 - 1998) *
+                    deficit(c) / 1e9 for c in crops])
+    elif 1983 + k // 12 < 2014:
+        return sum([(int(2014 - year) * 2 * areas[c][1] + int(year - 2006) * areas[c][2]) / (2014 - 2006) *
+                    deficit(c) / 1e9 for c in crops])
+    return sum([areas[c][2] * deficit(c) / 1e9 for c in crops])
+
+
+def test_crop_irrigation_requirements():
+    # 1983-2022: all the periods of the irrigated areas
+    inputs = synthetic_inputs(10, 12 * 40)
+    flows = inputs['flows']
+    requirements, areas, eff_precip = inputs['cwr_req'], inputs['cwr_areas'], inputs['cwr_precip']
+    for irr_def in [0, 0.4]:
+        cir = crop_irrigation_requirements(requirements, areas, eff_precip, flows.Year, flows.Month, irr_def)
+        expected = [[requirement(requirements[:, r], areas[:, r], eff_precip[r], flows.Year[k], flows.Month[k], k,
+                                 irr_def) for k in range(len(flows))] for r in range(len(eff_precip))]
+        np.testing.assert_array_equal(cir, expected)
+
+
+def test_stack_crop_data():
+    rng = np.random.RandomState(0)
+    cwr = dict()
+    for c in ['olive', 'citrus']:
+        cwr[c] = pd.DataFrame(rng.uniform(0, 100, (3, 15)), columns=list(range(1, 13)) +
+                              ['area_1984', 'area_1998', 'area_2014'])
+        cwr[c]['idx'] = [4, 0, 7]
+    requirements, areas = stack_crop_data(cwr, ['olive', 'citrus'], [7, 0])
+    np.testing.assert_array_equal(requirements[1, 0], cwr['citrus'].loc[2, list(range(1, 13))].values)
+    np.testing.assert_array_equal(areas[0, 1], cwr['olive'].loc[1, ['area_1984', 'area_1998', 'area_2014']].values)
@@ -0,0 +1,25 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+
+from tools import ensemble
+from tools.benchmark import synthetic_evaporation
+
+
+def test_run_ensemble(inputs, monkeypatch):
+    # the network of each value of the arguments of build_network is specified once
+    runs = [{'evaporation': synthetic_evaporation, 'SurfaceReservoir.eta': eta, 'GW_Wahda/trigger': trigger}
+            for eta in [0.5, 0.7] for trigger in [10, 20]] + [{'evaporation': synthetic_evaporation, 'irr_def': 0.2}]
+    expected = [ensemble.simulate(inputs, parameters) for parameters in runs]
+    specs = []
+    network_spec = ensemble.network_spec
+
+    def counted_spec(*args, **kwargs):
+        specs.append(kwargs)
+        return network_spec(*args, **kwargs)
+    monkeypatch.setattr(ensemble, 'network_spec', counted_spec)
+    results = ensemble.run_ensemble(inputs, runs, max_workers=0)
+    assert len(specs) == 2
+    for key in ensemble.key_outputs:
+        np.testing.assert_array_equal(results[key], [r[key] for r in expected])
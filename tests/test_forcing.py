@@ -0,0 +1,50 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+import pytest
+
+from components.calendar import Calendar
+from data.forcing import ForcingStore, forcing_variables
+from tests.conftest import M
+from tools.benchmark import synthetic_evaporation
+from tools.model import build_network, build_simulator
+
+
+def test_round_trip(inputs, tmp_path):
+    network = build_network(inputs, evaporation=synthetic_evaporation)
+    store = ForcingStore.from_network(network, str(tmp_path))
+    assert store.T == M
+    for variable in forcing_variables:
+        for name in store.nodes[variable]:
+            np.testing.assert_array_equal(store.series(variable, name), getattr(network.get_node(name), variable))
+    years = [2, 0, 2]
+    store = ForcingStore.from_network(network, str(tmp_path / 'years'), years)
+    inflow = np.asarray(network.get_node('Adasiya').inflow_forecast)
+    np.testing.assert_array_equal(store.series('inflow_forecast', 'Adasiya'),
+                                  np.concatenate([inflow[12 * y:12 * (y + 1)] for y in years]))
+    with pytest.raises(ValueError):
+        ForcingStore.from_network(network, str(tmp_path / 'outside'), [M // 12])
+
+
+def test_attach(inputs, tmp_path):
+    s, sink = build_simulator(build_network(inputs, evaporation=synthetic_evaporation), M)
+    s.start()
+    ForcingStore.from_network(build_network(inputs, evaporation=synthetic_evaporation), str(tmp_path))
+    network = build_network(inputs, evaporation=synthetic_evaporation, forcing=str(tmp_path))
+    assert isinstance(network.get_node('Adasiya').inflow_forecast, np.memmap)
+    s, store_sink = build_simulator(network)
+    s.start()
+    np.testing.assert_array_equal(store_sink.values, sink.values)
+
+
+def test_long_horizon(inputs, tmp_path):
+    network = build_network(inputs, evaporation=synthetic_evaporation)
+    ForcingStore.from_network(network, str(tmp_path), list(range(M // 12)) * 2)
+    network = build_network(inputs, evaporation=synthetic_evaporation, forcing=str(tmp_path))
+    s, sink = build_simulator(network)
+    s.start()
+    assert sink.values.shape[0] == 2 * M
+    assert not np.isnan(sink.frame('storage').values[-1]).all()
+    with pytest.raises(ValueError):
+        build_network(inputs, evaporation=synthetic_evaporation, calendar=Calendar(M), forcing=str(tmp_path))
@@ -0,0 +1,64 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import math
+
+import numpy as np
+import pytest
+
+from engines.gr2m import GR2M, distribute, gr2m, routing_capacity
+
+
+def sheet(precip, pet, x1, x2, s0, r0):
+    # equations of the GR2M sheet, month by month
+    s, r = s0, r0
+    q = []
+    for p, e in zip(precip, pet):
+        phi, psi = math.tanh(p / x1), math.tanh(e / x1)
+        s1 = (s + x1 * phi) / (1 + s / x1 * phi)
+        p1 = p + s - s1
+        s2 = s1 * (1 - psi) / (1 + (1 - s1 / x1) * psi)
+        s = s2 / (1 + (s2 / x1) ** 3) ** (1 / 3.)
+        r2 = x2 * (r + p1 + s2 - s)
+        q.append(r2 * r2 / (r2 + routing_capacity))
+        r = r2 - q[-1]
+    return q
+
+
+@pytest.fixture
+def forcing():
+    rng = np.random.RandomState(0)
+    return rng.gamma(0.8, 40, (3, 48)), np.tile([20, 30, 50, 80, 120, 160, 190, 180, 140, 90, 50, 25], 4)
+
+
+def test_gr2m(forcing):
+    precip, pet = forcing
+    x1, x2 = np.array([300., 800., 2000.]), np.array([0.6, 0.9, 1.1])
+    q = gr2m(precip, pet, x1, x2, r0=20.)
+    for i in range(3):
+        np.testing.assert_allclose(q[i], sheet(precip[i], pet, x1[i], x2[i], x1[i] / 2, 20.), rtol=1e-12)
+        # (a few ulps between the vectorized loops of numpy over different lengths)
+        np.testing.assert_allclose(gr2m(precip[i], pet, x1[i], x2[i], r0=20.), q[i], rtol=1e-12)
+    # parameter sets x rainfall ensembles
+    np.testing.assert_allclose(gr2m(precip[None], pet, x1[:, None], x2[:, None], r0=20.)[1], gr2m(
+        precip, pet, x1[1], x2[1], r0=20.), rtol=1e-12)
+
+
+def test_distribute(forcing):
+    precip, pet = forcing
+    areas = [100., 300., 600.]
+    basin_rainfall = (precip * np.array(areas)[:, None]).sum(axis=0) / sum(areas)
+    basin_rainfall[5] = 0
+    flow = np.linspace(0, 50, 48)
+    inflows = distribute(flow, precip, basin_rainfall, areas, baseflow=9.)
+    wet = basin_rainfall > 0
+    np.testing.assert_allclose(inflows.sum(axis=0)[wet], np.maximum(0, flow - 9.)[wet])
+    np.testing.assert_allclose(inflows[:, 5], np.maximum(0, flow[5] - 9.) * np.array(areas) / 1000)
+
+
+def test_traces(forcing):
+    precip, pet = forcing
+    model = GR2M(['a', 'b', 'c'], [100., 300., 600.], {'x1': 800., 'x2': 0.9, 'area': 1000.})
+    traces = model.traces(np.stack([precip, 2 * precip]), np.stack([precip[0], 2 * precip[0]]), pet)
+    assert len(traces) == 2 and sorted(traces[0]) == ['a', 'b', 'c']
+    np.testing.assert_array_equal(traces[1]['b'], model.inflows(2 * precip, 2 * precip[0], pet)[1])
@@ -0,0 +1,56 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+import pytest
+
+from components.hypsometry import Hypsometry, levels
+
+
+def scan(storage, capacity):
+    # former linear search of SurfaceReservoir.setup
+    return [s / 100.0 * capacity >= storage for s in range(0, 101, 2)].index(True)
+
+
+@pytest.fixture
+def hypsometry():
+    return Hypsometry(0.2 * 50 ** (2 / 3.0) * levels ** 0.6)
+
+
+def test_index(hypsometry):
+    rng = np.random.RandomState(0)
+    capacity = np.concatenate([rng.uniform(1, 100, 500), [50.] * len(levels)])
+    storage = np.concatenate([rng.uniform(0, 1, 500) * capacity[:500], levels * 50])
+    expected = [scan(s, c) for s, c in zip(storage, capacity)]
+    assert [hypsometry.index(s, c) for s, c in zip(storage, capacity)] == expected
+    np.testing.assert_array_equal(hypsometry.index(storage, capacity), expected)
+
+
+def test_sediments_above_capacity(hypsometry):
+    # negative capacity: the storages of the levels decrease, only the first level can be above the storage
+    for storage, capacity in [(0., -1.), (-0.5, -1.), (-1., -1.), (0., -50.)]:
+        assert hypsometry.index(storage, capacity) == scan(storage, capacity) == 0
+        assert hypsometry.area(storage, capacity) == hypsometry.areas[0]
+    np.testing.assert_array_equal(hypsometry.index(np.array([0., -0.5, 10.]), np.array([-1., -1., 50.])),
+                                  [0, 0, scan(10., 50.)])
+
+
+def test_above_capacity(hypsometry):
+    with pytest.raises(ValueError):
+        hypsometry.index(51., 50.)
+    with pytest.raises(ValueError):
+        hypsometry.index(1., -1.)
+    with pytest.raises(ValueError):
+        hypsometry.index(np.array([1., 51.]), np.array([50., 50.]))
+
+
+def test_area(hypsometry):
+    stacked = Hypsometry.stack([hypsometry, Hypsometry(2 * hypsometry.areas)])
+    storage, capacity = np.array([12.3, 12.3]), np.array([50., 50.])
+    id_s = scan(12.3, 50.)
+    np.testing.assert_array_equal(stacked.area(storage, capacity), np.array([1, 2]) * hypsometry.areas[id_s])
+    # interpolated between the levels around the storage
+    a0, a1 = hypsometry.areas[id_s - 1], hypsometry.areas[id_s]
+    expected = a0 + (12.3 - levels[id_s - 1] * 50) * (a1 - a0) / ((levels[id_s] - levels[id_s - 1]) * 50)
+    assert hypsometry.area(12.3, 50., True) == pytest.approx(expected)
+    np.testing.assert_allclose(stacked.area(storage, capacity, True), [expected, 2 * expected])
@@ -0,0 +1,79 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+import pytest
+
+from components.transit import TransitTime
+from engines.kernel import Kernel, backends
+from tests.conftest import M
+from tools.benchmark import synthetic_evaporation
+from tools.ensemble import bootstrap_flows, simulate
+from tools.model import build_network, build_simulator, check_kernel
+from tools.results import compare_results
+
+
+class ListMean(TransitTime):
+    """
+    Mean of the former lists of the aquifers: values summed in slot order at each timestep
+    """
+
+    def mean(self):
+        return sum(self.values.tolist()) / len(self)
+
+
+def test_kernel(inputs):
+    assert check_kernel(inputs, evaporation=synthetic_evaporation) == []
+
+
+@pytest.mark.parametrize('backend', backends)
+def test_sediments_above_capacity(inputs, backend):
+    # empty reservoir whose sediments exceed the capacity: first level of the area-storage relation
+    name = [n for n, year in zip(inputs['reservoirs'].name, inputs['reservoirs'].year) if year < 1983][-1]
+
+    def network():
+        network = build_network(inputs, evaporation=synthetic_evaporation)
+        reservoir = network.get_node(name)
+        reservoir.sediments = reservoir.observed_capacity + 1
+        reservoir.capacity = -1.
+        reservoir.storage_ini = 0
+        reservoir.reset_schedule()
+        return network
+    kernel = Kernel(network(), backend)
+    batch = Kernel(network(), backend).run_batch(range(M), [(name, 'evaporation')], n=2)
+    s, sink = build_simulator(network(), M)
+    s.start()
+    results = sink.as_dict()
+    assert compare_results(results, kernel.results(range(M))) == []
+    evaporation = results['values'][:, list(results['agents']).index(name), list(results['properties'])
+                                    .index('evaporation')]
+    np.testing.assert_array_equal(batch[(name, 'evaporation')], [evaporation, evaporation])
+
+
+def test_run_batch(inputs):
+    traces = bootstrap_flows(inputs['flows'], 3, seed=0)
+    network = build_network(inputs, evaporation=synthetic_evaporation)
+    outputs = [(n.name, p) for n in network.nodes for p in ['storage', 'release', 'outflow']
+               if p in n.get_properties()] + [('Jordan Valley Authority', 'kac'), ('Israel', 'quantity_available')]
+    inflows = dict((name, [trace[name] for trace in traces]) for name in traces[0])
+    batch = Kernel(network).run_batch(range(M), outputs, inflows=inflows)
+    for k, trace in enumerate(traces):
+        results = simulate(inputs, {'evaporation': synthetic_evaporation, 'flows': trace}, outputs)
+        for o in outputs:
+            np.testing.assert_array_equal(batch[o][k], results[o], err_msg=str(o))
+
+
+def test_transit_mean(inputs):
+    # the running sums of the aquifer averages are rounded once, the former sums at each addition: histories within
+    # a relative tolerance of 1e-9 (differences of a few ulps, amplified by the differences of volumes)
+    values = []
+    for former in [False, True]:
+        network = build_network(inputs, evaporation=synthetic_evaporation)
+        if former:
+            for n in network.get_nodes('Aquifer'):
+                n.demand_average = ListMean(n.demand_average.values, len(n.demand_average))
+                n.inflow_average = ListMean(n.inflow_average.values, len(n.inflow_average))
+        s, sink = build_simulator(network, M)
+        s.start()
+        values.append(sink.values)
+    np.testing.assert_allclose(values[0], values[1], rtol=1e-9, atol=1e-12)
@@ -0,0 +1,103 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+from pynsim import Engine
+
+from tests.conftest import M
+from tools.benchmark import synthetic_evaporation, synthetic_inputs
+from tools.model import build_network, build_simulator
+
+
+def current_upstream(node):
+    # former SurfaceReservoir.current_upstream_reservoirs
+    cur_us_reservoirs = []
+    res_tmp = [us_n for us_n in node.upstream_nodes if us_n.component_type == 'SurfaceReservoir']
+    while len(res_tmp) > 0:
+        if res_tmp[0].active == 1:
+            cur_us_reservoirs.append(res_tmp[0])
+        else:
+            for us_r in res_tmp[0].upstream_nodes:
+                if us_r.component_type == 'SurfaceReservoir':
+                    link = node.network.get_link('RS_' + str(us_r.idx) + '-' + str(res_tmp[0].idx))
+                    if link is not None:
+                        res_tmp.append(us_r)
+        res_tmp.remove(res_tmp[0])
+    return cur_us_reservoirs
+
+
+def sort_upstream(node, upstream):
+    # former SurfaceReservoir.all_current_upstream_reservoirs and all_upstream_reservoirs
+    all_us_reservoirs = []
+    us_res_tmp = upstream(node)
+    while len(us_res_tmp) > 0:
+        res_tmp = us_res_tmp
+        us_res_tmp = []
+        for res in res_tmp:
+            if res in all_us_reservoirs:
+                all_us_reservoirs.remove(res)
+            all_us_reservoirs.insert(0, res)
+            us_res_tmp += upstream(res)
+    return all_us_reservoirs
+
+
+def upstream(node):
+    return [us_n for us_n in node.upstream_nodes if us_n.component_type == 'SurfaceReservoir']
+
+
+class UpstreamCheck(Engine):
+    """
+    Upstream reservoirs of the reservoirs compared with the former searches at each timestep
+    """
+    name = "Upstream check"
+
+    def __init__(self, target, **kwargs):
+        super(UpstreamCheck, self).__init__(target, **kwargs)
+        self.differences = []
+        self.checked = 0
+
+    def run(self):
+        for n in self.target.get_nodes('SurfaceReservoir'):
+            for method, expected in [('current_upstream_reservoirs', current_upstream(n)),
+                                     ('all_current_upstream_reservoirs', sort_upstream(n, current_upstream)),
+                                     ('all_upstream_reservoirs', sort_upstream(n, upstream))]:
+                self.checked += 1
+                if getattr(n, method)() != expected:
+                    self.differences.append((self.timestep, n.name, method))
+
+
+def test_upstream_reservoirs(inputs):
+    network = build_network(inputs, evaporation=synthetic_evaporation)
+    s, sink = build_simulator(network, M)
+    check = UpstreamCheck(network)
+    s.add_engine(check)
+    s.start()
+    assert check.checked > 0
+    assert check.differences == []
+
+
+def test_sorted_upstream():
+    # reservoirs found at the same level through several paths, random active states
+    network = build_network(synthetic_inputs(60, 24), evaporation=synthetic_evaporation)
+    rng = np.random.RandomState(0)
+    for k in range(20):
+        for n in network.get_nodes('SurfaceReservoir'):
+            n.active = rng.choice([0, 1, 1, 2])
+        for n in network.nodes:
+            if hasattr(n, 'all_upstream_reservoirs'):
+                assert n.all_current_upstream_reservoirs() == sort_upstream(n, current_upstream)
+                assert n.all_upstream_reservoirs() == sort_upstream(n, upstream)
+
+
+def test_active_transition(inputs):
+    # the memoized upstream reservoirs follow the active state of the reservoirs
+    network = build_network(inputs, evaporation=synthetic_evaporation)
+    for n in network.get_nodes('SurfaceReservoir'):
+        n.active = 1
+    node = [n for n in network.get_nodes('SurfaceReservoir') if len(upstream(n)) > 0][0]
+    assert node.current_upstream_reservoirs() == upstream(node)
+    for res in upstream(node):
+        res.active = 2
+        assert node.current_upstream_reservoirs() == current_upstream(node)
+        assert node.all_current_upstream_reservoirs() == sort_upstream(node, current_upstream)
+    assert node.current_upstream_reservoirs() != upstream(node)
@@ -0,0 +1,35 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+
+from tests.conftest import M
+from tools import scenarios
+from tools.benchmark import synthetic_evaporation
+from tools.ensemble import restore_constants
+from tools.model import build_network, build_simulator
+
+
+def test_noop_branch(inputs):
+    branches = {'noop': [(60, scenarios.SetAttribute([], 'eta', 1))]}
+    results = scenarios.run_tree(inputs, branches, max_workers=0, evaporation=synthetic_evaporation)
+    assert scenarios.differences(results) == {'noop': []}
+    np.testing.assert_array_equal(results['noop']['values'], results['base']['values'])
+
+
+def test_branch(inputs):
+    # branch run from its fork = full run with the interventions scheduled from the start
+    # (a reservoir destroyed earlier: its schedule is computed again from the fork)
+    branches = {'efficiency': [(60, scenarios.Efficiency(0.1))], 'cut': [(48, scenarios.DemandCut(0.9))],
+                'rehabilitation': [(60, scenarios.Rehabilitation(['Res_9'], end_year=1990))]}
+    results = scenarios.run_tree(inputs, branches, max_workers=0, evaporation=synthetic_evaporation)
+    for name, interventions in branches.items():
+        restore_constants()
+        network = build_network(inputs, evaporation=synthetic_evaporation)
+        scenarios.schedule(network, interventions)
+        s, sink = build_simulator(network, M)
+        s.start()
+        np.testing.assert_array_equal(results[name]['values'], sink.values)
+        differences = scenarios.differences(results)[name]
+        assert len(differences) > 0
+        assert all(month >= scenarios.fork_timestep(interventions) for _, _, month, _ in differences)
@@ -0,0 +1,96 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import asyncio
+import json
+
+import pytest
+
+from tests.conftest import M
+from tools.ensemble import key_outputs, simulate
+from tools.scenarios import Rehabilitation
+from tools.service import SimulationService, scenario
+
+
+@pytest.mark.parametrize('request_', [[], {'unknown': 1}, {'parameters': {'SurfaceReservoir.unknown': 1}},
+                                      {'treaty': {'allocation': [1] * 11}}, {'treaty': {'unknown': [1] * 12}},
+                                      {'interventions': [{'type': 'Unknown', 'timestep': 0}]},
+                                      {'interventions': [{'type': 'Efficiency'}]},
+                                      {'interventions': [{'type': 'Efficiency', 'timestep': M}]},
+                                      {'interventions': [{'type': 'Efficiency', 'timestep': 0, 'unknown': 1}]},
+                                      {'outputs': [['Adasiya']]}, {'months': 0}, {'months': M + 1},
+                                      {'backend': 'unknown'},
+                                      {'backend': 'kernel', 'interventions': [{'type': 'Efficiency', 'timestep': 0}]}])
+def test_scenario_errors(request_):
+    with pytest.raises(ValueError):
+        scenario(request_, M)
+
+
+def test_scenario():
+    parameters, interventions, outputs, months, backend = scenario(
+        {'treaty': {'allocation': [2] * 12}, 'interventions': [{'type': 'Rehabilitation', 'year': 1985, 'month': 4}],
+         'outputs': [['El Wahda', 'storage']], 'months': 60}, M)
+    assert parameters == {'JVA.allocation': [2.] * 12, 'Israel.allocation': [2.] * 12}
+    assert [(t, type(i)) for t, i in interventions] == [(27, Rehabilitation)]
+    assert (outputs, months, backend) == ([('El Wahda', 'storage')], 60, 'pynsim')
+
+
+async def http(port, method, path, content=None):
+    # status, headers and body of a request to the service
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    body = b'' if content is None else json.dumps(content).encode('utf-8')
+    writer.write(b'%s %s HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s' % (method.encode(), path.encode(), len(body), body))
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), head.decode('latin-1'), body
+
+
+def chunks(body):
+    # JSON lines of a chunked body
+    lines = []
+    while True:
+        size, _, body = body.partition(b'\r\n')
+        if int(size, 16) == 0:
+            return lines
+        lines.append(json.loads(body[:int(size, 16)]))
+        body = body[int(size, 16) + 2:]
+
+
+def test_service(inputs):
+    service = SimulationService(inputs, max_workers=0)
+    expected = simulate(inputs, {'irr_def': 0.4})
+
+    async def requests():
+        service.start()
+        server = await asyncio.start_server(service.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            status = await http(port, 'GET', '/status')
+            assert status[0] == 200 and json.loads(status[2])['months'] == M
+            assert (await http(port, 'GET', '/unknown'))[0] == 404
+            assert (await http(port, 'GET', '/run'))[0] == 405
+            assert (await http(port, 'POST', '/run', {'months': 0}))[0] == 400
+            assert (await http(port, 'POST', '/run', {'outputs': [['Unknown', 'storage']]}))[0] == 400
+            assert (await http(port, 'POST', '/run', {'outputs': [['El Wahda', 'unknown']]}))[0] == 400
+            assert (await http(port, 'POST', '/run', {'parameters': {'Unknown/trigger': 1}}))[0] == 400
+            # runs in the thread of the service, one at a time
+            run = asyncio.ensure_future(http(port, 'POST', '/run', {}))
+            stream = asyncio.ensure_future(http(port, 'POST', '/run', {'stream': True}))
+            code, _, body = await run
+            assert code == 200
+            outputs = json.loads(body)['outputs']
+            code, head, body = await stream
+            assert code == 200 and 'chunked' in head
+            lines = chunks(body)
+        finally:
+            server.close()
+            await server.wait_closed()
+            service.stop()
+        return outputs, lines
+    outputs, lines = asyncio.run(requests())
+    for a, p in key_outputs:
+        assert outputs['%s/%s' % (a, p)] == pytest.approx(list(expected[(a, p)]), nan_ok=True)
+        assert [line['values']['%s/%s' % (a, p)] for line in lines[:-1]] == outputs['%s/%s' % (a, p)]
+    assert [line['timestep'] for line in lines[:-1]] == list(range(M))
+    assert lines[-1] == {'done': True}
@@ -0,0 +1,103 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+import pytest
+
+from components.spec import NetworkSpec, topological_order
+from tools.benchmark import synthetic_evaporation, synthetic_inputs
+from tools.model import network_spec
+
+
+def wiring(outlet, upstream):
+    """
+    Former wiring loop of build_network: nodes sorted from us to ds, visited level by level from the outlet
+    upstream: function node -> nodes upstream (e.g. the pynsim upstream_nodes)
+    """
+    nodes = [outlet]
+    us_nodes_tmp = upstream(outlet)
+    while len(us_nodes_tmp) > 0:
+        nodes_tmp = list(us_nodes_tmp)
+        us_nodes_tmp = []
+        for n in nodes_tmp:
+            if n in nodes:
+                nodes.remove(n)
+            nodes.insert(0, n)  # sorting from us to ds
+            for us_n in upstream(n):
+                us_nodes_tmp.append(us_n)
+    return nodes
+
+
+def random_upstream(n_nodes, seed):
+    # random DAG, node 0 the outlet, each node linked to one or two nodes closer to the outlet, links in random order
+    rng = np.random.RandomState(seed)
+    links = [(i, j) for i in range(1, n_nodes) for j in rng.choice(i, min(i, rng.randint(1, 3)), replace=False)]
+    upstream = dict((i, []) for i in range(n_nodes))
+    for k in rng.permutation(len(links)):
+        upstream[links[k][1]].append(links[k][0])
+    return upstream
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_topological_order(seed):
+    upstream = random_upstream(20, seed)
+    assert topological_order(0, upstream) == wiring(0, upstream.get)
+
+
+@pytest.mark.parametrize('n_reservoirs, T', [(10, 12), (60, 24)])
+def test_build(n_reservoirs, T):
+    spec = network_spec(synthetic_inputs(n_reservoirs, T), evaporation=synthetic_evaporation)
+    network = spec.build()
+    former = wiring(network.get_node(spec.outlet()), lambda n: n.upstream_nodes)
+    assert [n.name for n in network.nodes] == [n.name for n in former]
+    assert [n.name for n in network.nodes] == wiring(spec.outlet(), spec.upstream().get)
+
+
+def test_cycle():
+    with pytest.raises(ValueError, match='Cycle'):
+        topological_order(0, {0: [1], 1: [2], 2: [1]})
+
+
+def unknown_type(nodes, links):
+    nodes[0]['type'] = 'Lake'
+
+
+def unknown_node(nodes, links):
+    links[0]['end'] = 'Tiberias'
+
+
+def to_itself(nodes, links):
+    links[0]['end'] = links[0]['start']
+
+
+def link_name(nodes, links):
+    [link for link in links if link['type'] == 'RiverSection'][0]['name'] += '0'
+
+
+def duplicated(nodes, links):
+    nodes.append(dict(nodes[0]))
+
+
+def isolated(nodes, links):
+    nodes.append({'type': 'Aquifer', 'name': 'GW_Isolated', 'x': 0, 'y': 0, 'hist_bf': 1})
+
+
+def cycle(nodes, links):
+    # GW_Wahda -> reservoir -> GW_Wahda
+    start = [link['start'] for link in links if link['end'] == 'GW_Wahda'][0]
+    links.append({'type': 'UndergroundTransfer', 'name': 'GW_to_' + start, 'start': 'GW_Wahda', 'end': start})
+
+
+@pytest.mark.parametrize('change, error', [(unknown_type, 'Unknown type Lake'),
+                                           (unknown_node, 'Unknown end node Tiberias'),
+                                           (to_itself, 'from a node to itself'), (link_name, 'should be named'),
+                                           (duplicated, 'Duplicated node'),
+                                           (isolated, 'Node GW_Isolated not upstream of the outlet'),
+                                           (cycle, 'Cycle in the links')])
+def test_validate(inputs, change, error):
+    spec = network_spec(inputs, evaporation=synthetic_evaporation)
+    spec.validate()
+    nodes, links = spec.nodes, spec.links
+    change(nodes, links)
+    with pytest.raises(ValueError, match=error):
+        NetworkSpec(spec.name, nodes, links, spec.institutions, spec.calendar).validate()
@@ -0,0 +1,74 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data import store
+
+
+@pytest.fixture
+def workbook(tmp_path, monkeypatch):
+    # workbook of numbers parsed by a counted pd.read_excel, cache in tmp_path
+    monkeypatch.setattr(store, 'cache_dir', str(tmp_path / 'cache'))
+    parsed = []
+
+    def read_excel(path, **kwargs):
+        parsed.append(kwargs)
+        with open(path) as f:
+            values = [float(v) for v in f.read().split()]
+        return pd.DataFrame({'flow': values, 'year': [1983 + k for k in range(len(values))], 'name': 'Wahda'})
+    monkeypatch.setattr(store.pd, 'read_excel', read_excel)
+    path = str(tmp_path / 'book.xlsx')
+    with open(path, 'w') as f:
+        f.write('1 2 3')
+    return path, parsed
+
+
+def test_cache(workbook):
+    path, parsed = workbook
+    df = store.read_excel(path, sheetname='inflows')
+    assert list(df.columns) == ['flow', 'year', 'name'] and list(df.flow) == [1, 2, 3]
+    pd.testing.assert_frame_equal(store.read_excel(path, sheetname='inflows'), df)
+    assert len(parsed) == 1
+    # other arguments: other entry
+    store.read_excel(path, sheetname='storage')
+    assert len(parsed) == 2
+
+
+def test_invalidation(workbook):
+    path, parsed = workbook
+    store.read_excel(path)
+    # touched, same content: cache kept, then checked on the mtime only
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    store.read_excel(path)
+    assert len(parsed) == 1
+    with open(path, 'w') as f:
+        f.write('4 5 6 7')
+    assert list(store.read_excel(path).flow) == [4, 5, 6, 7]
+    assert len(parsed) == 2
+    store.clear_cache()
+    store.read_excel(path)
+    assert len(parsed) == 3
+
+
+def test_mapped_columns(workbook, monkeypatch):
+    path, parsed = workbook
+    store.read_excel(path)
+    loaded = []
+    load_column = store._load_column
+
+    def recorded(npy):
+        loaded.append(load_column(npy))
+        return loaded[-1]
+    monkeypatch.setattr(store, '_load_column', recorded)
+    df = store.read_excel(path)
+    assert all(isinstance(a, np.memmap) for a in loaded[:2])
+    assert np.shares_memory(df.flow.values, loaded[0])
+    # copy-on-write: the frame can be modified, not the cache
+    df.loc[0, 'flow'] = 10
+    assert store.read_excel(path).flow[0] == 1
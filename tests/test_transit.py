@@ -0,0 +1,73 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+from math import fsum
+
+import numpy as np
+import pytest
+
+from components.transit import TransitTime, transit_add, transit_advance, transit_mean, transit_weights
+
+
+def run(window, steps, seed=0):
+    # months set then added to, as by the aquifers and Syria
+    rng = np.random.RandomState(seed)
+    for t in range(steps):
+        window.set(t, rng.uniform(0, 10))
+        window.add(t, rng.uniform(0, 1))
+        yield t
+
+
+@pytest.mark.parametrize('initial', [4.2, np.arange(24) / 7.])
+def test_uniform(initial):
+    window = TransitTime(initial, 24)
+    for t in run(window, 20000):
+        values = window.values.tolist()
+        # running sum equal to the sum of the window rounded once: no drift
+        assert window.moments[0] == fsum(values)
+        assert window.mean() == fsum(values) / 24
+        # former mean of the lists, rounded at each addition: within (length - 1) rounding errors
+        assert window.mean() == pytest.approx(sum(values) / 24, rel=24 * 2 ** -53)
+
+
+@pytest.mark.parametrize('kernel, shape', [('exponential', 2), ('gamma', 2), ('gamma', 3)])
+def test_weighted(kernel, shape):
+    window = TransitTime(4.2, 36, kernel, 6., shape)
+    weights = transit_weights(36, kernel, 6., shape)[2]
+    for t in run(window, 2000):
+        age = (t - np.arange(36)) % 36
+        assert window.mean() == pytest.approx(np.sum(weights[age] * window.values) / weights.sum(), rel=1e-12)
+
+
+def test_batch():
+    # same updates on a [slot, scenario] window as on each scenario
+    windows = [TransitTime(x, 12, 'gamma', 4., 2) for x in [1., 2., 3.]]
+    values = np.array([w.values for w in windows]).T
+    moments = np.array([w.moments for w in windows]).T
+    rng = np.random.RandomState(0)
+    for t in range(500):
+        set_values, added = rng.uniform(0, 10, 3), rng.uniform(0, 1, 3)
+        transit_advance(values, moments, t % 12, set_values, windows[0].step, windows[0].tail)
+        transit_add(values, moments, t % 12, added)
+        for k, w in enumerate(windows):
+            w.set(t, set_values[k])
+            w.add(t, added[k])
+        np.testing.assert_array_equal(transit_mean(moments, windows[0].coefficients, windows[0].total),
+                                      [w.mean() for w in windows])
+
+
+def test_state():
+    window = TransitTime(4.2, 24)
+    list(run(window, 100))
+    restored = TransitTime(0., 24)
+    restored.restore(window.state())
+    list(run(window, 100, seed=1))
+    list(run(restored, 100, seed=1))
+    assert restored.state() == window.state()
+
+
+def test_unknown_kernel():
+    with pytest.raises(ValueError):
+        TransitTime(1., 24, 'triangular')
+    with pytest.raises(ValueError):
+        TransitTime(1., 24, 'gamma', shape=1.5)
@@ -0,0 +1,2 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
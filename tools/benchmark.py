@@ -0,0 +1,231 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from components.hypsometry import levels
+from components.topology import Topology
+from data.demand import crop_irrigation_requirements
+from engines.kernel import Kernel, backends
+from tools.model import crops, load_inputs, build_network, build_simulator
+
+# synthetic basins timed by run_suite: (reservoirs, months)
+suite = [(10, 400), (100, 400), (1000, 400), (10000, 400), (10, 5000), (10, 50000)]
+# evaporation of the synthetic basins [mm], above the synthetic rainfall (net evaporation > 0)
+synthetic_evaporation = [150] * 12
+
+
+def time_backends(inputs, T=None, repeat=3, **kwargs):
+    """
+    Best time [s] of repeat runs over T months with the pynsim engines and each backend of the kernel
+    The network is built before each run (not timed), the numba kernel is compiled before the first run
+    kwargs: arguments of build_network
+    """
+    if T is None:
+        T = len(inputs['flows'])
+    timings = dict()
+    for backend in ['pynsim'] + backends:
+        if backend == 'numba':
+            Kernel(build_network(inputs, **kwargs), backend).run(range(T))
+        for r in range(repeat):
+            network = build_network(inputs, **kwargs)
+            if backend == 'pynsim':
+                s, _ = build_simulator(network, T, results=False)
+                start = time.time()
+                s.start()
+            else:
+                kernel = Kernel(network, backend)
+                start = time.time()
+                kernel.run(range(T))
+            elapsed = time.time() - start
+            timings[backend] = min(elapsed, timings.get(backend, elapsed))
+    return timings
+
+
+def synthetic_inputs(n_reservoirs, T, seed=0, canal_fraction=0.05):
+    """
+    Inputs of a synthetic basin with the layout of load_inputs, to be built by build_network with synthetic_evaporation
+    Reservoir 1 is El Wahda (wadi to Adasiya), reservoir k > 1 drains through a wadi to a reservoir < k or Adasiya
+    and a fraction of the reservoirs has a canal to another reservoir < k
+    """
+    rng = np.random.RandomState(seed)
+    idx = np.arange(1, n_reservoirs + 1)
+    names = ['El Wahda'] + ['Res_%d' % k for k in idx[1:]]
+    river = np.array([0] + [0 if rng.rand() < 0.1 else rng.randint(1, k) for k in idx[1:]])
+    canal = np.full(n_reservoirs, np.nan)
+    for i in range(2, n_reservoirs):
+        if rng.rand() < canal_fraction:
+            k = rng.randint(1, idx[i])
+            if k != river[i]:
+                canal[i] = k
+    capacity = np.round(rng.lognormal(1, 1, n_reservoirs), 3)
+    capacity[0] = 110
+    year = rng.randint(1960, 2011, n_reservoirs)
+    year[0] = 2007
+    end_year = np.where(rng.rand(n_reservoirs) < 0.2, year + rng.randint(20, 40, n_reservoirs), np.nan)
+    end_year[0] = np.nan
+    use = np.where(rng.rand(n_reservoirs) < 0.8, 'Farming', 'Potable supply')
+    use[0] = 'Potable supply'
+    inhabitants = np.where(rng.rand(n_reservoirs) < 0.3, rng.randint(1000, 200000, n_reservoirs), np.nan)
+    reservoirs = pd.DataFrame({'idx': idx, 'name': names, 'manager': 'Syria',
+                               'east': rng.randint(220000, 310000, n_reservoirs),
+                               'north': rng.randint(210000, 290000, n_reservoirs), 'year': year,
+                               'end_year': end_year, 'capacity': capacity, 'use': use, 'inhabitants': inhabitants,
+                               'river': river, 'canal': canal})
+
+    k = np.arange(T)
+    season = 1 + np.cos(2 * np.pi * (k % 12) / 12.0)  # wet in winter
+    flows = dict((dam, rng.gamma(2, capacity[i] / 20, T) * season) for i, dam in enumerate(names))
+    flows['Adasiya'] = rng.gamma(2, 5, T) * season
+    flows = pd.concat([pd.DataFrame({'Year': 1983 + k // 12, 'Month': k % 12 + 1}), pd.DataFrame(flows)], axis=1)
+    precip = pd.DataFrame(dict((dam, np.minimum(100, rng.gamma(2, 10, T) * season)) for dam in names))  # [mm]
+    # area-storage relations [km2]
+    A_S = pd.DataFrame(dict((dam, 0.2 * capacity[i] ** (2 / 3.0) * levels ** 0.6) for i, dam in enumerate(names)))
+
+    farming = [i for i in range(n_reservoirs) if use[i] == 'Farming']
+    cwr_req = rng.uniform(0, 150, (len(crops), len(farming) + 1, 12))  # [mm]
+    cwr_areas = rng.uniform(0, 1e6, (len(crops), len(farming) + 1, 3))  # [m2]
+    cwr_precip = rng.gamma(2, 10, (len(farming) + 1, T))  # [mm]
+
+    return {'eff_precip': None, 'contributive_weighted_precip': precip, 'A_S': A_S, 'cwr': None, 'flows': flows,
+            # below the capacity of El Wahda whatever the sediments
+            'wahda_storage': pd.Series(np.zeros(T)), 'reservoirs': reservoirs, 'farming': farming,
+            'cwr_req': cwr_req, 'cwr_areas': cwr_areas, 'cwr_precip': cwr_precip}
+
+
+def time_stages(inputs=None, T=None, irr_def=0.4, export=True, kernel=True, **kwargs):
+    """
+    Time [s] of each stage of a run over T months:
+    - load: input workbooks (only if inputs is None)
+    - demand: crop irrigation requirements, also part of build
+    - build: network with its topology, topology: compilation of the topology alone
+    - network setup, nodes, links, institutions: setup at each timestep (pynsim timings)
+    - one entry per engine, history: rest of Simulator.start (pynsim histories, off by default in build_simulator)
+    - export: results saved in a npz file
+    - kernel compile, kernel run: default backend of engines.kernel (compiled before if numba)
+    kwargs: arguments of build_network
+    """
+    timings = dict()
+    start = time.time()
+    if inputs is None:
+        inputs = load_inputs()
+        timings['load'] = time.time() - start
+    if T is None:
+        T = len(inputs['flows'])
+    flows = inputs['flows']
+
+    start = time.time()
+    crop_irrigation_requirements(inputs['cwr_req'], inputs['cwr_areas'], inputs['cwr_precip'], flows.Year,
+                                 flows.Month, irr_def)
+    timings['demand'] = time.time() - start
+
+    start = time.time()
+    network = build_network(inputs, irr_def=irr_def, **kwargs)
+    timings['build'] = time.time() - start
+    start = time.time()
+    Topology(network)
+    timings['topology'] = time.time() - start
+
+    s, sink = build_simulator(network, T, results=export)
+    s.record_time = True
+    start = time.time()
+    s.start()
+    total = time.time() - start
+    timings['network setup'] = s.timing['network']
+    for part in ['nodes', 'links', 'institutions']:
+        timings[part] = s.timing[part]
+    timings.update(s.timing['engines'])
+    timings['history'] = total - sum(timings[p] for p in ['network setup', 'nodes', 'links', 'institutions'] +
+                                     list(s.timing['engines']))
+
+    if export:
+        path = os.path.join(tempfile.mkdtemp(), 'results.npz')
+        start = time.time()
+        sink.save(path)
+        timings['export'] = time.time() - start
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+    if kernel:
+        if backends[-1] == 'numba':
+            Kernel(build_network(inputs, irr_def=irr_def, **kwargs)).run(range(min(T, 12)))
+        network = build_network(inputs, irr_def=irr_def, **kwargs)
+        start = time.time()
+        k = Kernel(network)
+        timings['kernel compile'] = time.time() - start
+        start = time.time()
+        k.run(range(T))
+        timings['kernel run'] = time.time() - start
+    return timings
+
+
+def run_suite(sizes=suite, seed=0, **kwargs):
+    """
+    Stage timings of the 1983 configuration and of the synthetic basins of sizes [(reservoirs, months)]
+    kwargs: arguments of time_stages
+    """
+    results = {'1983': time_stages(**kwargs)}
+    for n_reservoirs, T in sizes:
+        results['%d reservoirs x %d months' % (n_reservoirs, T)] = \
+            time_stages(synthetic_inputs(n_reservoirs, T, seed), evaporation=synthetic_evaporation, **kwargs)
+    return results
+
+
+def save_baseline(results, path):
+    """
+    Writes the timings and the environment in a JSON file
+    """
+    baseline = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                'backends': backends, 'timings': results}
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+
+
+def compare_baseline(results, path, tolerance=0.25, min_time=0.01):
+    """
+    Stages slower than the JSON baseline by more than tolerance [ratio], ignoring stages faster than min_time [s]
+    Returns a list of (case, stage, baseline time, time)
+    """
+    with open(path) as f:
+        baseline = json.load(f)['timings']
+    regressions = []
+    for case in sorted(set(results) & set(baseline)):
+        for stage in sorted(set(results[case]) & set(baseline[case])):
+            old, new = baseline[case][stage], results[case][stage]
+            if new > min_time and new > (1 + tolerance) * old:
+                regressions.append((case, stage, old, new))
+    return regressions
+
+
+def report(timings, reference='pynsim'):
+    """
+    One line per backend: time and speedup against the reference
+    """
+    lines = []
+    for backend in sorted(timings, key=lambda b: -timings[b]):
+        lines.append('%-8s %10.5f s   x%.1f' % (backend, timings[backend], timings[reference] / timings[backend]))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    # python -m tools.benchmark [baseline.json]: the baseline is written if it does not exist
+    print(report(time_backends(load_inputs())))
+    results = run_suite()
+    for case in sorted(results):
+        print(case)
+        for stage in sorted(results[case], key=lambda p: -results[case][p]):
+            print('    %-20s %10.5f s' % (stage, results[case][stage]))
+    baseline_file = sys.argv[1] if len(sys.argv) > 1 else 'benchmark_baseline.json'
+    if os.path.exists(baseline_file):
+        for case, stage, old, new in compare_baseline(results, baseline_file):
+            print('regression: %s, %s: %.5f s -> %.5f s' % (case, stage, old, new))
+    else:
+        save_baseline(results, baseline_file)
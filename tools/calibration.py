@@ -0,0 +1,211 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from data.store import read_excel
+from engines.gr2m import GR2M, gr2m_file, precip_file, basin, read_forcing
+from tools.ensemble import simulate, restore_constants, _defaults, _spec_cache, parametrized_classes
+from tools.model import data_dir, build_network
+from tools.pool import executor, worker, worker_count
+
+# calibrated parameters: (name, lower bound, upper bound), names of tools.ensemble.simulate or 'GR2M.x1'/'GR2M.x2'
+calibrated_parameters = [('SurfaceReservoir.eta', 0.3, 0.9),
+                         ('SurfaceReservoir.rf', 0, 0.6),
+                         ('SurfaceReservoir.sediment_pct', 0, 0.005),
+                         ('GW_Wahda/trigger', 5, 25),
+                         ('GW_Wahda/min_bf', 0, 2),
+                         ('Aquifer.wadi_rf', 0.3, 1),
+                         ('RiverSection.link_yield', 0.2, 1)]
+gr2m_parameters = [('GR2M.x1', 500, 5000), ('GR2M.x2', 0.5, 1.2)]
+
+# observed series: (agent, property) compared to the simulation
+adasiya_flow = ('Adasiya', 'inflow_tot')
+wahda_storage = ('El Wahda', 'storage')
+
+
+def read_observations(source_file='reservoirs_1983.xlsx', gr2m_path=gr2m_file):
+    """
+    Observed flows at Adasiya (GR2M sheet) and storage of El Wahda (storage sheet) [hm3], NaN when not available
+    (confidential data, replaced by X in the workbooks)
+    Returns a dict (agent, property) -> array [month]
+    """
+    flows = read_excel(gr2m_path, sheetname='GR2M', header=None, skiprows=39, parse_cols='A:E')
+    flows = flows[flows[1] == flows[1]]
+    storage = read_excel(os.path.join(data_dir, source_file), sheetname='storage', skiprows=[0], parse_cols='A:C')
+    return {adasiya_flow: pd.to_numeric(flows[4], errors='coerce').values,
+            wahda_storage: pd.to_numeric(storage['El Wahda'], errors='coerce').values}
+
+
+def runoff_forcing(source_file='reservoirs_1983.xlsx'):
+    """
+    GR2M of the source workbook and its forcing (rainfall of the sub-basins and the basin, PET), read once and
+    sent to the workers with the calibration
+    """
+    runoff = GR2M.from_workbooks(os.path.join(data_dir, source_file))
+    rainfall = read_excel(precip_file, sheetname='calib_for_runoff')
+    return runoff, rainfall[runoff.names].values.T, rainfall[basin].values, read_forcing().pet.values
+
+
+def nash(simulated, observed):
+    """
+    Nash-Sutcliffe efficiency over the observed months (NaN: missing)
+    """
+    observed = np.asarray(observed, dtype=float)
+    simulated = np.asarray(simulated, dtype=float)
+    T = min(len(observed), len(simulated))
+    known = ~np.isnan(observed[:T]) & ~np.isnan(simulated[:T])
+    o = observed[:T][known]
+    s = simulated[:T][known]
+    if len(o) < 2:
+        return np.nan
+    return 1 - np.sum((s - o) ** 2) / np.sum((o - o.mean()) ** 2)
+
+
+class Calibration(object):
+    """
+    Parameters of the model fitted to observed series by differential evolution (DE/rand/1/bin), each generation
+    simulated over a process pool
+    observed: dict (agent, property) -> array [month] (see read_observations), weights: same keys (1 by default)
+    parameters: list of (name, lower bound, upper bound), see calibrated_parameters
+    runoff: runoff_forcing, needed for the GR2M parameters; the inflows of each run are simulated from this forcing,
+    which covers the inputs loaded with test_future=0
+    fixed: parameters shared by all the runs (tools.ensemble.simulate)
+    Score to minimize: sum over the series of weight x (1 - Nash)
+    """
+
+    def __init__(self, inputs, observed, parameters=calibrated_parameters, weights=None, runoff=None, fixed=None,
+                 backend='kernel'):
+        self.inputs = inputs
+        self.observed = dict((key, value) for key, value in observed.items()
+                             if (~np.isnan(np.asarray(value, dtype=float))).sum() > 1)
+        if len(self.observed) == 0:
+            raise ValueError("No observations to calibrate against")
+        self.weights = dict((key, 1.) for key in self.observed) if weights is None else weights
+        self.names = [p[0] for p in parameters]
+        self.bounds = np.array([(p[1], p[2]) for p in parameters], dtype=float)
+        self.runoff = runoff
+        self.fixed = dict() if fixed is None else fixed
+        self.backend = backend
+        if any(name.startswith('GR2M.') for name in self.names):
+            if runoff is None:
+                raise ValueError("GR2M parameters need the runoff forcing")
+            if runoff[1].shape[-1] != len(inputs['flows']):
+                raise ValueError("Forcing of %s months for %s months of inputs"
+                                 % (runoff[1].shape[-1], len(inputs['flows'])))
+
+    def __repr__(self):
+        return "%s(parameters=%s, observed=%s)" % (self.__class__.__name__, self.names, list(self.observed))
+
+    def parameters(self, x):
+        """
+        Parameters of tools.ensemble.simulate given a vector x, with the inflows simulated by GR2M if needed
+        """
+        parameters = dict(self.fixed)
+        gr2m = dict()
+        for name, value in zip(self.names, x):
+            if name.startswith('GR2M.'):
+                gr2m[name.split('.', 1)[1]] = float(value)
+            else:
+                parameters[name] = float(value)
+        if len(gr2m) > 0:
+            runoff, rainfall, basin_rainfall, pet = self.runoff
+            model = GR2M(runoff.names, runoff.areas, dict(runoff.parameters, **gr2m), runoff.baseflow)
+            if 'x1' in gr2m:
+                model.parameters['s0'] = gr2m['x1'] / 2
+            parameters['flows'] = model.traces(rainfall[None], basin_rainfall[None], pet)[0]
+        return parameters
+
+    def default_vector(self):
+        """
+        Current values of the parameters (class constants, attributes of the network, parameters of GR2M)
+        """
+        network = None
+        x = []
+        for name in self.names:
+            if name.startswith('GR2M.'):
+                x.append(self.runoff[0].parameters[name.split('.', 1)[1]])
+            elif '/' in name:
+                if network is None:
+                    restore_constants()
+                    network = build_network(self.inputs)
+                agent, attribute = name.split('/', 1)
+                x.append(getattr(network.get_node(agent) or network.get_institution(agent), attribute))
+            else:
+                cls, constant = name.split('.', 1)
+                x.append(_defaults[cls].get(constant, getattr(parametrized_classes[cls], constant)))
+        return np.array(x, dtype=float)
+
+    def score(self, x, specs=None):
+        """
+        Weighted sum of 1 - Nash over the observed series (inf if the run fails)
+        specs: cache of the network specs of the runs (see tools.ensemble._build)
+        """
+        try:
+            results = simulate(self.inputs, self.parameters(x), list(self.observed), self.backend, specs)
+        except (ValueError, ZeroDivisionError, FloatingPointError):
+            return np.inf
+        score = sum(self.weights[key] * (1 - nash(results[key], observed)) for key, observed in self.observed.items())
+        return score if score == score else np.inf
+
+    def run(self, population=None, generations=30, mutation=0.7, crossover=0.9, seed=None, max_workers=None,
+            tolerance=1e-6, initial=True):
+        """
+        Differential evolution over generations, population: number of vectors (10 per parameter by default)
+        initial: the current values of the parameters are one of the first vectors
+        max_workers=0 runs the simulations in the current process
+        Returns a dict: best vector x, its parameters and score, best score of each generation (history)
+        """
+        n = len(self.names)
+        size = population or 10 * n
+        rng = np.random.RandomState(seed)
+        low, high = self.bounds[:, 0], self.bounds[:, 1]
+        vectors = low + rng.uniform(size=(size, n)) * (high - low)
+        if initial:
+            vectors[0] = np.clip(self.default_vector(), low, high)
+
+        pool = executor(self, max_workers, _spec_cache)
+        chunksize = max(1, size // (4 * worker_count(max_workers)))
+
+        def evaluate(xs):
+            return list(pool.map(_score, xs, chunksize=chunksize))
+        try:
+            scores = np.array(evaluate(vectors))
+            history = [scores.min()]
+            for generation in range(generations):
+                trials = de_trials(rng, vectors, low, high, mutation, crossover)
+                trial_scores = np.array(evaluate(trials))
+                better = trial_scores <= scores
+                vectors[better] = trials[better]
+                scores[better] = trial_scores[better]
+                history.append(scores.min())
+                if np.isfinite(scores).all() and scores.max() - scores.min() < tolerance:
+                    break
+        finally:
+            pool.shutdown()
+        best = int(np.argmin(scores))
+        return {'x': vectors[best], 'parameters': dict(zip(self.names, vectors[best])), 'score': scores[best],
+                'history': history, 'population': vectors, 'scores': scores}
+
+
+def de_trials(rng, vectors, low, high, mutation, crossover):
+    """
+    Trial vectors of differential evolution (DE/rand/1/bin) [vector, parameter]: mutation from three other vectors,
+    bounced back between the bounds and the parent, binomial crossover with at least one mutated parameter
+    """
+    size, n = vectors.shape
+    others = np.array([rng.choice(np.delete(np.arange(size), i), 3, replace=False) for i in range(size)])
+    mutants = vectors[others[:, 0]] + mutation * (vectors[others[:, 1]] - vectors[others[:, 2]])
+    mutants = np.where(mutants < low, low + rng.uniform(size=mutants.shape) * (vectors - low), mutants)
+    mutants = np.where(mutants > high, high - rng.uniform(size=mutants.shape) * (high - vectors), mutants)
+    crossed = rng.uniform(size=(size, n)) < crossover
+    crossed[np.arange(size), rng.randint(0, n, size)] = True
+    return np.where(crossed, mutants, vectors)
+
+
+def _score(x):
+    calibration, specs = worker()
+    return calibration.score(x, specs)
@@ -0,0 +1,107 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+from pynsim import Engine
+
+from components.transit import TransitTime
+
+
+def agent_state(agent):
+    """
+    Attributes of an agent carried from one timestep to the next: its properties and the _state of its class
+    """
+    return sorted(agent._properties) + list(getattr(agent, '_state', []))
+
+
+def get_state(network):
+    """
+    Copy of the state of the nodes and institutions: dict 'agent/attribute' -> value (number, list or None)
+    Transit times of the aquifers as lists (TransitTime.state)
+    """
+    state = dict()
+    for agent in network.nodes + network.institutions:
+        for attribute in agent_state(agent):
+            value = getattr(agent, attribute)
+            if isinstance(value, TransitTime):
+                value = value.state()
+            state[agent.name + '/' + attribute] = list(value) if isinstance(value, list) else value
+    return state
+
+
+def set_state(network, state):
+    """
+    Restores a state of get_state
+    Lists are modified in place: Israel.obs_concession is the class list Israel.concession
+    The schedules of the reservoirs are computed again from the restored capacity and sediments
+    """
+    for key, value in state.items():
+        name, attribute = key.split('/', 1)
+        agent = network.get_node(name) or network.get_institution(name)
+        if agent is None:
+            raise KeyError("Unknown agent %s" % name)
+        current = getattr(agent, attribute, None)
+        if isinstance(current, TransitTime):
+            current.restore(value)
+        elif isinstance(value, list) and isinstance(current, list):
+            current[:] = value
+        else:
+            setattr(agent, attribute, value)
+    for n in network.nodes:
+        if hasattr(n, 'reset_schedule'):
+            n.reset_schedule()
+
+
+def save_checkpoint(network, timestep, path):
+    """
+    Writes the state of the network in a compressed npz file, timestep: next timestep to simulate
+    """
+    state = get_state(network)
+    arrays = dict((key, np.asarray(value)) for key, value in state.items() if value is not None)
+    np.savez_compressed(path, _timestep=timestep, _none=np.array([key for key in state if state[key] is None]),
+                        **arrays)
+
+
+def load_checkpoint(path):
+    """
+    Reads a checkpoint of save_checkpoint
+    Returns the next timestep to simulate and the state
+    """
+    with np.load(path) as f:
+        state = dict((key, f[key].tolist() if f[key].ndim > 0 else f[key][()])
+                     for key in f.files if not key.startswith('_'))
+        state.update((key, None) for key in f['_none'].tolist())
+        return int(f['_timestep']), state
+
+
+def resume(network, path):
+    """
+    Restores the state of a checkpoint in a network built with build_network
+    Returns the next timestep to simulate (start of build_simulator)
+    """
+    timestep, state = load_checkpoint(path)
+    set_state(network, state)
+    return timestep
+
+
+class Checkpoint(Engine):
+    """
+    Engine saving the state of the network at the end of the given timesteps, to be added after the other engines
+    path: file name with %d replaced by the next timestep to simulate, e.g. 'results/state_%d.npz'
+    path=None: states kept in memory, in states (next timestep -> state)
+    """
+    name = "Checkpoint"
+
+    def __init__(self, target, timesteps, path=None, **kwargs):
+        super(Checkpoint, self).__init__(target, **kwargs)
+        # target = network
+        self.timesteps = set(timesteps)
+        self.path = path
+        self.states = dict()
+
+    def run(self):
+        if self.timestep in self.timesteps:
+            if self.path is None:
+                self.states[self.timestep + 1] = get_state(self.target)
+            else:
+                save_checkpoint(self.target, self.timestep + 1, self.path % (self.timestep + 1))
@@ -0,0 +1,211 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import copy
+import itertools
+
+import numpy as np
+
+from components.node import SurfaceReservoir, Aquifer
+from components.link import RiverSection
+from components.institution import JVA, Israel
+from engines.kernel import Kernel
+from tools.model import build_network, build_simulator, network_spec
+from tools.pool import executor, worker, worker_count
+
+# outputs aggregated over the runs: (agent, property)
+key_outputs = [('Adasiya', 'alpha'), ('Adasiya', 'beta'), ('Jordan Valley Authority', 'kac'), ('El Wahda', 'storage')]
+
+# class constants that can be changed in a run, as 'Class.constant'
+parametrized_classes = dict((c.__name__, c) for c in [SurfaceReservoir, Aquifer, RiverSection, JVA, Israel])
+# arguments of build_network that can be changed in a run
+network_arguments = ['irr_def', 'evaporation']
+
+# constants as defined in the classes (some lists are modified during a run, e.g. Israel.concession)
+_defaults = dict((name, dict((k, copy.deepcopy(v)) for k, v in vars(cls).items()
+                             if not k.startswith('_') and isinstance(v, (int, float, str, list))))
+                 for name, cls in parametrized_classes.items())
+
+
+def restore_constants():
+    """
+    Resets the class constants to their default values
+    """
+    for name, constants in _defaults.items():
+        for k, v in constants.items():
+            setattr(parametrized_classes[name], k, copy.deepcopy(v))
+
+
+def simulate(inputs, parameters=None, outputs=key_outputs, backend='pynsim', specs=None):
+    """
+    Runs one simulation with parameters overriding the default model:
+    - 'Class.constant': class constant (e.g. 'SurfaceReservoir.eta', 'JVA.allocation', 'RiverSection.link_yield')
+    - 'agent/attribute': attribute of a node or institution of the built network (e.g. 'GW_Wahda/trigger')
+    - 'irr_def', 'evaporation': arguments of build_network
+    - 'flows': dict of inflow traces replacing columns of inputs['flows']
+    backend: 'pynsim' (engines) or 'kernel' (engines.kernel)
+    specs: cache of the network specs of the runs (see _build)
+    Returns a dict (agent, property) -> array [timestep]
+    """
+    restore_constants()
+    try:
+        network = _build(inputs, parameters, specs)
+        T = len(inputs['flows'])
+        if backend == 'kernel':
+            results = Kernel(network).results(range(T))
+        else:
+            agents = [network.get_node(a) or network.get_institution(a) for a in set(a for a, p in outputs)]
+            s, sink = build_simulator(network, T, agents=agents, properties=list(set(p for a, p in outputs)))
+            s.start()
+            results = sink.as_dict()
+    finally:
+        restore_constants()
+    agent_names = list(results['agents'])
+    properties = list(results['properties'])
+    return dict(((a, p), results['values'][:, agent_names.index(a), properties.index(p)]) for a, p in outputs)
+
+
+def _build(inputs, parameters, specs=None):
+    """
+    Network built with the parameters of a run, class constants are set (restore_constants to reset them)
+    specs: dict caching the spec of the network for each value of the arguments of build_network (unless the
+    flows are replaced), the network is then only instantiated from its spec
+    """
+    parameters = dict() if parameters is None else parameters
+    kwargs = dict()
+    attributes = dict()
+    for key, value in parameters.items():
+        if '/' in key:
+            attributes[key] = value
+        elif key == 'flows':
+            inputs = dict(inputs)
+            inputs['flows'] = inputs['flows'].copy()
+            for name, trace in value.items():
+                inputs['flows'][name] = np.asarray(trace, dtype=float)
+        elif key in network_arguments:
+            kwargs[key] = value
+        elif '.' in key and key.split('.')[0] in parametrized_classes:
+            setattr(parametrized_classes[key.split('.')[0]], key.split('.', 1)[1], copy.deepcopy(value))
+        else:
+            raise KeyError("Unknown parameter %s" % key)
+    if specs is None or 'flows' in parameters:
+        network = build_network(inputs, **kwargs)
+    else:
+        arguments = tuple((k, tuple(v) if isinstance(v, list) else v) for k, v in sorted(kwargs.items()))
+        if arguments not in specs:
+            specs[arguments] = network_spec(inputs, **kwargs)
+        network = specs[arguments].build()
+    for key, value in attributes.items():
+        name, attribute = key.split('/', 1)
+        agent = network.get_node(name) or network.get_institution(name)
+        if agent is None:
+            raise KeyError("Unknown agent %s" % name)
+        setattr(agent, attribute, copy.deepcopy(value))
+        if hasattr(agent, 'reset_schedule'):
+            agent.reset_schedule()
+    return network
+
+
+def compile_kernel(inputs, **kwargs):
+    """
+    Kernel compiled from the network of the inputs with the default class constants (kwargs: arguments of
+    build_network), to be shared by batched runs (not modified by run_batch)
+    """
+    restore_constants()
+    try:
+        return Kernel(build_network(inputs, **kwargs))
+    finally:
+        restore_constants()
+
+
+def run_traces(inputs, traces, parameters=None, outputs=key_outputs):
+    """
+    Runs all the inflow traces (list of dicts name -> trace, e.g. bootstrap_flows) in one batched kernel call
+    parameters: same as simulate, shared by all the traces
+    Returns a dict (agent, property) -> array [trace, timestep]
+    """
+    restore_constants()
+    try:
+        kernel = Kernel(_build(inputs, parameters))
+    finally:
+        restore_constants()
+    inflows = dict((name, np.array([trace[name] for trace in traces])) for name in traces[0])
+    return kernel.run_batch(range(len(inputs['flows'])), outputs, inflows=inflows)
+
+
+def _spec_cache(shared):
+    # network specs of the runs of a worker (see _build)
+    return dict()
+
+
+def _run(job):
+    parameters, outputs, backend = job
+    inputs, specs = worker()
+    return simulate(inputs, parameters, outputs, backend, specs)
+
+
+def run_ensemble(inputs, runs, outputs=key_outputs, max_workers=None, backend='pynsim'):
+    """
+    Runs the simulations defined by a list of parameters over a process pool
+    Inputs are sent once to each worker, then only the parameters of each run, the network of each value of the
+    arguments of build_network is specified once per worker
+    max_workers=0 runs the simulations in the current process
+    Returns a dict (agent, property) -> array [run, timestep]
+    """
+    jobs = [(parameters, outputs, backend) for parameters in runs]
+    chunksize = max(1, len(jobs) // (4 * worker_count(max_workers)))
+    with executor(inputs, max_workers, _spec_cache) as pool:
+        results = list(pool.map(_run, jobs, chunksize=chunksize))
+    return dict((key, np.array([r[key] for r in results])) for key in outputs)
+
+
+def parameter_grid(values):
+    """
+    All the combinations of a dict parameter -> list of values
+    """
+    keys = list(values.keys())
+    return [dict(zip(keys, combination)) for combination in itertools.product(*[values[k] for k in keys])]
+
+
+def sample_parameters(distributions, n, seed=None):
+    """
+    n parameter sets sampled from a dict parameter -> (low, high) (uniform) or function(rng, n)
+    """
+    rng = np.random.RandomState(seed)
+    samples = dict()
+    for key, distribution in distributions.items():
+        if callable(distribution):
+            samples[key] = list(distribution(rng, n))
+        else:
+            samples[key] = list(rng.uniform(distribution[0], distribution[1], n))
+    return [dict((key, samples[key][i]) for key in samples) for i in range(n)]
+
+
+def bootstrap_flows(flows, n, seed=None, names=None):
+    """
+    n synthetic inflow traces resampling whole years (Jan-Dec) of all the sub-basins together
+    Returns a list of dicts name -> trace, to be used as the 'flows' parameter
+    """
+    if names is None:
+        names = [c for c in flows.columns if c not in ('Year', 'Month')]
+    values = flows[names].values
+    T = len(values)
+    n_years = T // 12
+    rng = np.random.RandomState(seed)
+    traces = []
+    for i in range(n):
+        years = rng.randint(0, n_years, size=(T + 11) // 12)
+        k = (12 * years[:, None] + np.arange(12)[None, :]).ravel()[:T]
+        traces.append(dict((name, values[k, j]) for j, name in enumerate(names)))
+    return traces
+
+
+def ensemble_statistics(results, percentiles=(5, 50, 95)):
+    """
+    Mean and percentiles over the runs, for each output
+    """
+    statistics = dict()
+    for key, values in results.items():
+        statistics[key] = dict([('mean', np.nanmean(values, axis=0))] +
+                               [('p%d' % q, np.nanpercentile(values, q, axis=0)) for q in percentiles])
+    return statistics
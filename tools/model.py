@@ -0,0 +1,272 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import os
+
+import numpy as np
+import pandas as pd
+from pynsim import Simulator
+
+from components.calendar import Calendar, get_calendar
+from components.spec import NetworkSpec
+from engines.twr_management import SimulationOfSyria, TreatyOfPeace, ExchangeWithTiberias
+from engines.kernel import Kernel
+from engines.gr2m import GR2M, read_forcing
+from data.demand import stack_crop_data, crop_irrigation_requirements
+from data.forcing import ForcingStore
+from data.store import read_excel
+from tools.results import ResultsSink, compare_results, disable_history
+
+data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+# Evaporation at Wahda (CONFIDENTIAL DATA)
+# TODO replace this data
+evaporation = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]  # [mm]
+
+# Crops
+crops = ['olive', 'citrus', 'tomato', 'apple', 'cherry', 'eggplant', 'lettuce', 'cauliflower', 'forage']
+
+
+def load_inputs(source_file='reservoirs_1983.xlsx', test_future=1, gr2m=0):
+    """
+    Reads the input workbooks (see data.store for the cache) and stacks the crop data
+    gr2m: inflows simulated with engines.gr2m instead of read in the inflows sheet
+    """
+    source = os.path.join(data_dir, source_file)
+    precip_file = os.path.join(data_dir, 'precip83-16_v7.xlsx')
+
+    # PERSIANN rainfall
+    eff_precip = read_excel(precip_file, sheetname='calib_for_cwr')
+    contributive_weighted_precip = read_excel(source, sheetname='rainfall', skiprows=[0], parse_cols='C:W')
+    # Test for future?
+    if test_future == 1:
+        eff_precip2 = read_excel(precip_file, sheetname='calib_for_cwr', skiprows=range(1, 1+279), skip_footer=6)
+        eff_precip = pd.concat([eff_precip, eff_precip2], ignore_index=True)
+        contributive_weighted_precip2 = read_excel(source, sheetname='rainfall', skiprows=[0]+list(range(2, 2+279)),
+                                                   skip_footer=6, parse_cols='C:W')
+        contributive_weighted_precip = pd.concat([contributive_weighted_precip, contributive_weighted_precip2],
+                                                 ignore_index=True)
+
+    # area-storage relations
+    A_S = read_excel(source, sheetname='evaporation', skiprows=[0])
+
+    # CWR
+    cwr = dict()
+    for c in crops:
+        cwr[c] = read_excel(source, sheetname=c, skiprows=[0])
+
+    # Inflows [natural flow GR2M]
+    if gr2m == 1:
+        # GR2M run in-process on the PERSIANN rainfall and the PET of GR2M_v4.xlsx instead of the inflows sheet
+        runoff_precip = read_excel(precip_file, sheetname='calib_for_runoff')
+        flows = GR2M.from_workbooks(source).frame(runoff_precip, read_forcing().pet.values)
+    else:
+        flows = read_excel(source, sheetname='inflows', skiprows=[0, 1], parse_cols='A:W')
+    # Test for future?
+    if test_future == 1:
+        if gr2m == 1:
+            flows2 = flows.iloc[279:len(flows) - 6]
+        else:
+            flows2 = read_excel(source, sheetname='inflows', skiprows=[0, 1]+list(range(3, 3+279)), skip_footer=6,
+                                parse_cols='A:W')
+        flows = pd.concat([flows, flows2], ignore_index=True)
+
+    # Wahda storage constrained (CONFIDENTIAL DATA)
+    # TODO fill the excel sheet
+    if test_future == 1:
+        wahda_storage = read_excel(source, sheetname='storage', skiprows=[0], parse_cols='E:G')
+    else:
+        wahda_storage = read_excel(source, sheetname='storage', skiprows=[0], parse_cols='A:C')
+    wahda_storage = wahda_storage['El Wahda']
+
+    # Nodes
+    reservoirs = read_excel(source, skip_footer=17)  # ignoring dams < 1 MCM
+
+    # crops stacked for all farming reservoirs and the aquifer (idx 0)
+    farming = [i for i in range(len(reservoirs)) if reservoirs.use[i] == 'Farming']
+    cwr_req, cwr_areas = stack_crop_data(cwr, crops, [reservoirs.idx[i] for i in farming] + [0])
+    cwr_precip = np.column_stack([eff_precip[reservoirs.name[i]] for i in farming] + [eff_precip['YRB']]).T
+
+    return {'eff_precip': eff_precip, 'contributive_weighted_precip': contributive_weighted_precip, 'A_S': A_S,
+            'cwr': cwr, 'flows': flows, 'wahda_storage': wahda_storage, 'reservoirs': reservoirs,
+            'farming': farming, 'cwr_req': cwr_req, 'cwr_areas': cwr_areas, 'cwr_precip': cwr_precip}
+
+
+def crop_demands(inputs, irr_def=0.4):
+    """
+    Crop irrigation requirements [hm3] of the farming reservoirs and of the aquifer (GW_Wahda) for each month
+    irr_def: irrigation deficit
+    Returns a dict name -> array [month]
+    """
+    flows = inputs['flows']
+    cir = crop_irrigation_requirements(inputs['cwr_req'], inputs['cwr_areas'], inputs['cwr_precip'],
+                                       flows.Year, flows.Month, irr_def)
+    demands = dict((inputs['reservoirs'].name[i], cir[k]) for k, i in enumerate(inputs['farming']))
+    demands['GW_Wahda'] = cir[-1]
+    return demands
+
+
+def network_spec(inputs, irr_def=0.4, evaporation=evaporation, calendar=None):
+    """
+    Spec of the Yarmouk network (components.spec): reservoirs, aquifers, Adasiya, links and the three institutions
+    irr_def: irrigation deficit
+    calendar: components.calendar.Calendar of the timesteps (e.g. Calendar(len(inputs['flows']), 'daily')), the
+    monthly forcing is disaggregated at its timesteps, monthly timesteps if None
+    """
+    flows = inputs['flows']
+    timesteps = Calendar(len(flows)) if calendar is None else calendar
+    reservoirs = inputs['reservoirs']
+    contributive_weighted_precip = inputs['contributive_weighted_precip']
+    A_S = inputs['A_S']
+
+    # crop irrigation requirements [hm3]
+    cir = crop_demands(inputs, irr_def)
+
+    nodes = []
+    names = {0: 'Adasiya'}  # idx -> name, 0 for the outlet
+    for i, dam in enumerate(reservoirs.name):
+        names[reservoirs.idx[i]] = dam
+        # storage constraint only for El Wahda
+        if reservoirs.idx[i] == 1:
+            storage_constraint_i = inputs['wahda_storage']
+        else:
+            storage_constraint_i = list()
+
+        # Net Reservoir Evaporation [mm]
+        nre_i = [evaporation[k % 12] - p for k, p in enumerate(contributive_weighted_precip[dam])]
+
+        # irrigation
+        if reservoirs.use[i] != 'Farming':
+            # crop irrigation requirements
+            cir_i = [0 for m in flows.Month]  # hm3
+        else:
+            # abstractions from reservoir i
+            cir_i = cir[dam]  # [hm3]
+
+        # household consumption
+        if reservoirs.inhabitants[i] == reservoirs.inhabitants[i]:
+            pop = reservoirs.inhabitants[i]
+        else:
+            pop = 0
+
+        nodes.append({'type': 'SurfaceReservoir', 'name': dam, 'x': reservoirs.east[i], 'y': reservoirs.north[i],
+                      'idx': reservoirs.idx[i], 'capacity': reservoirs.capacity[i], 'area_storage': A_S[dam],
+                      'service_year': reservoirs.year[i], 'end_year': reservoirs.end_year[i],
+                      'use': reservoirs.use[i], 'manager': reservoirs.manager[i],
+                      'initial_storage': 0.8*reservoirs.capacity[i], 'nre_forecast': timesteps.disaggregate(nre_i),
+                      'crop_demand_forecast': timesteps.disaggregate(cir_i), 'inhabitants': pop,
+                      'inflow_forecast': timesteps.disaggregate(flows[dam]),
+                      'storage_forecast': timesteps.disaggregate(storage_constraint_i, 'state')})
+
+    gwr = cir['GW_Wahda']  # [hm3]
+    # test for future scenarios: irrigated areas reduced by 10, 20 and 30% in 2018, 2019 and after
+    # gwr[(2018 - 1983) * 12:(2019 - 1983) * 12] *= 0.9
+    # gwr[(2019 - 1983) * 12:(2020 - 1983) * 12] *= 0.8
+    # gwr[(2020 - 1983) * 12:] *= 0.7
+
+    nodes.append({'type': 'Aquifer', 'name': 'GW_Wahda', 'x': 0, 'y': 0, 'hist_bf': 7, 'trigger': 14.75,
+                  'min_bf': 0.3, 'crop_demand_forecast': timesteps.disaggregate(gwr)})
+    nodes.append({'type': 'Aquifer', 'name': 'GW_Adasiya', 'x': 0, 'y': 0, 'hist_bf': 2})
+    nodes.append({'type': 'Outlet', 'name': 'Adasiya', 'x': 0, 'y': 0,
+                  'inflow_forecast': timesteps.disaggregate(flows['Adasiya'])})
+
+    # Links, for each reservoir: underground transfers (GW -> Wah/Ad, Res -> GW), wadi (Res -> Res/Ad) and canal
+    # (Res -> Res)
+    links = []
+    for i, idx in enumerate(reservoirs.idx):
+        # Transfers  with GW
+        if idx == 1:
+            links.append({'type': 'UndergroundTransfer', 'name': 'GW_to_Ad', 'start': 'GW_Adasiya', 'end': 'Adasiya'})
+            links.append({'type': 'UndergroundTransfer', 'name': 'GW_to_W', 'start': 'GW_Wahda', 'end': names[1]})
+        else:
+            links.append({'type': 'UndergroundTransfer', 'name': str(idx) + '_to_GW', 'start': names[idx],
+                          'end': 'GW_Wahda'})
+
+        # Wadis, no losses from El Wahda to Adasiya
+        idx_W_ds = reservoirs.river[i]  # index of downstream node from a wadi
+        if idx_W_ds == idx_W_ds:
+            links.append({'type': 'RiverSection', 'name': 'RS_' + str(idx) + '-' + str(int(idx_W_ds)),
+                          'start': names[idx], 'end': names[int(idx_W_ds)]})
+            if idx == 1 and idx_W_ds == 0:
+                links[-1]['link_yield'] = 1
+
+        # Canals
+        idx_C_ds = reservoirs.canal[i]  # index of downstream node from a canal
+        if idx_C_ds == idx_C_ds:
+            links.append({'type': 'Canal', 'name': 'C_' + str(idx) + '-' + str(int(idx_C_ds)), 'start': names[idx],
+                          'end': names[int(idx_C_ds)]})
+
+    # Institutions
+    institutions = [{'type': 'JVA', 'name': 'Jordan Valley Authority'}, {'type': 'Israel', 'name': 'Israel'},
+                    {'type': 'Syria', 'name': 'MAAR'}]
+    return NetworkSpec('Yarmouk_reservoirs_network', nodes, links, institutions, calendar)
+
+
+def build_network(inputs, irr_def=0.4, evaporation=evaporation, calendar=None, forcing=None):
+    """
+    Builds the Yarmouk network: reservoirs, aquifers, Adasiya, links and the three institutions
+    irr_def: irrigation deficit
+    calendar: timesteps of the network (see network_spec), monthly if None
+    forcing: directory of a data.forcing.ForcingStore (e.g. a long horizon of ForcingStore.from_network) whose
+    forecasts replace the ones of the inputs, the network then runs over the timesteps of the store (months if
+    calendar is None)
+    """
+    network = network_spec(inputs, irr_def, evaporation, calendar).build()
+    if forcing is not None:
+        store = ForcingStore(forcing)
+        if calendar is not None and len(calendar) != store.T:
+            raise ValueError("Forcing of %s timesteps for a calendar of %s timesteps" % (store.T, len(calendar)))
+        store.attach(network)
+    return network
+
+
+def build_simulator(network, T=None, results=True, start=0, history=False, **kwargs):
+    """
+    Simulator running the three engines over the timesteps start to T, with a ResultsSink if results is True
+    T: all the timesteps of the calendar of the network if None (e.g. forecasts of a forcing store)
+    start > 0: the state of the network at start is restored first (see tools.checkpoint)
+    history: pynsim histories of all the properties (get_history), not needed with the sink
+    kwargs: arguments of ResultsSink (agents, properties, dtype, every)
+    Returns the simulator and the sink (None if results is False)
+    """
+    # Simulator object that will be run
+    s = Simulator(network=network)
+    if not history:
+        disable_history(network)
+
+    # Timesteps of the simulator
+    if T is None:
+        T = len(get_calendar(network))
+    t = range(start, T)  # timesteps of the calendar of the network (months by default)
+    s.set_timesteps(t)
+
+    # Engines
+    reservoirs_management = SimulationOfSyria(target=network.get_institution('MAAR'))
+    treaty = TreatyOfPeace(target=network.get_institution('Jordan Valley Authority'))
+    pumping = ExchangeWithTiberias(target=network.get_institution('Israel'))
+    s.add_engine(reservoirs_management)
+    # if test alpha & beta possibilities
+    s.add_engine(treaty)
+    s.add_engine(pumping)
+
+    # Results recorded at each timestep, after the three engines
+    sink = None
+    if results:
+        sink = ResultsSink(target=network, timesteps=t, **kwargs)
+        s.add_engine(sink)
+    return s, sink
+
+
+def check_kernel(inputs, T=None, **kwargs):
+    """
+    Runs the kernel and the pynsim engines on two networks built from the same inputs, over the timesteps of their
+    calendar by default
+    Returns the (agent, property) whose histories differ
+    """
+    # compiled before the pynsim run, which modifies the class constants of Israel
+    kernel = Kernel(build_network(inputs, **kwargs))
+    if T is None:
+        T = len(kernel.calendar)
+    s, sink = build_simulator(build_network(inputs, **kwargs), T)
+    s.start()
+    return compare_results(sink.as_dict(), kernel.results(range(T)))
@@ -0,0 +1,210 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+
+from engines.kernel import monthly_constants
+from tools.calibration import de_trials
+from tools.ensemble import compile_kernel, _defaults
+from tools.pool import executor, worker, worker_count
+
+# decision variables of a policy: (name, lower bound, upper bound), constants of JVA and Israel
+# monthly constants (engines.kernel.monthly_constants) are 12 variables, one per month
+policy_parameters = [('JVA.kac_min', 30, 80),
+                     ('JVA.kac_margin', 0, 60),
+                     ('JVA.kac_decrease', 0, 40),
+                     ('JVA.kac08', 0, 1),
+                     ('Israel.pumping_capacity', 5, 15)]
+# monthly repartitions of the KAC objective: the 12 variables are weights normalized to 100 [%]
+repartitions = ['JVA.kac_94', 'JVA.kac95_07', 'JVA.kac08']
+
+# objectives, mean annual volumes over the traces [hm3/year]: KAC supply and Israel share maximized, deficits of the
+# reservoirs managed by Syria minimized
+objectives = ['KAC supply', 'Israel share', 'Syrian deficits']
+maximized = np.array([True, True, False])
+kac_supply = ('Jordan Valley Authority', 'kac')
+israel_share = ('Israel', 'quantity_available')
+
+
+def non_dominated_sort(costs):
+    """
+    Pareto ranks of points to minimize [point, objective]: list of fronts (arrays of indices), the first one
+    non-dominated
+    """
+    costs = np.asarray(costs, dtype=float)
+    # dominates[i, j]: i not worse than j for all the objectives and better for one
+    dominates = (costs[:, None] <= costs[None]).all(axis=2) & (costs[:, None] < costs[None]).any(axis=2)
+    n_dominating = dominates.sum(axis=0)
+    fronts = []
+    remaining = np.ones(len(costs), dtype=bool)
+    while remaining.any():
+        front = np.flatnonzero(remaining & (n_dominating == 0))
+        fronts.append(front)
+        remaining[front] = False
+        n_dominating = n_dominating - dominates[front].sum(axis=0)
+    return fronts
+
+
+def crowding_distance(costs):
+    """
+    Crowding distance of the points of a front [point, objective] (NSGA-II), inf for the extreme points
+    """
+    costs = np.asarray(costs, dtype=float)
+    distance = np.zeros(len(costs))
+    for j in range(costs.shape[1]):
+        order = np.argsort(costs[:, j], kind='stable')
+        span = costs[order[-1], j] - costs[order[0], j]
+        distance[order[[0, -1]]] = np.inf
+        if span > 0 and len(costs) > 2:
+            distance[order[1:-1]] += (costs[order[2:], j] - costs[order[:-2], j]) / span
+    return distance
+
+
+def pareto_front(costs):
+    """
+    Mask of the non-dominated points to minimize [point, objective]
+    """
+    mask = np.zeros(len(costs), dtype=bool)
+    mask[non_dominated_sort(costs)[0]] = True
+    return mask
+
+
+class PolicySearch(object):
+    """
+    Operating rules of JVA and Israel (annual KAC objective, KAC repartitions, pumping capacity) searched for the
+    Pareto front of the objectives over inflow traces, by an evolutionary algorithm (NSGA-II selection, DE/rand/1/bin
+    variation)
+    Each policy is simulated over all the traces in one batched kernel run (Kernel.run_batch), the policies of a
+    generation over a process pool
+    traces: list of dicts name -> inflow trace (e.g. tools.ensemble.bootstrap_flows), the inflows of the inputs if None
+    parameters: list of (name, lower bound, upper bound), see policy_parameters
+    kwargs: arguments of build_network
+    """
+
+    def __init__(self, inputs, traces=None, parameters=policy_parameters, **kwargs):
+        self.inputs = inputs
+        self.traces = traces
+        self.names = [p[0] for p in parameters]
+        for name in self.names:
+            cls, constant = name.split('.', 1)
+            if constant not in _defaults.get(cls, dict()) or cls not in ('JVA', 'Israel'):
+                raise ValueError("Unknown constant %s of the institutions" % name)
+        self.sizes = [12 if name in monthly_constants else 1 for name in self.names]
+        self.bounds = np.repeat(np.array([(p[1], p[2]) for p in parameters], dtype=float), self.sizes, axis=0)
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return "%s(parameters=%s, traces=%s)" % (self.__class__.__name__, self.names,
+                                                 1 if self.traces is None else len(self.traces))
+
+    def constants(self, x):
+        """
+        Constants of the institutions given a vector x: dict 'Class.constant' -> number or 12 monthly values
+        """
+        constants = dict()
+        k = 0
+        for name, size in zip(self.names, self.sizes):
+            values = np.asarray(x[k:k + size], dtype=float)
+            k += size
+            if name in repartitions:
+                total = values.sum()
+                values = 100. * values / total if total > 0 else np.full(12, 100. / 12)
+            constants[name] = values.tolist() if size > 1 else float(values[0])
+        return constants
+
+    def default_vector(self):
+        """
+        Current policy (class constants), the repartitions as weights within the bounds
+        """
+        x = []
+        for name in self.names:
+            cls, constant = name.split('.', 1)
+            value = np.atleast_1d(np.asarray(_defaults[cls][constant], dtype=float))
+            if name in repartitions:
+                value = value / 100.
+            x += list(value)
+        return np.clip(np.array(x), self.bounds[:, 0], self.bounds[:, 1])
+
+    def kernel(self):
+        """
+        Kernel compiled from the network of the inputs, shared by all the policies (see compile_kernel)
+        """
+        return compile_kernel(self.inputs, **self.kwargs)
+
+    def evaluate(self, xs, kernel=None):
+        """
+        Objectives of a list of policies [policy, objective], all the policies and traces in one batched run
+        """
+        kernel = self.kernel() if kernel is None else kernel
+        xs = np.atleast_2d(xs)
+        syrian = [n.name for n in kernel.network.get_nodes('SurfaceReservoir') if n.manager == 'Syria']
+        outputs = [kac_supply, israel_share] + [(name, 'deficit') for name in syrian]
+        n_traces = 1 if self.traces is None else len(self.traces)
+        constants = dict()
+        for x in xs:
+            for name, value in self.constants(x).items():
+                constants.setdefault(name, []).append(value)
+        constants = dict((name, np.repeat(values, n_traces, axis=0)) for name, values in constants.items())
+        inflows = None
+        if self.traces is not None:
+            inflows = dict((name, np.tile([trace[name] for trace in self.traces], (len(xs), 1)))
+                           for name in self.traces[0])
+        T = len(self.inputs['flows'])
+        results = kernel.run_batch(range(T), outputs, inflows=inflows, n=len(xs) * n_traces, constants=constants)
+        annual = np.column_stack([np.nansum(results[kac_supply], axis=1), np.nansum(results[israel_share], axis=1),
+                                  sum(np.nansum(results[o], axis=1) for o in outputs[2:])]) * 12. / T
+        return annual.reshape(len(xs), n_traces, len(objectives)).mean(axis=1)
+
+    def run(self, population=40, generations=30, mutation=0.5, crossover=0.9, seed=None, max_workers=None,
+            initial=True):
+        """
+        Evolutionary search over generations, population: number of policies
+        initial: the current policy is one of the first policies
+        max_workers=0 runs the simulations in the current process
+        Returns a dict: vectors x, constants and objectives [policy, objective] of the Pareto front, and the final
+        population and its objectives
+        """
+        n = len(self.bounds)
+        rng = np.random.RandomState(seed)
+        low, high = self.bounds[:, 0], self.bounds[:, 1]
+        vectors = low + rng.uniform(size=(population, n)) * (high - low)
+        if initial:
+            vectors[0] = self.default_vector()
+        # objectives to minimize
+        sign = np.where(maximized, -1., 1.)
+
+        # kernel compiled once by each worker
+        pool = executor(self, max_workers, PolicySearch.kernel)
+        n_workers = worker_count(max_workers)
+
+        def evaluate(xs):
+            chunks = np.array_split(xs, min(n_workers, len(xs)))
+            return np.concatenate(list(pool.map(_evaluate, chunks)))
+        try:
+            values = evaluate(vectors)
+            for generation in range(generations):
+                # offspring of the policies (differential evolution)
+                trials = de_trials(rng, vectors, low, high, mutation, crossover)
+                # parents and offspring selected by Pareto rank, then crowding distance
+                vectors = np.concatenate([vectors, trials])
+                values = np.concatenate([values, evaluate(trials)])
+                selected = []
+                for front in non_dominated_sort(values * sign):
+                    if len(selected) + len(front) > population:
+                        distance = crowding_distance(values[front] * sign)
+                        front = front[np.argsort(-distance, kind='stable')[:population - len(selected)]]
+                    selected += list(front)
+                    if len(selected) == population:
+                        break
+                vectors = vectors[selected]
+                values = values[selected]
+        finally:
+            pool.shutdown()
+        front = pareto_front(values * sign)
+        return {'x': vectors[front], 'constants': [self.constants(x) for x in vectors[front]],
+                'objectives': values[front], 'population': vectors, 'values': values}
+
+
+def _evaluate(xs):
+    search, kernel = worker()
+    return search.evaluate(xs, kernel)
@@ -0,0 +1,62 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import os
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+
+# object shared by the tasks of a worker process (inputs, calibration, search...), sent once by the initializer, and
+# what the worker made of it once (e.g. a compiled kernel)
+_shared = None
+_setup = None
+
+
+def init_worker(shared, setup=None):
+    """
+    Initializer of the worker processes: keeps the shared object and setup(shared) if given (see worker)
+    """
+    global _shared, _setup
+    _shared = shared
+    _setup = None if setup is None else setup(shared)
+
+
+def worker():
+    """
+    Shared object of the current process and the result of its setup
+    """
+    return _shared, _setup
+
+
+def worker_count(max_workers=None):
+    """
+    Number of processes running the tasks: max_workers, all the CPUs by default, 1 for max_workers=0
+    """
+    if max_workers == 0:
+        return 1
+    return max_workers or os.cpu_count() or 1
+
+
+class InlineExecutor(Executor):
+    """
+    Executor running each task in the current process when it is submitted
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def executor(shared, max_workers=None, setup=None):
+    """
+    Process pool whose workers keep the shared object, sent once to each of them, then only the arguments of each
+    task (see init_worker): max_workers processes, all the CPUs by default
+    max_workers=0 runs the tasks in the current process
+    """
+    if max_workers == 0:
+        init_worker(shared, setup)
+        return InlineExecutor()
+    return ProcessPoolExecutor(max_workers=worker_count(max_workers), initializer=init_worker,
+                               initargs=(shared, setup))
@@ -0,0 +1,164 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import json
+import time
+from collections import defaultdict
+
+import numpy as np
+
+# bounds of the bins of the timing histograms [s]: 10 bins per decade from 1 us to 10 s
+bins = np.logspace(-6, 1, 71)
+# methods of the institutions called by the engines
+institution_methods = ['manage_water_resources', 'manage_wahda', 'separate_the_flow', 'pump_in_yarmoukeem_pool',
+                       'send_concession_back']
+# lookups of the network counted at each timestep
+lookups = ['get_node', 'get_link', 'get_institution']
+
+
+class Profiler(object):
+    """
+    Opt-in instrumentation of a simulator: nothing is wrapped before attach, detach restores the original methods
+    - wall time of each engine run, component setup, institution method and history recording (post_process)
+    - get_node/get_link/get_institution lookups of the network at each timestep
+    trace: keeps every call for the Chrome trace (dump_trace)
+    """
+
+    def __init__(self, trace=True):
+        self.trace = trace
+        self.durations = defaultdict(list)  # name -> durations of the calls [s]
+        self.categories = dict()  # name -> engine, node, link, institution or network
+        self.lookups = dict((m, defaultdict(int)) for m in lookups)  # lookup -> timestep index -> calls
+        self.events = []  # (name, start [s], duration [s], timestep index)
+        self.timestep_idx = None
+        self._wrapped = []  # (object, attribute, instance attribute replaced)
+
+    def __repr__(self):
+        return "%s(calls=%s, events=%s)" % (self.__class__.__name__, sum(len(d) for d in self.durations.values()),
+                                            len(self.events))
+
+    def attach(self, simulator):
+        """
+        Wraps the engines, the components and the network of the simulator
+        """
+        network = simulator.network
+        self._wrap(network, 'set_timestep', self._set_timestep)
+        for engine in simulator.engines:
+            self._time(engine, 'run', engine.name, 'engine')
+        for c in network.components:
+            self._time(c, 'setup', c.name + '.setup', c.base_type)
+        for institution in network.institutions:
+            for m in institution_methods:
+                if hasattr(institution, m):
+                    self._time(institution, m, '%s.%s' % (institution.name, m), 'institution')
+        self._time(network, 'post_process', 'history', 'network')
+        for m in lookups:
+            self._wrap(network, m, lambda method, m=m: self._count(method, self.lookups[m]))
+        return self
+
+    def detach(self):
+        """
+        Restores the methods wrapped by attach
+        """
+        for obj, attribute, previous in reversed(self._wrapped):
+            if previous is None:
+                delattr(obj, attribute)
+            else:
+                setattr(obj, attribute, previous)
+        self._wrapped = []
+
+    def _wrap(self, obj, attribute, wrapper):
+        self._wrapped.append((obj, attribute, obj.__dict__.get(attribute)))
+        setattr(obj, attribute, wrapper(getattr(obj, attribute)))
+
+    def _set_timestep(self, method):
+        def set_timestep(timestamp, timestep_idx):
+            self.timestep_idx = timestep_idx
+            return method(timestamp, timestep_idx)
+        return set_timestep
+
+    def _count(self, method, counts):
+        def counted(*args, **kwargs):
+            counts[self.timestep_idx] += 1
+            return method(*args, **kwargs)
+        return counted
+
+    def _time(self, obj, attribute, name, category):
+        self.categories[name] = category
+        durations = self.durations[name]
+        events = self.events
+
+        def wrapper(method):
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    duration = time.perf_counter() - start
+                    durations.append(duration)
+                    if self.trace:
+                        events.append((name, start, duration, self.timestep_idx))
+            return timed
+        self._wrap(obj, attribute, wrapper)
+
+    def summary(self):
+        """
+        (name, category, calls, total [s], mean [s], max [s]) of each instrumented method, by decreasing total time
+        """
+        rows = [(name, self.categories[name], len(d), sum(d), sum(d) / len(d), max(d))
+                for name, d in self.durations.items() if len(d) > 0]
+        return sorted(rows, key=lambda row: -row[3])
+
+    def histogram(self, name):
+        """
+        Number of calls of name in each bin of bins
+        """
+        return np.histogram(self.durations[name], bins)[0]
+
+    def lookup_counts(self, lookup):
+        """
+        Calls of a network lookup at each timestep (index 0, 1, ...)
+        """
+        counts = self.lookups[lookup]
+        steps = [k for k in counts if k is not None]
+        values = np.zeros(max(steps) + 1 if len(steps) > 0 else 0, dtype=int)
+        for k in steps:
+            values[k] = counts[k]
+        return values
+
+    def report(self, top=20):
+        """
+        Table of the most expensive methods and the lookups per timestep
+        """
+        lines = ['%-50s %-12s %8s %10s %10s %10s' % ('', 'category', 'calls', 'total [s]', 'mean [ms]', 'max [ms]')]
+        for name, category, calls, total, mean, longest in self.summary()[:top]:
+            lines.append('%-50s %-12s %8d %10.4f %10.4f %10.4f' % (name[:50], category, calls, total, mean * 1e3,
+                                                                   longest * 1e3))
+        for m in lookups:
+            counts = self.lookup_counts(m)
+            if len(counts) > 0:
+                lines.append('%s: %d per timestep (max %d)' % (m, counts.mean(), counts.max()))
+        return '\n'.join(lines)
+
+    def dump_trace(self, path):
+        """
+        Writes the calls in the Chrome trace format (chrome://tracing, Perfetto, speedscope)
+        """
+        origin = self.events[0][1] if len(self.events) > 0 else 0
+        events = [{'name': name, 'cat': self.categories[name], 'ph': 'X', 'pid': 0, 'tid': 0,
+                   'ts': (start - origin) * 1e6, 'dur': duration * 1e6, 'args': {'timestep': timestep_idx}}
+                  for name, start, duration, timestep_idx in self.events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def profile(simulator, trace=True):
+    """
+    Runs the simulator with a profiler attached, returns the profiler
+    """
+    profiler = Profiler(trace).attach(simulator)
+    try:
+        simulator.start()
+    finally:
+        profiler.detach()
+    return profiler
@@ -0,0 +1,175 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+import pandas as pd
+from pynsim import Engine
+
+# properties at the end of a timestep, the others are volumes of the timestep [hm3] (see monthly_results)
+state_properties = ['storage', 'storage_ini', 'capacity', 'sediments', 'active', 'objective_kac']
+
+
+class ResultsSink(Engine):
+    """
+    Engine recording the properties of the agents in preallocated arrays, one array [timestep, agent] per property
+    To be added after the other engines of the simulator
+    agents, properties: recorded agents and properties (all by default)
+    every: decimation, only the timesteps 0, every, 2 * every... are recorded
+    """
+    name = "Results sink"
+
+    def __init__(self, target, timesteps, agents=None, properties=None, dtype=float, every=1, **kwargs):
+        super(ResultsSink, self).__init__(target, **kwargs)
+        # target = network
+        if agents is None:
+            agents = target.nodes + target.institutions
+        if properties is None:
+            properties = []
+            for agent in agents:
+                properties += [p for p in agent.get_properties().keys() if p not in properties]
+        self.agents = list(agents)
+        self.properties = list(properties)
+        self.every = every
+        self.timesteps = list(timesteps)[::every]
+        self.dtype = dtype
+        # agents having each property and their values
+        self.columns = dict((p, [agent for agent in self.agents if p in agent.get_properties()])
+                            for p in self.properties)
+        self.arrays = dict((p, np.full((len(self.timesteps), len(self.columns[p])), np.nan, dtype=dtype))
+                           for p in self.properties)
+        self._slots = [(self.arrays[p], p, list(enumerate(self.columns[p]))) for p in self.properties]
+
+    def run(self):
+        if self.timestep_idx % self.every != 0:
+            return
+        k = self.timestep_idx // self.every
+        for array, p, columns in self._slots:
+            row = array[k]
+            for i, agent in columns:
+                value = getattr(agent, p)
+                if value is not None:
+                    row[i] = value
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    @property
+    def values(self):
+        """
+        All the results in one array [timestep, agent, property], NaN for the agents without a property
+        """
+        values = np.full((len(self.timesteps), len(self.agents), len(self.properties)), np.nan, dtype=self.dtype)
+        for j, p in enumerate(self.properties):
+            values[:, [self.agents.index(agent) for agent in self.columns[p]], j] = self.arrays[p]
+        return values
+
+    def frame(self, prop):
+        """
+        DataFrame [timestep, agent] of one property sharing the memory of the results (no copy)
+        """
+        return pd.DataFrame(self.arrays[prop], index=self.timesteps, columns=[agent.name for agent in
+                                                                              self.columns[prop]], copy=False)
+
+    def save(self, path):
+        """
+        Writes the results in a compressed npz file
+        """
+        np.savez_compressed(path, **self.as_dict())
+
+    def recorded(self):
+        """
+        Mask [agent, property] of the properties defined for each agent
+        """
+        mask = np.zeros((len(self.agents), len(self.properties)), dtype=bool)
+        for j, p in enumerate(self.properties):
+            mask[[self.agents.index(agent) for agent in self.columns[p]], j] = True
+        return mask
+
+    def to_excel(self, path):
+        """
+        Same layout as the history export: one sheet per property, one column per agent
+        """
+        to_excel(self.as_dict(), path)
+
+    def as_dict(self):
+        return {'values': self.values, 'timesteps': np.array(self.timesteps),
+                'agents': np.array([agent.name for agent in self.agents]),
+                'properties': np.array(self.properties), 'recorded': self.recorded()}
+
+
+def disable_history(network):
+    """
+    Stops the pynsim histories (lists of the properties of all the components appended at each timestep)
+    """
+    network.post_process = _no_history
+
+
+def _no_history():
+    pass
+
+
+def load_results(path):
+    """
+    Reads results saved by ResultsSink.save
+    """
+    with np.load(path) as f:
+        return dict((k, f[k]) for k in f.files)
+
+
+def compare_results(a, b):
+    """
+    (agent, property) recorded in both results whose values differ (NaN equal to NaN)
+    """
+    different = []
+    for i, agent in enumerate(a['agents']):
+        for j, prop in enumerate(a['properties']):
+            if not a['recorded'][i, j]:
+                continue
+            x = a['values'][:, i, j]
+            y = b['values'][:, list(b['agents']).index(agent), list(b['properties']).index(prop)]
+            nan = np.isnan(x)
+            if not (np.array_equal(nan, np.isnan(y)) and np.array_equal(x[~nan], y[~nan])):
+                different.append((str(agent), str(prop)))
+    return different
+
+
+def monthly_results(results, calendar):
+    """
+    Results of the timesteps of a calendar (components.calendar) back to months, same layout (ResultsSink.as_dict)
+    with the month indices as timesteps: volumes summed over the timesteps of each month, state_properties at the
+    last timestep of the month
+    """
+    values = []
+    for j, prop in enumerate(results['properties']):
+        months, monthly = calendar.aggregate(results['values'][:, :, j], 'state' if prop in state_properties
+                                             else 'volume', results['timesteps'])
+        values.append(monthly)
+    return dict(results, values=np.stack(values, axis=2), timesteps=months)
+
+
+def property_frame(results, prop):
+    """
+    DataFrame [timestep, agent] of one property, agents without this property are left out
+    """
+    j = list(results['properties']).index(prop)
+    agents = results['recorded'][:, j]
+    return pd.DataFrame(results['values'][:, agents, j], index=results['timesteps'],
+                        columns=results['agents'][agents])
+
+
+def to_excel(results, path):
+    """
+    Excel export of results (dict or npz file), agents at the same columns in all sheets
+    """
+    if not isinstance(results, dict):
+        results = load_results(results)
+    writer = pd.ExcelWriter(path, engine='xlsxwriter')
+    for j, prop in enumerate(results['properties']):
+        recorded = results['recorded'][:, j]
+        # empty columns for the agents without this property
+        columns = [name if recorded[i] else '' for i, name in enumerate(results['agents'])]
+        df = pd.DataFrame(results['values'][:, :, j], index=results['timesteps'])
+        df.columns = columns
+        df.to_excel(writer, sheet_name=str(prop))
+    writer.close()
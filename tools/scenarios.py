@@ -0,0 +1,193 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import numpy as np
+
+from tools.checkpoint import Checkpoint, set_state
+from tools.ensemble import restore_constants
+from tools.model import build_network, build_simulator
+from tools.pool import executor, worker
+
+
+class Intervention(object):
+    """
+    Change of the network applied at the start of a month, before the setup of the components
+    Subclasses implement apply(network, timestep), they are sent to the worker processes (no lambdas)
+    """
+
+    def __call__(self, network, timestep):
+        self.apply(network, timestep)
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, ', '.join('%s=%s' % kv for kv in sorted(vars(self).items())))
+
+    def apply(self, network, timestep):
+        raise NotImplementedError
+
+
+class SetAttribute(Intervention):
+    """
+    Sets an attribute of agents (nodes or institutions) given by name
+    """
+
+    def __init__(self, agents, attribute, value):
+        self.agents = agents
+        self.attribute = attribute
+        self.value = value
+
+    def apply(self, network, timestep):
+        for name in self.agents:
+            agent = network.get_node(name) or network.get_institution(name)
+            if agent is None:
+                raise KeyError("Unknown agent %s" % name)
+            setattr(agent, self.attribute, self.value)
+            if hasattr(agent, 'reset_schedule'):
+                agent.reset_schedule()
+
+
+class Efficiency(Intervention):
+    """
+    Irrigation efficiency increased by delta for the nodes of the given types
+    (test efficiency for future scenarios in SurfaceReservoir.setup and Aquifer.setup)
+    """
+
+    def __init__(self, delta=0.1, component_types=('SurfaceReservoir', 'Aquifer')):
+        self.delta = delta
+        self.component_types = component_types
+
+    def apply(self, network, timestep):
+        for n in network.nodes:
+            if n.component_type in self.component_types:
+                n.eta += self.delta
+
+
+class Rehabilitation(Intervention):
+    """
+    Reservoirs active again until end_year, all the reservoirs if names is None
+    (test rehabilitation for future scenarios in SurfaceReservoir.setup)
+    """
+
+    def __init__(self, names=None, end_year=2222):
+        self.names = names
+        self.end_year = end_year
+
+    def apply(self, network, timestep):
+        for n in network.get_nodes('SurfaceReservoir'):
+            if self.names is None or n.name in self.names:
+                n.active = 1
+                n.year_end = self.end_year
+                n.reset_schedule()
+
+
+class DemandCut(Intervention):
+    """
+    Crop demand of a node multiplied by factor from the month of the intervention
+    (irrigated areas reduced in the future scenarios of build_network)
+    The forecast is copied: networks built from the same inputs share their forecasts
+    """
+
+    def __init__(self, factor, name='GW_Wahda'):
+        self.factor = factor
+        self.name = name
+
+    def apply(self, network, timestep):
+        n = network.get_node(self.name)
+        forecast = np.array(n.crop_demand_forecast, dtype=float)
+        forecast[timestep:] *= self.factor
+        n.crop_demand_forecast = forecast
+
+
+def schedule(network, interventions):
+    """
+    Applies the interventions [(timestep, intervention)] at the start of their month, before the setup of the
+    components (pynsim calls network.setup first)
+    """
+    timesteps = dict()
+    for timestep, intervention in interventions:
+        timesteps.setdefault(timestep, []).append(intervention)
+    setup = network.setup
+
+    def scheduled_setup(timestep):
+        for intervention in timesteps.get(timestep, []):
+            intervention(network, timestep)
+        setup(timestep)
+    network.setup = scheduled_setup
+
+
+def fork_timestep(interventions):
+    """
+    First month of a branch different from the base run
+    """
+    return min(timestep for timestep, intervention in interventions)
+
+
+def _run_branch(job):
+    interventions, start, state, T, kwargs = job
+    inputs, _ = worker()
+    restore_constants()
+    try:
+        network = build_network(inputs, **kwargs)
+        if state is not None:
+            set_state(network, state)
+        schedule(network, interventions)
+        s, sink = build_simulator(network, T, start=start)
+        s.start()
+    finally:
+        restore_constants()
+    return sink.values
+
+
+def run_tree(inputs, branches, T=None, max_workers=None, **kwargs):
+    """
+    Runs a base scenario and branches forking from it
+    branches: dict name -> list of (timestep, intervention), e.g. {'rehabilitation': [(420, Rehabilitation())]}
+    The base run is simulated once and its state kept at the fork of each branch; each branch is then simulated
+    from its fork only, over a process pool (max_workers=0 runs the branches in the current process)
+    kwargs: arguments of build_network
+    Returns a dict 'base'/branch name -> results (layout of ResultsSink.as_dict, T months)
+    """
+    if T is None:
+        T = len(inputs['flows'])
+    forks = dict((name, fork_timestep(interventions)) for name, interventions in branches.items())
+    restore_constants()
+    try:
+        network = build_network(inputs, **kwargs)
+        s, sink = build_simulator(network, T)
+        checkpoint = Checkpoint(target=network, timesteps=[f - 1 for f in forks.values() if f > 0])
+        s.add_engine(checkpoint)
+        s.start()
+    finally:
+        restore_constants()
+    base = sink.as_dict()
+    results = {'base': base}
+
+    names = sorted(branches)
+    jobs = [(branches[name], forks[name], checkpoint.states.get(forks[name]), T, kwargs) for name in names]
+    with executor(inputs, max_workers) as pool:
+        values = list(pool.map(_run_branch, jobs))
+    for name, branch_values in zip(names, values):
+        # months before the fork shared with the base run
+        results[name] = dict(base, values=np.concatenate([base['values'][:forks[name]], branch_values]))
+    return results
+
+
+def differences(results, reference='base'):
+    """
+    For each branch, the (agent, property, first month, max absolute difference) differing from the reference
+    """
+    ref = results[reference]
+    diff = dict()
+    for name, branch in results.items():
+        if name == reference:
+            continue
+        diff[name] = []
+        for i, agent in enumerate(ref['agents']):
+            for j, prop in enumerate(ref['properties']):
+                x = ref['values'][:, i, j]
+                y = branch['values'][:, i, j]
+                different = ~((x == y) | (np.isnan(x) & np.isnan(y)))
+                if different.any():
+                    delta = np.abs(x - y)
+                    delta = float(np.nanmax(delta)) if (~np.isnan(delta)).any() else np.nan
+                    diff[name].append((str(agent), str(prop), int(ref['timesteps'][np.argmax(different)]), delta))
+    return diff
@@ -0,0 +1,248 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import itertools
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import numpy as np
+
+from engines.kernel import node_parameters
+from tools.ensemble import compile_kernel, key_outputs, _defaults
+from tools.model import crop_demands
+from tools.pool import executor, worker, worker_count
+from tools.results import state_properties
+
+# factors of the analysis: (name, lower bound, upper bound), class constants of the nodes
+# (engines.kernel.node_parameters) and the irrigation deficit of build_network
+sensitivity_factors = [('SurfaceReservoir.eta', 0.3, 0.8),
+                       ('SurfaceReservoir.eta_pipe', 0.3, 0.8),
+                       ('SurfaceReservoir.rf', 0.1, 0.5),
+                       ('SurfaceReservoir.CroppingIntensity', 0.8, 1.3),
+                       ('SurfaceReservoir.sediment_pct', 0, 0.003),
+                       ('SurfaceReservoir.household_use', 3, 8),
+                       ('Aquifer.eta', 0.5, 0.9),
+                       ('Aquifer.rf', 0.1, 0.5),
+                       ('Aquifer.wadi_rf', 0.5, 0.95),
+                       ('irr_def', 0.2, 0.6)]
+
+
+def saltelli_design(n, k, seed=None):
+    """
+    Saltelli design of n base points in the unit hypercube of k factors [point, k + 2, factor]: for each point, the
+    rows of the matrices A and B, then the row of A with the factor i taken from B (i = 1 to k)
+    """
+    rng = np.random.RandomState(seed)
+    a = rng.uniform(size=(n, k))
+    b = rng.uniform(size=(n, k))
+    design = np.repeat(a[:, None], k + 2, axis=1)
+    design[:, 1] = b
+    for i in range(k):
+        design[:, i + 2, i] = b[:, i]
+    return design
+
+
+def morris_design(r, k, levels=4, seed=None):
+    """
+    r Morris trajectories in the unit hypercube of k factors [trajectory, k + 1, factor]: from a point of the grid of
+    levels values, each factor moved once by delta = levels / (2 (levels - 1)), in a random order and direction
+    """
+    rng = np.random.RandomState(seed)
+    delta = levels / (2. * (levels - 1))
+    # base values such that the base + delta is on the grid
+    base = rng.randint(0, levels // 2, size=(r, k)) / (levels - 1.)
+    direction = rng.choice([-1., 1.], size=(r, k))
+    design = np.repeat(np.where(direction < 0, base + delta, base)[:, None], k + 1, axis=1)
+    for j in range(r):
+        for step, i in enumerate(rng.permutation(k)):
+            design[j, step + 1:, i] += direction[j, i] * delta
+    return design
+
+
+class SobolIndices(object):
+    """
+    First order (Saltelli, 2010) and total (Jansen) Sobol indices of outputs, updated as the points of a Saltelli
+    design are evaluated
+    """
+
+    def __init__(self, k, n_outputs):
+        self.n = 0
+        self.sum = np.zeros(n_outputs)
+        self.squares = np.zeros(n_outputs)
+        self.first = np.zeros((k, n_outputs))
+        self.total = np.zeros((k, n_outputs))
+
+    def __repr__(self):
+        return "%s(n=%s, factors=%s)" % (self.__class__.__name__, self.n, len(self.first))
+
+    def add(self, values):
+        """
+        Outputs of points of the design [point, k + 2, output] (see saltelli_design)
+        """
+        values = np.asarray(values, dtype=float)
+        a, b, ab = values[:, 0], values[:, 1], values[:, 2:]
+        self.n += len(values)
+        self.sum += a.sum(axis=0) + b.sum(axis=0)
+        self.squares += (a ** 2).sum(axis=0) + (b ** 2).sum(axis=0)
+        self.first += (b[:, None] * (ab - a[:, None])).sum(axis=0)
+        self.total += ((a[:, None] - ab) ** 2).sum(axis=0)
+
+    def indices(self):
+        """
+        Dict 'S1', 'ST' -> indices [factor, output], NaN for the outputs of zero variance
+        """
+        mean = self.sum / (2 * self.n)
+        variance = self.squares / (2 * self.n) - mean ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = np.where(variance > 0, variance, np.nan)
+            return {'S1': self.first / self.n / variance, 'ST': self.total / (2 * self.n) / variance}
+
+
+class MorrisIndices(object):
+    """
+    Statistics of the elementary effects of the factors on outputs (Morris, 1991; mu* of Campolongo et al., 2007),
+    updated as the trajectories are evaluated, for factors scaled to [0, 1]
+    """
+
+    def __init__(self, k, n_outputs):
+        self.n = 0
+        self.sum = np.zeros((k, n_outputs))
+        self.absolute = np.zeros((k, n_outputs))
+        self.squares = np.zeros((k, n_outputs))
+
+    def __repr__(self):
+        return "%s(n=%s, factors=%s)" % (self.__class__.__name__, self.n, len(self.sum))
+
+    def add(self, design, values):
+        """
+        Trajectories [trajectory, k + 1, factor] (see morris_design) and their outputs [trajectory, k + 1, output]
+        """
+        design = np.asarray(design, dtype=float)
+        values = np.asarray(values, dtype=float)
+        step = np.diff(design, axis=1)
+        factor = np.abs(step).argmax(axis=2)  # factor moved at each step [trajectory, k]
+        delta = np.take_along_axis(step, factor[:, :, None], axis=2)
+        effects = np.zeros((len(design),) + self.sum.shape)
+        effects[np.arange(len(design))[:, None], factor] = np.diff(values, axis=1) / delta
+        self.n += len(design)
+        self.sum += effects.sum(axis=0)
+        self.absolute += np.abs(effects).sum(axis=0)
+        self.squares += (effects ** 2).sum(axis=0)
+
+    def indices(self):
+        """
+        Dict 'mu', 'mu_star', 'sigma' -> statistics [factor, output]
+        """
+        mu = self.sum / self.n
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sigma = np.sqrt(np.maximum(self.squares - self.n * mu ** 2, 0) / (self.n - 1))
+        return {'mu': mu, 'mu_star': self.absolute / self.n, 'sigma': sigma}
+
+
+class SensitivityAnalysis(object):
+    """
+    Global sensitivity analysis of outputs summarized over the simulation (mean annual volumes [hm3/year], mean of
+    state_properties) to factors sampled in their bounds: Sobol indices (Saltelli design) or Morris elementary effects
+    The kernel is compiled once in each worker process and keeps the forcing of the inputs, the points of a block of
+    the design are simulated together by Kernel.run_batch (the crop demands are only computed again for irr_def), the
+    indices are updated as the blocks are evaluated
+    factors: list of (name, lower bound, upper bound), see sensitivity_factors
+    kwargs: arguments of build_network (e.g. calendar)
+    """
+
+    def __init__(self, inputs, factors=sensitivity_factors, outputs=key_outputs, **kwargs):
+        self.inputs = inputs
+        self.names = [f[0] for f in factors]
+        for name in self.names:
+            cls, constant = name.split('.', 1) if '.' in name else (None, name)
+            if name != 'irr_def' and (cls not in ('SurfaceReservoir', 'Aquifer') or constant not in node_parameters
+                                      or constant not in _defaults[cls]):
+                raise ValueError("Unknown factor %s: class constant of the nodes or irr_def expected" % name)
+        self.bounds = np.array([(f[1], f[2]) for f in factors], dtype=float)
+        self.outputs = list(outputs)
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return "%s(factors=%s, outputs=%s)" % (self.__class__.__name__, self.names, len(self.outputs))
+
+    def kernel(self):
+        """
+        Kernel compiled from the network of the inputs, shared by all the points (see compile_kernel)
+        """
+        return compile_kernel(self.inputs, **self.kwargs)
+
+    def values(self, points):
+        """
+        Values of the factors [point, factor] of points of the unit hypercube
+        """
+        low, high = self.bounds[:, 0], self.bounds[:, 1]
+        return low + np.asarray(points, dtype=float) * (high - low)
+
+    def evaluate(self, points, kernel=None):
+        """
+        Summarized outputs [point, output] of points of the unit hypercube [point, factor], in one batched run
+        """
+        kernel = self.kernel() if kernel is None else kernel
+        x = self.values(np.atleast_2d(points))
+        constants = dict((name, x[:, j]) for j, name in enumerate(self.names) if name != 'irr_def')
+        demands = None
+        if 'irr_def' in self.names:
+            demands = dict()
+            for irr_def in x[:, self.names.index('irr_def')]:
+                for name, monthly in crop_demands(self.inputs, irr_def).items():
+                    demands.setdefault(name, []).append(kernel.calendar.disaggregate(monthly))
+        T = len(kernel.calendar)
+        results = kernel.run_batch(range(T), self.outputs, n=len(x), constants=constants, demands=demands)
+        return np.column_stack([np.nanmean(results[o], axis=1) if o[1] in state_properties else
+                                np.nansum(results[o], axis=1) * kernel.calendar.steps_per_year / T
+                                for o in self.outputs])
+
+    def _blocks(self, design, block, max_workers):
+        """
+        Outputs of the blocks of points of a design [point, runs, factor] over a process pool (kernel compiled once
+        by each worker), yields (block of the design, outputs [point, runs, output]) as they are evaluated, two blocks
+        per worker submitted at a time
+        max_workers=0 runs the simulations in the current process
+        """
+        blocks = (design[j:j + block] for j in range(0, len(design), block))
+        with executor(self, max_workers, SensitivityAnalysis.kernel) as pool:
+            pending = dict((pool.submit(_evaluate, b), b)
+                           for b in itertools.islice(blocks, 2 * worker_count(max_workers)))
+            while len(pending) > 0:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+                    for b in itertools.islice(blocks, 1):
+                        pending[pool.submit(_evaluate, b)] = b
+
+    def sobol(self, n, seed=None, block=32, max_workers=None, callback=None):
+        """
+        Sobol indices from a Saltelli design of n base points: n (k + 2) runs, k factors
+        block: base points simulated together, callback(indices, points evaluated) after each block
+        Returns a dict: 'S1', 'ST' [factor, output], 'n', factor names and outputs
+        """
+        estimator = SobolIndices(len(self.names), len(self.outputs))
+        for points, values in self._blocks(saltelli_design(n, len(self.names), seed), block, max_workers):
+            estimator.add(values)
+            if callback is not None:
+                callback(estimator.indices(), estimator.n)
+        return dict(estimator.indices(), n=estimator.n, factors=self.names, outputs=self.outputs)
+
+    def morris(self, r, levels=4, seed=None, block=32, max_workers=None, callback=None):
+        """
+        Statistics of the elementary effects from r Morris trajectories: r (k + 1) runs, k factors
+        block: trajectories simulated together, callback(indices, trajectories evaluated) after each block
+        Returns a dict: 'mu', 'mu_star', 'sigma' [factor, output] (factors scaled to [0, 1]), 'n', factor names and
+        outputs
+        """
+        estimator = MorrisIndices(len(self.names), len(self.outputs))
+        for trajectories, values in self._blocks(morris_design(r, len(self.names), levels, seed), block, max_workers):
+            estimator.add(trajectories, values)
+            if callback is not None:
+                callback(estimator.indices(), estimator.n)
+        return dict(estimator.indices(), n=estimator.n, factors=self.names, outputs=self.outputs)
+
+
+def _evaluate(design):
+    analysis, kernel = worker()
+    values = analysis.evaluate(design.reshape(-1, design.shape[2]), kernel)
+    return values.reshape(design.shape[:2] + (-1,))
@@ -0,0 +1,365 @@
+__author__ = 'N. Avisse'
+__email__ = 'nicolas.avisse@gmail.com'
+
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import queue as queues
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from pynsim import Engine
+
+from engines.kernel import Kernel
+from tools.ensemble import key_outputs, restore_constants, parametrized_classes, _defaults, _build
+from tools.model import load_inputs, build_simulator
+from tools.pool import executor, init_worker, worker
+from tools.scenarios import SetAttribute, Efficiency, Rehabilitation, DemandCut, schedule
+
+# interventions of a scenario request, by type (arguments of the classes given in the request)
+intervention_types = dict((c.__name__, c) for c in [SetAttribute, Efficiency, Rehabilitation, DemandCut])
+# institutions bound by the treaty quantities of a request (e.g. 'allocation', 'concession') [hm3/month]
+treaty_classes = ['JVA', 'Israel']
+
+reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+# specs of the networks built in a worker process (tools.pool.worker: inputs)
+_specs = dict()
+
+
+class ResultsStream(Engine):
+    """
+    Engine sending the outputs of each timestep to a queue (multiprocessing manager queue of the service)
+    To be added after the other engines of the simulator
+    """
+    name = "Results stream"
+
+    def __init__(self, target, outputs, queue, **kwargs):
+        super(ResultsStream, self).__init__(target, **kwargs)
+        # target = network
+        self.slots = [(target.get_node(a) or target.get_institution(a), p) for a, p in outputs]
+        self.queue = queue
+
+    def run(self):
+        self.queue.put((self.timestep, [_number(getattr(agent, p)) for agent, p in self.slots]))
+
+
+def _number(value):
+    """
+    JSON value of an output: None for the missing values and NaN
+    """
+    if value is None:
+        return None
+    value = float(value)
+    return None if math.isnan(value) or math.isinf(value) else value
+
+
+def scenario(request, T):
+    """
+    Checks a scenario request (dict read from JSON) and returns the job of the workers:
+    - parameters: parameters of tools.ensemble.simulate ('Class.constant', 'agent/attribute', 'irr_def',
+      'evaporation')
+    - treaty: dict name -> 12 monthly quantities set for JVA and Israel, e.g. {'allocation': [...]} [hm3]
+    - interventions: list of {'type', 'timestep' or 'year' (+ 'month', 1 by default), arguments of the class},
+      e.g. {'type': 'Rehabilitation', 'year': 2018, 'month': 4}
+    - outputs: list of [agent, property] (tools.ensemble.key_outputs by default)
+    - months: number of months simulated (all by default), backend: 'pynsim' or 'kernel' (no interventions)
+    Raises ValueError if the request is not valid
+    """
+    if not isinstance(request, dict):
+        raise ValueError("A scenario is a JSON object")
+    unknown = set(request) - {'parameters', 'treaty', 'interventions', 'outputs', 'months', 'backend', 'stream'}
+    if len(unknown) > 0:
+        raise ValueError("Unknown keys %s" % sorted(unknown))
+    parameters = dict(request.get('parameters', dict()))
+    for key in parameters:
+        if '.' in key and '/' not in key and key.split('.', 1)[1] not in _defaults.get(key.split('.')[0], []):
+            raise ValueError("Unknown class constant %s" % key)
+    for name, quantities in request.get('treaty', dict()).items():
+        if not isinstance(quantities, list) or len(quantities) != 12:
+            raise ValueError("Treaty quantity %s: 12 monthly values expected" % name)
+        for cls in treaty_classes:
+            if not hasattr(parametrized_classes[cls], name):
+                raise ValueError("Unknown treaty quantity %s of %s" % (name, cls))
+            parameters['%s.%s' % (cls, name)] = [float(q) for q in quantities]
+
+    interventions = []
+    for item in request.get('interventions', []):
+        item = dict(item)
+        cls = intervention_types.get(item.pop('type', None))
+        if cls is None:
+            raise ValueError("Intervention type expected among %s" % sorted(intervention_types))
+        if 'timestep' in item:
+            timestep = int(item.pop('timestep'))
+        elif 'year' in item:
+            timestep = (int(item.pop('year')) - 1983) * 12 + int(item.pop('month', 1)) - 1
+        else:
+            raise ValueError("Timestep or year of the intervention %s expected" % cls.__name__)
+        if not 0 <= timestep < T:
+            raise ValueError("Intervention %s at month %s outside the simulation" % (cls.__name__, timestep))
+        try:
+            interventions.append((timestep, cls(**item)))
+        except TypeError as e:
+            raise ValueError("Intervention %s: %s" % (cls.__name__, e))
+
+    outputs = [tuple(o) for o in request.get('outputs', key_outputs)]
+    if any(len(o) != 2 for o in outputs):
+        raise ValueError("Outputs are [agent, property] pairs")
+    months = int(request.get('months', T))
+    if not 0 < months <= T:
+        raise ValueError("Months between 1 and %s expected" % T)
+    backend = request.get('backend', 'pynsim')
+    if backend not in ('pynsim', 'kernel'):
+        raise ValueError("Unknown backend %s" % backend)
+    if backend == 'kernel' and len(interventions) > 0:
+        raise ValueError("Interventions are only applied by the pynsim backend")
+    return parameters, interventions, outputs, months, backend
+
+
+def _warm(arguments):
+    """
+    Spec of the network built in a worker before the first request
+    Returns the properties of each agent of the network: dict name -> list
+    """
+    inputs, _ = worker()
+    restore_constants()
+    try:
+        network = _build(inputs, arguments, _specs)
+    finally:
+        restore_constants()
+    return dict((agent.name, sorted(agent.get_properties())) for agent in network.nodes + network.institutions)
+
+
+def _run_scenario(job, queue=None):
+    """
+    Runs a scenario in a worker, the outputs of each timestep sent to the queue if given (None at the end)
+    Returns a dict (agent, property) -> list [timestep]
+    """
+    parameters, interventions, outputs, T, backend = job
+    inputs, _ = worker()
+    restore_constants()
+    try:
+        network = _build(inputs, parameters, _specs)
+        for name in set(a for a, p in outputs):
+            if network.get_node(name) is None and network.get_institution(name) is None:
+                raise KeyError("Unknown agent %s" % name)
+        if backend == 'kernel':
+            values = _outputs(Kernel(network).results(range(T)), outputs)
+            if queue is not None:
+                for t in range(T):
+                    queue.put((t, [values[key][t] for key in outputs]))
+            return values
+        schedule(network, interventions)
+        agents = [network.get_node(a) or network.get_institution(a) for a in set(a for a, p in outputs)]
+        s, sink = build_simulator(network, T, agents=agents, properties=list(set(p for a, p in outputs)))
+        if queue is not None:
+            s.add_engine(ResultsStream(target=network, outputs=outputs, queue=queue))
+        s.start()
+    finally:
+        restore_constants()
+        if queue is not None:
+            queue.put(None)
+    return _outputs(sink.as_dict(), outputs)
+
+
+def _outputs(results, outputs):
+    """
+    Outputs of results (layout of ResultsSink.as_dict) as JSON lists: dict (agent, property) -> list [timestep]
+    """
+    agent_names = list(results['agents'])
+    properties = list(results['properties'])
+    return dict(((a, p), [_number(v) for v in results['values'][:, agent_names.index(a), properties.index(p)]])
+                for a, p in outputs)
+
+
+class SimulationService(object):
+    """
+    Local HTTP/JSON service running scenarios on a warm pool of worker processes
+    The inputs are read once and sent once to each worker, which keeps the spec of the network (built per run in
+    a few ms, the runs modifying the components)
+    GET /status: months, outputs and parameters
+    POST /run: scenario (see scenario), results as one JSON object {'timesteps', 'outputs': {'agent/property'}},
+    or, with 'stream': true, one JSON line per timestep {'timestep', 'values'} then {'done': true} (or {'error'})
+    max_workers=0 runs the scenarios one at a time in a thread of the service (the runs modify the class constants)
+    """
+
+    def __init__(self, inputs, max_workers=None, irr_def=0.4):
+        self.inputs = inputs
+        self.T = len(inputs['flows'])
+        self.irr_def = irr_def
+        self.max_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+        self.pool = None
+        self.manager = None
+        self.agents = None  # properties of the agents of the warm network
+
+    def __repr__(self):
+        return "%s(months=%s, workers=%s)" % (self.__class__.__name__, self.T, self.max_workers)
+
+    def start(self):
+        """
+        Starts the workers and builds the spec of the default network in each of them
+        """
+        warm = {'irr_def': self.irr_def}
+        if self.max_workers == 0:
+            init_worker(self.inputs)
+            self.agents = _warm(warm)
+            self.pool = ThreadPoolExecutor(max_workers=1)
+            return
+        self.pool = executor(self.inputs, self.max_workers)
+        self.manager = multiprocessing.Manager()
+        self.agents = list(self.pool.map(_warm, [warm] * self.max_workers))[0]
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.manager is not None:
+            self.manager.shutdown()
+            self.manager = None
+
+    def job(self, request):
+        """
+        Job of a scenario request (see scenario), its agents checked against the warm network
+        Raises ValueError if the request is not valid
+        """
+        job = scenario(request, self.T)
+        job[0].setdefault('irr_def', self.irr_def)
+        if self.agents is not None:
+            for key in job[0]:
+                if '/' in key and key.split('/', 1)[0] not in self.agents:
+                    raise ValueError("Unknown agent %s" % key.split('/', 1)[0])
+            for a, p in job[2]:
+                if a not in self.agents:
+                    raise ValueError("Unknown agent %s" % a)
+                if p not in self.agents[a]:
+                    raise ValueError("Unknown property %s of %s" % (p, a))
+        return job
+
+    def status(self):
+        return {'months': self.T, 'workers': self.max_workers, 'backends': ['pynsim', 'kernel'],
+                'outputs': ['%s/%s' % o for o in key_outputs], 'interventions': sorted(intervention_types),
+                'parameters': sorted('%s.%s' % (cls, k) for cls in _defaults for k in _defaults[cls])}
+
+    async def run(self, job):
+        """
+        Results of a scenario: dict (agent, property) -> list [timestep]
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.pool, _run_scenario, job)
+
+    async def stream(self, job):
+        """
+        Outputs of a scenario as they are simulated: (timestep, values) for each timestep
+        Raises the error of the run after the last timestep simulated (or if its worker stopped)
+        """
+        loop = asyncio.get_running_loop()
+        queue = queues.Queue() if self.manager is None else self.manager.Queue()
+        future = loop.run_in_executor(self.pool, _run_scenario, job, queue)
+        while True:
+            try:
+                item = await loop.run_in_executor(None, queue.get, True, 1.)
+            except queues.Empty:
+                if future.done():
+                    break
+                continue
+            if item is None:
+                break
+            yield item
+        await future
+
+    async def handle(self, reader, writer):
+        """
+        One HTTP/1.1 request per connection
+        """
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = dict()
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if line == '':
+                    break
+                key, _, value = line.partition(':')
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            if len(request_line) < 2:
+                await self.respond(writer, 400, {'error': 'Invalid request line'})
+            elif request_line[1] == '/status':
+                await self.respond(writer, 200, self.status())
+            elif request_line[1] != '/run':
+                await self.respond(writer, 404, {'error': 'Unknown path %s' % request_line[1]})
+            elif request_line[0] != 'POST':
+                await self.respond(writer, 405, {'error': 'POST a scenario to /run'})
+            else:
+                await self.run_request(writer, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def run_request(self, writer, body):
+        try:
+            request = json.loads(body.decode('utf-8') or '{}')
+            job = self.job(request)
+        except (TypeError, ValueError) as e:
+            await self.respond(writer, 400, {'error': str(e)})
+            return
+        outputs = ['%s/%s' % key for key in job[2]]
+        if not request.get('stream', False):
+            try:
+                results = await self.run(job)
+            except Exception as e:
+                await self.respond(writer, 500, {'error': '%s: %s' % (e.__class__.__name__, e)})
+                return
+            await self.respond(writer, 200, {'timesteps': list(range(job[3])),
+                                             'outputs': dict(('%s/%s' % key, values)
+                                                             for key, values in results.items())})
+            return
+        # chunked NDJSON, errors of the run sent as the last line
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n'
+                     b'Connection: close\r\n\r\n')
+        try:
+            async for timestep, values in self.stream(job):
+                await self.write_chunk(writer, {'timestep': timestep, 'values': dict(zip(outputs, values))})
+            await self.write_chunk(writer, {'done': True})
+        except Exception as e:
+            await self.write_chunk(writer, {'error': '%s: %s' % (e.__class__.__name__, e)})
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    @staticmethod
+    async def write_chunk(writer, content):
+        line = (json.dumps(content) + '\n').encode('utf-8')
+        writer.write(b'%x\r\n%s\r\n' % (len(line), line))
+        await writer.drain()
+
+    @staticmethod
+    async def respond(writer, code, content):
+        body = json.dumps(content).encode('utf-8')
+        writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n'
+                     b'Connection: close\r\n\r\n' % (code, reasons[code].encode('latin-1'), len(body)))
+        writer.write(body)
+        await writer.drain()
+
+    async def serve(self, host='127.0.0.1', port=8050):
+        """
+        Serves the requests until cancelled, the workers started first
+        """
+        self.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.stop()
+
+
+if __name__ == '__main__':
+    # python -m tools.service [port]: inputs of syria_main_simu.py (test_future=1)
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8050
+    service = SimulationService(load_inputs())
+    print('%s on http://127.0.0.1:%d' % (service, port))
+    try:
+        asyncio.run(service.serve(port=port))
+    except KeyboardInterrupt:
+        pass